@@ -18,27 +18,65 @@
 #   - Alerta visual al superar 80% / 100% del presupuesto
 #   - Racha corregida: días CON gasto consecutivos (gastos hormiga)
 #   - Teclado numérico en monto al abrir formulario (inputmode)
+# Mejoras v3.2:
+#   - Caché stale-while-revalidate: Sheets se refresca en segundo plano
+#   - Motor de rachas precalculado (racha actual O(1), récord e historial)
+#   - Almacén local SQLite indexado; Sheets se sincroniza en segundo plano
+#   - Multiusuario: una hoja por usuario autenticado, cachés LRU por tenant
+#   - Rolling 7/30 días, comparativos mes/año y proyección por días del mes
+#   - Capa de datos sin Streamlit (gastos.py) y CLI (cli.py)
+#   - Fragmentos: ordenar, vista de gráfico y selector de mes sin rerun completo
+#   - Memo por sesión de vistas derivadas (mes, orden, búsqueda, versión)
+#   - Tema, fuentes y script inputmode como estáticos cacheables (static/)
+#   - Altas, bajas y presupuestos parchan la caché en sitio (sin recarga)
+#   - Ingesta columnar sin formato, fechas dd/mm/aaaa rápidas y reporte de descartes
+#   - Hojas por año (Gastos_AAAA): años cerrados congelados, descarga en paralelo
+#   - Rangos libres (últimos N días, trimestre, personalizado) con índice por fecha
+#   - Reporte anual: una lámina por mes (PNG en zip), dibujadas en paralelo
+#   - Aviso en el preview si el monto es inusual para su categoría (sketches)
+#   - Ledger compartido por proceso: meses como vistas copy-on-write, sin copias
+#   - Cadenas Arrow en todo el ledger: búsqueda y export CSV vectorizados
+#   - Meses vecinos armados en segundo plano: ‹ › encuentran todo listo
+#   - Métricas Prometheus: llamadas y latencia de Sheets, cachés y reruns
+#   - Prueba de carga: N sesiones websocket contra Sheets en memoria (cli.py loadtest)
+#   - "Este año": mapa de presupuesto vs real por mes y categoría (80% / 100%)
+#   - Doble toque al guardar: token por preview y aviso de duplicado reciente
+#   - Primera carga: ledger y presupuestos en un solo values_batch_get
+#   - Editar un gasto (✏️): mismo ID; se confirma la celda ID y un batch_update escribe lo que cambia
+#   - Detalle por categoría: solo la categoría abierta renderiza sus movimientos
 # ============================================================
 
 import streamlit as st
 import datetime as dt
-import gspread
-from google.oauth2.service_account import Credentials
 import pandas as pd
-import os
+import traceback
+import hashlib
 import json
-import pathlib
 import uuid
-import io
-from dotenv import load_dotenv
-import traceback
+from collections import OrderedDict
+from pathlib import Path
 import matplotlib.pyplot as plt
 
+import gastos
+import metrics
+import reports
+from gastos import (
+    MESES_ORD, DIAS_ORD, TZ_OFFSET, VALID_CATS, ICON_MAP, COLORS_MAP, FONTS_CSS_URL,
+    Tenant, DEFAULT_TENANT, get_tenants, current_tenant, use_tenant,
+    load_data, load_budgets, save_to_sheet, recent_duplicate, delete_from_sheet, update_expense, save_budget,
+    SAVE_IN_FLIGHT, load_columns, ANALYTICS_COLS,
+    get_backend, now_peru,
+    RANGE_PRESETS, range_preset, range_stats,
+    BUDGET_WARN_PCT, BUDGET_OVER_PCT, budget_level, get_budget_matrix,
+    get_month, prefetch_months, adjacent_months,
+    days_with_expense_streak, get_streak_index, get_category_stats, export_csv,
+)
+
 # ============================================================
 # 1) CONFIG
 # ============================================================
 st.set_page_config(
-    page_title="Gastos · Andrés",
+    page_title="Gastos",   # con el nombre del usuario en cuanto se resuelve el tenant
     page_icon="💸",
     layout="centered",
     initial_sidebar_state="collapsed",
@@ -58,24 +96,10 @@ st.markdown("""
 </head>
 """, unsafe_allow_html=True)
 
-env_path = pathlib.Path(".") / ".env"
-if not env_path.exists():
-    env_path = pathlib.Path(".") / ".env.local"
-load_dotenv(dotenv_path=env_path)
-
-SHEET_NAME = "Gastos_Diarios"
 
 # ============================================================
 # 2) CONSTANTES
 # ============================================================
-MESES_ORD = [
-    "Enero","Febrero","Marzo","Abril","Mayo","Junio",
-    "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre",
-]
-DIAS_ORD = ["LUNES","MARTES","MIÉRCOLES","JUEVES","VIERNES","SÁBADO","DOMINGO"]
-
-TZ_OFFSET = dt.timezone(dt.timedelta(hours=-5))  # Perú UTC-5
-
 THEME = {
     "bg":      "#000000",
     "surface": "#0F0F10",
@@ -88,28 +112,13 @@ THEME = {
     "danger":  "#FF4B4B",
     "warning": "#FFC700",
 }
+LEVEL_COLOR = {"ok": THEME["primary"], "warn": THEME["warning"], "over": THEME["danger"], "": THEME["muted"]}
+HEAT_CATS   = 5   # columnas de categoría en el mapa del año; el resto va junto
 
-CATEGORIES = {
-    "Alimentación":      ("🍽️", "#00E054"),
-    "Transporte":        ("🚗", "#00F0FF"),
-    "Salud":             ("💊", "#FFC700"),
-    "Trabajo":           ("💼", "#FF4B4B"),
-    "Ocio":              ("🎵", "#FFFFFF"),
-    "Casa":              ("🏠", "#A259FF"),
-    "Inversión":         ("📈", "#4A90E2"),
-    "Pareja":            ("❤️", "#FF69B4"),
-    "Estudios":          ("📚", "#F5A623"),
-    "Viaje":             ("✈️", "#50E3C2"),
-    "Frutas":            ("🍎", "#7ED321"),
-    "Golosinas":         ("🍬", "#FF8AD8"),
-    "Compras Generales": ("🛒", "#B8E986"),
-    "Otros":             ("📦", "#888888"),
-}
+# Registrar de nuevo en cada rerun devuelve la misma métrica
+RERUN_SECONDS = metrics.histogram("gastos_rerun_seconds", "Duración de cada rerun completo, por vista", ("view",))
+FATAL_ERRORS  = metrics.counter("gastos_fatal_errors_total", "Reruns que terminaron en 'Error fatal en la app'")
 
-VALID_CATS  = list(CATEGORIES.keys())
-ICON_MAP    = {k: v[0] for k, v in CATEGORIES.items()}
-COLORS_MAP  = {k: v[1] for k, v in CATEGORIES.items()}
-CAT_ALIASES = {"Comida": "Alimentación", "comida": "Alimentación"}
 
 # ============================================================
 # 3) SESSION STATE
@@ -124,6 +133,7 @@ _DEFAULTS = {
     "sel_month":      MESES_ORD[_now.month - 1],
     "search_query":   "",
     "confirm_delete": None,   # ID del gasto a borrar
+    "editing":        None,   # gasto que se corrige: valores con que abre el formulario
     "budget_mode":    False,
     "presupuesto":    {},
     "sort_by":        "fecha",
@@ -131,637 +141,188 @@ _DEFAULTS = {
     "show_success":   False,
     "preview_data":   None,
     "data_loaded":    False,
-    "show_picker":     False,
+    "show_picker":    False,
+    "picker_year":    _now.year,
+    "period":         "mes",      # "mes" | clave de RANGE_PRESETS | "custom"
+    "range_custom":   range_preset("30d", _now.date()),
+    "report_zip":     None,       # ((año, versión), bytes) del último reporte
 }
 for k, v in _DEFAULTS.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
 # ============================================================
-# 4) CSS
+# 4) CSS Y ESTÁTICOS
 # ============================================================
-def inject_css():
-    primary = THEME["primary"]
-    # CSS base — no f-string para evitar conflictos con llaves CSS
-    css = """
-@import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800;900&family=JetBrains+Mono:wght@500;700&display=swap');
-
-html, body, [class*="css"] {
-  font-family: 'Inter', -apple-system, sans-serif !important;
-  color: #e0e0e0 !important;
-  -webkit-font-smoothing: antialiased !important;
-}
-html, body { background: #040404 !important; overflow-x: hidden !important; }
-.stApp { background: #040404 !important; }
-.block-container {
-  max-width: 800px !important;
-  padding: max(20px, env(safe-area-inset-top)) 18px max(100px, env(safe-area-inset-bottom)) 18px !important;
-}
-#MainMenu, header, footer,
-div[data-testid="stToolbar"],
-div[data-testid="stDecoration"],
-div[data-testid="stStatusWidget"] {
-  display: none !important; visibility: hidden !important; height: 0 !important;
-}
-button {
-  font-family: 'Inter', sans-serif !important;
-  border-radius: 13px !important;
-  letter-spacing: -.1px !important;
-  transition: all .14s cubic-bezier(.4,0,.2,1) !important;
-}
-button[kind="primary"] {
-  background: #00E054 !important; color: #000 !important; border: none !important;
-  font-weight: 700 !important; font-size: .92rem !important; height: 50px !important;
-}
-button[kind="primary"]:hover {
-  filter: brightness(1.08) !important;
-  box-shadow: 0 6px 22px rgba(0,224,84,.25) !important;
-  transform: translateY(-1px) !important;
-}
-button[kind="primary"]:active  { transform: scale(.97) !important; }
-button[kind="primary"]:disabled { background: #141414 !important; color: #2a2a2a !important; }
-button[kind="secondary"] {
-  background: #0c0c0c !important; border: 1px solid #1a1a1a !important;
-  color: #555 !important; font-weight: 600 !important;
-  height: 42px !important; font-size: .82rem !important;
-}
-button[kind="secondary"]:hover {
-  background: #111 !important; border-color: #242424 !important; color: #aaa !important;
-}
-div[data-baseweb="select"] > div {
-  background: #0c0c0c !important; border: 1px solid #1a1a1a !important; border-radius: 12px !important;
-}
-div[data-baseweb="menu"], div[data-baseweb="popover"],
-ul[data-testid="stSelectboxVirtualDropdown"] {
-  background: #0e0e0e !important; border: 1px solid #1a1a1a !important; border-radius: 12px !important;
-}
-li[role="option"] { color: #999 !important; font-size: .88rem !important; }
-li[role="option"][aria-selected="true"] { background: #141414 !important; color: #00E054 !important; }
-input[type="text"], div[data-testid="stTextInput"] input {
-  background: #0c0c0c !important; border: 1px solid #1a1a1a !important;
-  border-radius: 12px !important; color: #ddd !important;
-  padding: 13px 16px !important; font-size: .88rem !important;
-  font-family: 'Inter', sans-serif !important;
-  transition: border-color .15s ease, box-shadow .15s ease !important;
-}
-input[type="text"]:focus, div[data-testid="stTextInput"] input:focus {
-  border-color: rgba(0,224,84,.3) !important;
-  box-shadow: 0 0 0 3px rgba(0,224,84,.06) !important;
-  outline: none !important;
-}
-input[type="text"]::placeholder,
-div[data-testid="stTextInput"] input::placeholder { color: #252525 !important; }
-/* Monto input — grande y centrado */
-div[data-testid="stTextInput"]:has([placeholder="0.00"]) input {
-  font-size: clamp(2.2rem, 8vw, 3.5rem) !important;
-  font-weight: 800 !important;
-  font-family: 'JetBrains Mono', monospace !important;
-  text-align: center !important;
-  letter-spacing: -1.5px !important;
-  color: #f0f0f0 !important;
-  border-radius: 18px !important;
-  padding: 20px 16px !important;
-  caret-color: #00E054 !important;
-}
-div[data-testid="stNumberInput"] {
-  background: transparent !important; border: none !important;
-  width: 100% !important;
-}
-div[data-testid="stNumberInput"] > div {
-  background: transparent !important; border: none !important;
-  width: 100% !important; gap: 0 !important;
-}
-div[data-testid="stNumberInput"] input {
-  background: transparent !important; border: none !important;
-  color: #fff !important;
-  font-size: clamp(2.8rem, 11vw, 4.5rem) !important;
-  font-weight: 800 !important;
-  font-family: 'JetBrains Mono', monospace !important;
-  text-align: center !important; padding: 4px 0 !important;
-  caret-color: #00E054 !important; letter-spacing: -2px !important;
-  box-shadow: none !important; width: 100% !important;
-  -webkit-appearance: none !important;
-}
-div[data-testid="stNumberInput"] input:focus {
-  border: none !important; box-shadow: none !important; outline: none !important;
-  background: transparent !important;
-}
-/* Ocultar flechas +/- del number input */
-div[data-testid="stNumberInput"] button,
-div[data-testid="stNumberInput"] > div > div:last-child,
-div[data-testid="stNumberInput"] [data-testid="stNumberInputStepDown"],
-div[data-testid="stNumberInput"] [data-testid="stNumberInputStepUp"] {
-  display: none !important;
-}
-/* Fix fondo azul oscuro del contenedor Streamlit */
-div[data-testid="stNumberInput"] > div > div:first-child {
-  background: transparent !important; border: none !important; box-shadow: none !important;
-}
-div[role="radiogroup"] {
-  display: flex; flex-wrap: wrap; gap: 6px; justify-content: center;
-  width: 100% !important; margin: 0 auto !important;
-}
-/* Centrar el contenedor padre que Streamlit agrega */
-div[data-testid="stRadio"] > div {
-  display: flex !important;
-  justify-content: center !important;
-  width: 100% !important;
-}
-div[data-testid="stRadio"] {
-  width: 100% !important;
-}
-div[role="radiogroup"] label {
-  background: #0c0c0c !important; border: 1px solid #181818 !important;
-  border-radius: 11px !important; padding: 10px 15px !important;
-  cursor: pointer; transition: all .12s ease;
-  min-height: 44px !important; display: flex !important; align-items: center !important;
-}
-div[role="radiogroup"] label p {
-  color: #444 !important; font-weight: 600 !important; font-size: .83rem !important;
-  margin: 0 !important; font-family: 'Inter', sans-serif !important;
-  white-space: nowrap !important; transition: color .12s ease;
-}
-div[role="radiogroup"] label:hover { background: #111 !important; border-color: #222 !important; }
-div[role="radiogroup"] label:hover p { color: #aaa !important; }
-div[role="radiogroup"] label:has(input:checked) {
-  background: rgba(0,224,84,.08) !important; border-color: rgba(0,224,84,.25) !important;
-}
-div[role="radiogroup"] label:has(input:checked) p { color: #00E054 !important; font-weight: 700 !important; }
-div[role="radiogroup"] label > div:first-child { display: none; }
-@media (max-width: 599px) {
-  div[role="radiogroup"] {
-    display: grid !important;
-    grid-template-columns: 1fr 1fr !important;
-    gap: 6px !important;
-    width: 100% !important;
-    margin: 0 auto !important;
-    padding: 0 !important;
-  }
-  div[role="radiogroup"] label {
-    justify-content: center !important; text-align: center !important;
-    min-height: 48px !important; border-radius: 13px !important;
-    width: 100% !important;
-  }
-  div[role="radiogroup"] label p { font-size: .85rem !important; }
-  button[kind="secondary"] { height: 40px !important; font-size: .78rem !important; }
-  button[kind="primary"]   { height: 50px !important; }
-  .block-container { padding-left: 13px !important; padding-right: 13px !important; }
-  .card { border-radius: 19px !important; padding: 20px 16px 17px !important; }
-  .card-amount { letter-spacing: -2px !important; }
-  .mov-item { padding: 12px 12px !important; border-radius: 12px !important; }
-  .stat-pill { padding: 11px 11px 9px !important; border-radius: 13px !important; }
-  .amount-hero { border-radius: 17px !important; }
-}
-.badge {
-  display: inline-flex; align-items: center; gap: 7px; padding: 5px 11px 5px 8px;
-  border-radius: 999px; background: #080808; border: 1px solid #161616;
-  color: #2a2a2a !important; font-weight: 600; font-size: .68rem;
-  letter-spacing: 1.8px; text-transform: uppercase;
-}
-.badge-dot {
-  width: 5px; height: 5px; border-radius: 50%; background: #00E054;
-  box-shadow: 0 0 6px #00E054; flex-shrink: 0;
-}
-.greeting {
-  font-size: clamp(1.65rem, 5vw, 2rem); font-weight: 800; line-height: 1.2;
-  color: #e8e8e8; margin: 8px 0 14px; letter-spacing: -.5px;
-}
-.card {
-  background: #0c0c0c !important; border: 1px solid #151515 !important;
-  border-radius: 22px !important; padding: 26px 22px 22px !important;
-  position: relative; overflow: hidden; margin-top: 6px;
-  display: flex !important; flex-direction: column !important; align-items: center !important;
-}
-.card::before {
-  content: ''; position: absolute; top: 0; left: 50%; transform: translateX(-50%);
-  width: 40%; height: 1px;
-  background: linear-gradient(90deg, transparent, rgba(0,224,84,.18), transparent);
-}
-.card::after {
-  content: ''; position: absolute; top: 35%; left: 50%; transform: translate(-50%,-50%);
-  width: 55%; height: 70px;
-  background: radial-gradient(ellipse, rgba(0,224,84,.035) 0%, transparent 70%);
-  pointer-events: none;
-}
-.card-title {
-  color: #242424 !important; font-size: .65rem !important; letter-spacing: 3px !important;
-  text-transform: uppercase !important; margin-bottom: 8px !important; font-weight: 600 !important;
-}
-.card-amount-wrap { display: flex; align-items: baseline; gap: 5px; position: relative; z-index: 1; }
-.card-currency {
-  font-size: clamp(1rem, 2.5vw, 1.3rem); font-weight: 600; color: #252525;
-  font-family: 'JetBrains Mono', monospace;
-}
-.card-amount {
-  font-size: clamp(2.6rem, 9vw, 3.8rem) !important; font-weight: 800 !important;
-  color: #f0f0f0 !important; font-family: 'JetBrains Mono', monospace !important;
-  letter-spacing: -2.5px !important; line-height: 1 !important;
-}
-.card-sub {
-  color: #222 !important; font-size: .72rem !important;
-  font-weight: 500 !important; margin-top: 10px !important;
-}
-.card-sub span { color: #2d6644; font-weight: 600; }
-.budget-wrap { margin-top: 10px; padding: 0 2px; }
-.budget-bar-bg { width: 100%; height: 3px; background: #141414; border-radius: 99px; overflow: hidden; }
-.budget-bar-fill { height: 100%; border-radius: 99px; transition: width .8s cubic-bezier(.4,0,.2,1); }
-.budget-meta { display: flex; justify-content: space-between; margin-top: 6px; }
-.budget-spent  { color: #242424; font-size: .7rem; font-weight: 500; }
-.budget-remain { font-size: .7rem; font-weight: 600; }
-.budget-alert {
-  border-radius: 11px; padding: 10px 13px; margin-top: 9px;
-  font-weight: 600; font-size: .8rem; display: flex; align-items: center; gap: 8px;
-  animation: fadeUp .25s ease forwards;
-}
-.budget-alert.warn   { background: rgba(200,140,0,.06); border: 1px solid rgba(200,140,0,.14); color: #8a6500; }
-.budget-alert.danger { background: rgba(200,50,50,.06);  border: 1px solid rgba(200,50,50,.16);  color: #903030; }
-.stat-row { display: grid; grid-template-columns: 1fr 1fr; gap: 6px; margin-top: 8px; }
-@media (min-width: 600px) { .stat-row { grid-template-columns: repeat(4, 1fr); } }
-.stat-pill {
-  background: #080808; border: 1px solid #141414; border-radius: 15px;
-  padding: 13px 13px 11px; display: flex; flex-direction: column; gap: 6px;
-}
-.stat-label { color: #222; font-size: .63rem; font-weight: 600; letter-spacing: 2px; text-transform: uppercase; }
-.stat-value { color: #b0b0b0; font-size: 1rem; font-weight: 700; font-family: 'JetBrains Mono', monospace; letter-spacing: -.4px; }
-.stat-value.streak { color: #00E054; font-size: 1.1rem; }
-.month-nav { display: flex; align-items: center; justify-content: center; padding: 4px 0 0; }
-.month-nav-label { font-size: .98rem; font-weight: 700; color: #bbb; text-align: center; }
-.month-label     { font-size: .98rem; font-weight: 700; color: #bbb; text-align: center; }
-.section-title {
-  color: #1e1e1e !important; font-weight: 600; font-size: .63rem;
-  letter-spacing: 3px; margin-top: 20px; margin-bottom: 8px; text-transform: uppercase;
-}
-div[data-testid="stExpander"] {
-  background: #0c0c0c !important; border: 1px solid #151515 !important;
-  border-radius: 17px !important; overflow: hidden; margin-bottom: 5px !important;
-}
-div[data-testid="stExpander"]:hover { border-color: #1e1e1e !important; }
-div[data-testid="stExpander"] details { background: #0c0c0c !important; }
-div[data-testid="stExpander"] summary {
-  padding: 15px 17px !important; background: #0c0c0c !important; min-height: 52px !important;
-}
-div[data-testid="stExpander"] summary:hover { background: #0f0f0f !important; }
-div[data-testid="stExpander"] summary p { font-weight: 700 !important; font-size: .88rem !important; color: #aaa !important; }
-div[data-testid="stExpander"] summary svg { width: 17px !important; height: 17px !important; color: #2a2a2a !important; }
-.mov-item {
-  background: #0c0c0c; border: 1px solid #151515; border-radius: 13px;
-  padding: 13px 15px; margin-bottom: 4px;
-  display: flex; justify-content: space-between; align-items: center;
-  transition: border-color .12s ease;
-}
-.mov-item:hover { border-color: #1e1e1e; }
-.mov-left { display: flex; flex-direction: column; gap: 2px; min-width: 0; flex: 1; }
-.mov-cat  { font-weight: 600; font-size: .88rem; color: #bbb; }
-.mov-desc { color: #242424; font-size: .75rem; font-weight: 500; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; max-width: 380px; }
-.mov-right { display: flex; flex-direction: column; align-items: flex-end; gap: 2px; }
-.mov-amt  { font-weight: 700; color: #00E054; white-space: nowrap; font-family: 'JetBrains Mono', monospace; font-size: .86rem; letter-spacing: -.3px; }
-.mov-date { font-size: .66rem; color: #202020; font-weight: 500; }
-.legend-row { display: flex; align-items: center; justify-content: space-between; padding: 8px 0; border-bottom: 1px solid #0f0f0f; }
-.legend-row:last-child { border-bottom: none; }
-.legend-left { display: flex; align-items: center; gap: 8px; }
-.legend-dot  { width: 6px; height: 6px; border-radius: 50%; flex-shrink: 0; }
-.legend-name { color: #777; font-weight: 600; font-size: .82rem; }
-.legend-pct  { color: #2e2e2e; font-weight: 600; font-size: .8rem; font-family: 'JetBrains Mono', monospace; }
-.rich-card   { padding-bottom: 12px; margin-bottom: 12px; border-bottom: 1px solid #101010; }
-.rich-header { display: flex; justify-content: space-between; align-items: flex-start; margin-bottom: 7px; }
-.rich-left   { display: flex; flex-direction: column; gap: 3px; }
-.rich-right  { display: flex; flex-direction: column; align-items: flex-end; gap: 2px; }
-.rich-cat    { font-size: .88rem; font-weight: 700; color: #aaa; }
-.rich-sub    { font-size: .65rem; font-weight: 600; color: #252525; text-transform: uppercase; letter-spacing: 1px; }
-.rich-amt    { font-size: 1rem; font-weight: 700; color: #ccc; font-family: 'JetBrains Mono', monospace; letter-spacing: -.5px; }
-.rich-pct    { font-size: .75rem; font-weight: 700; }
-.rich-bar-bg  { width: 100%; height: 3px; background: #111; border-radius: 99px; margin-top: 7px; overflow: hidden; }
-.rich-bar-fill { height: 100%; border-radius: 99px; opacity: .65; }
-.amount-hero {
-  background: #0c0c0c; border: 1px solid #151515; border-radius: 20px;
-  padding: 22px 20px 16px; text-align: center; position: relative; overflow: hidden;
-}
-.amount-hero::before {
-  content: ''; position: absolute; bottom: 0; left: 50%; transform: translateX(-50%);
-  width: 35%; height: 1px;
-  background: linear-gradient(90deg, transparent, rgba(0,224,84,.12), transparent);
-}
-.amount-currency-label { font-size: .63rem; font-weight: 600; color: #242424; letter-spacing: 3px; text-transform: uppercase; }
-.amount-hint           { font-size: .7rem; color: #1e1e1e; font-weight: 500; margin-top: 4px; }
-.amount-hint.has-value { color: #1e4a2e; }
-.cat-section-label  { font-size: .63rem; font-weight: 600; color: #1e1e1e; letter-spacing: 3px; text-transform: uppercase; text-align: center; margin: 18px 0 9px; }
-.form-field-label   { font-size: .63rem; font-weight: 600; color: #1e1e1e; letter-spacing: 3px; text-transform: uppercase; text-align: center; margin: 16px 0 7px; }
-.preview-card { background: #0c0c0c; border: 1px solid #151515; border-radius: 18px; padding: 18px; margin: 14px 0; }
-.preview-amount-big { text-align: center; font-size: clamp(2.2rem, 7vw, 3rem); font-weight: 800; font-family: 'JetBrains Mono', monospace; letter-spacing: -2px; margin-bottom: 18px; line-height: 1; }
-.preview-row   { display: flex; justify-content: space-between; align-items: center; padding: 9px 0; border-bottom: 1px solid #101010; }
-.preview-row:last-child { border-bottom: none; }
-.preview-label { color: #242424; font-size: .65rem; font-weight: 600; text-transform: uppercase; letter-spacing: 1.8px; }
-.preview-value { color: #888; font-weight: 600; font-size: .86rem; }
-@keyframes fadeUp { from { opacity: 0; transform: translateY(6px); } to { opacity: 1; transform: translateY(0); } }
-.success-flash  { position: fixed; inset: 0; z-index: 9999; pointer-events: none; background: radial-gradient(ellipse at 50% 0%, rgba(0,224,84,.04) 0%, transparent 60%); animation: fadeUp .3s ease forwards; }
-.success-banner { background: #090e0b; border: 1px solid #121c14; border-radius: 14px; padding: 14px 16px; display: flex; align-items: center; gap: 12px; margin-bottom: 12px; animation: fadeUp .35s ease forwards; }
-.success-icon   { font-size: 1.6rem; }
-.success-title  { font-weight: 700; color: #00E054; font-size: .88rem; margin-bottom: 2px; }
-.success-sub    { font-size: .75rem; color: #162a1c; font-weight: 500; }
-@keyframes shimmer { 0% { background-position: -700px 0; } 100% { background-position: 700px 0; } }
-.skeleton      { background: linear-gradient(90deg, #0a0a0a 25%, #121212 50%, #0a0a0a 75%); background-size: 700px 100%; animation: shimmer 1.8s infinite linear; border-radius: 13px; }
-.skeleton-card { height: 148px; margin-bottom: 7px; border-radius: 22px; }
-.skeleton-pill { height: 70px; flex: 1; border-radius: 15px; }
-.skeleton-row  { height: 58px; margin-bottom: 4px; border-radius: 13px; }
-.sort-label    { color: #1e1e1e; font-size: .63rem; font-weight: 600; letter-spacing: 2px; text-transform: uppercase; padding-top: 10px; }
-div[data-testid="stToast"] { background: #0e0e0e !important; border: 1px solid #1a1a1a !important; color: #bbb !important; border-radius: 11px !important; box-shadow: 0 8px 28px rgba(0,0,0,.55) !important; }
-div[data-testid="stToast"] p, div[data-testid="stToast"] svg { color: #bbb !important; fill: #bbb !important; }
-.empty-state { text-align: center; padding: 60px 24px; }
-.empty-icon  { font-size: 2.8rem; margin-bottom: 12px; opacity: .35; }
-.empty-title { font-size: .95rem; font-weight: 700; color: #1e1e1e; margin-bottom: 5px; }
-.empty-sub   { font-size: .8rem; color: #161616; font-weight: 500; }
-"""
-    st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
+STATIC_DIR = Path(__file__).parent / "static"
+
+
+@st.cache_resource(show_spinner=False)
+def _content_hash(name: str, mtime: float) -> str:
+    return hashlib.sha1((STATIC_DIR / name).read_bytes()).hexdigest()[:10]
+
+
+def static_url(name: str) -> str:
+    """URL de app/static con hash de contenido: el navegador la cachea hasta que cambie."""
+    path = STATIC_DIR / name
+    return f"app/static/{name}?v={_content_hash(name, path.stat().st_mtime)}"
+
+
+def inject_assets():
+    """
+    Tema, fuentes y script de inputmode se sirven como estáticos.
+    En cada rerun solo viaja este loader (~500 B); el navegador añade
+    cada recurso al <head> una sola vez y lo reutiliza de caché.
+    """
+    fonts = static_url("fonts/fonts.css") if (STATIC_DIR / "fonts" / "fonts.css").exists() else FONTS_CSS_URL
+    assets = [("gastos-fonts", "link", fonts),
+              ("gastos-css", "link", static_url("gastos.css")),
+              ("gastos-js", "script", static_url("inputmode.js"))]
+    st.html(f"""<script>
+(function() {{
+  {json.dumps(assets)}.forEach(function(a) {{
+    var old = document.getElementById(a[0]);
+    if (old && old.dataset.src === a[2]) return;
+    var el = document.createElement(a[1]);
+    el.id = a[0]; el.dataset.src = a[2];
+    if (a[1] === "link") {{ el.rel = "stylesheet"; el.href = a[2]; }} else {{ el.src = a[2]; }}
+    if (old) old.replaceWith(el); else document.head.appendChild(el);
+  }});
+}})();
+</script>""", unsafe_allow_javascript=True)
 
 
 # ============================================================
-# 5) GOOGLE SHEETS
+# 5) SESIÓN Y NAVEGACIÓN
 # ============================================================
-@st.cache_resource
-def get_client():
-    try:
-        scope = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        info  = json.loads(st.secrets["GCP_SERVICE_ACCOUNT"])
-        creds = Credentials.from_service_account_info(info, scopes=scope)
-        return gspread.authorize(creds)
-    except Exception as e:
-        st.error("❌ Error conectando con Google Sheets")
-        st.exception(e)
-        return None
-
-
-def normalize_mes(m):
-    if not isinstance(m, str):
-        return None
-    return {k.lower(): k for k in MESES_ORD}.get(m.strip().lower(), m.strip().capitalize())
-
-
-def normalize_cat(c):
-    c = str(c).strip()
-    return CAT_ALIASES.get(c, c if c in VALID_CATS else "Otros")
-
-
-@st.cache_data(ttl=180, show_spinner=False)
-def load_data() -> pd.DataFrame:
-    client = get_client()
-    if not client:
-        return pd.DataFrame()
-    try:
-        sheet = client.open(SHEET_NAME).sheet1
-        df    = pd.DataFrame(sheet.get_all_records())
-        if df.empty:
-            return df
+def resolve_tenant() -> Tenant:
+    """Tenant del usuario de esta sesión; muestra el login si hace falta."""
+    tenants = get_tenants()
+    if not tenants:
+        return DEFAULT_TENANT
+    user = getattr(st, "user", None) or st.experimental_user
+    if not user.get("is_logged_in", False):
+        st.markdown('<div class="greeting">Gastos 💸</div>', unsafe_allow_html=True)
+        if st.button("Iniciar sesión", type="primary", use_container_width=True):
+            st.login()
+        st.stop()
+    tenant = tenants.get(str(user.get("email", "")).lower())
+    if tenant is None:
+        st.error("Tu cuenta no tiene una hoja de gastos asignada.")
+        if st.button("Cerrar sesión", type="secondary"):
+            st.logout()
+        st.stop()
+    return tenant
+
+
+def fmt_delta(pct: float) -> str:
+    return "—" if pd.isna(pct) else f"{'▲' if pct >= 0 else '▼'} {abs(pct) * 100:.0f}%"
 
-        cu = {c.strip().upper(): c for c in df.columns}
 
-        # FECHA
-        fcol = cu.get("FECHA")
-        df["FECHA"] = pd.to_datetime(df[fcol], errors="coerce", dayfirst=True) if fcol else pd.NaT
+def apply_sort(dfm: pd.DataFrame) -> pd.DataFrame:
+    col = "FECHA" if st.session_state.sort_by == "fecha" else "MONTO"
+    return dfm.sort_values(col, ascending=st.session_state.sort_asc)
 
-        # MES
-        df["MES"] = (
-            df[cu["MES"]].apply(normalize_mes) if "MES" in cu
-            else df["FECHA"].dt.month.map(lambda x: MESES_ORD[x-1] if pd.notna(x) else None)
-        )
 
-        # AÑO
-        df["AÑO"] = (
-            pd.to_numeric(df[cu["AÑO"]], errors="coerce").fillna(0).astype(int) if "AÑO" in cu
-            else df["FECHA"].dt.year.fillna(0).astype(int)
-        )
+VIEW_MEMO_SIZE = 32   # entradas por sesión (~6 por mes visitado)
 
-        # CATEGORÍA
-        ccat = cu.get("CATEGORÍA") or cu.get("CATEGORIA")
-        df["CATEGORÍA"] = df[ccat].apply(normalize_cat) if ccat else "Otros"
 
-        # DESCRIPCION
-        cdesc = cu.get("DESCRIPCION") or cu.get("DESCRIPCIÓN")
-        df["DESCRIPCION"] = df[cdesc].astype(str).str.strip() if cdesc else ""
+def view_memo(name: str, build, *key):
+    """
+    Memo por sesión de vistas derivadas (dfm, grp, orden, slices...).
+    La clave incluye la versión del ledger: cualquier escritura o sync
+    la invalida sin tener que limpiar nada a mano.
+    """
+    memo = st.session_state.setdefault("view_memo", OrderedDict())
+    k = (name, load_data.version) + key
+    if k in memo:
+        memo.move_to_end(k)
+        return memo[k]
+    value = memo[k] = build()
+    while len(memo) > VIEW_MEMO_SIZE:
+        memo.popitem(last=False)
+    return value
 
-        # MONTO
-        if "MONTO" in cu:
-            df["MONTO"] = pd.to_numeric(
-                df[cu["MONTO"]].astype(str).str.replace(",", "", regex=False),
-                errors="coerce",
-            ).fillna(0.0)
-        else:
-            df["MONTO"] = 0.0
 
-        # ID — columna clave para eliminar de forma segura
-        if "ID" in cu:
-            df["ID"] = df[cu["ID"]].astype(str).str.strip()
-        else:
-            # Gastos legacy sin ID: asignamos temporal (no se puede borrar de forma segura)
-            df["ID"] = [f"legacy_{i}" for i in range(len(df))]
+def sorted_view(dfm: pd.DataFrame, vkey: tuple) -> pd.DataFrame:
+    sort = (st.session_state.sort_by, st.session_state.sort_asc)
+    return view_memo("sorted", lambda: apply_sort(dfm), *vkey, *sort)
 
-        df = df[(df["AÑO"] > 0) & (df["MES"].notna()) & (df["MONTO"] > 0)]
-        return df.reset_index(drop=True)
-    except Exception:
-        return pd.DataFrame()
 
+def category_slices(dfm: pd.DataFrame, vkey: tuple) -> dict:
+    """Detalle por categoría ya ordenado: un solo groupby por vista."""
+    sort = (st.session_state.sort_by, st.session_state.sort_asc)
+    return view_memo("by_cat", lambda: dict(tuple(sorted_view(dfm, vkey).groupby("CATEGORÍA", sort=False))),
+                     *vkey, *sort)
 
-def save_to_sheet(data: dict) -> tuple[bool, str]:
-    client = get_client()
-    if not client:
-        return False, "Sin credenciales."
-    try:
-        sheet    = client.open(SHEET_NAME).sheet1
-        mes_name = MESES_ORD[data["date"].month - 1]
-        gasto_id = str(uuid.uuid4())[:8]
-
-        # Asegurar que existe la columna ID en el header
-        headers = sheet.row_values(1)
-        if "ID" not in headers:
-            sheet.update_cell(1, len(headers) + 1, "ID")
-
-        row = [
-            data["date"].strftime("%d/%m/%Y"),
-            mes_name,
-            int(data["date"].year),
-            data["category"],
-            data["description"],
-            float(data["amount"]),
-            gasto_id,
-        ]
-        sheet.append_row(row)
-        load_data.clear()
-        return True, gasto_id
-    except Exception as e:
-        return False, str(e)
-
-
-def delete_from_sheet(gasto_id: str) -> tuple[bool, str]:
-    """Busca la fila por ID único y la elimina. Nunca borra la fila equivocada."""
-    client = get_client()
-    if not client:
-        return False, "Sin credenciales."
-    try:
-        sheet   = client.open(SHEET_NAME).sheet1
-        values  = sheet.get_all_values()
-        headers = [h.strip().upper() for h in values[0]]
-        id_col  = next((i for i, h in enumerate(headers) if h == "ID"), None)
-
-        if id_col is None:
-            return False, "Columna ID no encontrada. Agrega la columna ID al Sheet."
-
-        row_to_delete = next(
-            (i + 2 for i, row in enumerate(values[1:])
-             if len(row) > id_col and str(row[id_col]).strip() == gasto_id),
-            None,
-        )
-        if row_to_delete is None:
-            return False, f"No se encontró el gasto con ID '{gasto_id}'."
 
-        sheet.delete_rows(row_to_delete)
-        load_data.clear()
-        return True, "OK"
-    except Exception as e:
-        return False, str(e)
+def prev_month():
+    idx = MESES_ORD.index(st.session_state.sel_month)
+    if idx == 0:
+        st.session_state.sel_month = MESES_ORD[11]
+        st.session_state.sel_year -= 1
+    else:
+        st.session_state.sel_month = MESES_ORD[idx - 1]
 
 
-# ============================================================
-# 5b) PRESUPUESTO PERSISTENTE (tab "Presupuesto" en el Sheet)
-# ============================================================
-BUDGET_SHEET = "Presupuesto"   # nombre de la segunda hoja
+def next_month():
+    idx = MESES_ORD.index(st.session_state.sel_month)
+    if idx == 11:
+        st.session_state.sel_month = MESES_ORD[0]
+        st.session_state.sel_year += 1
+    else:
+        st.session_state.sel_month = MESES_ORD[idx + 1]
 
 
-def _get_budget_sheet():
-    """Devuelve la hoja Presupuesto, creándola si no existe."""
-    client = get_client()
-    if not client:
-        return None
-    try:
-        ss = client.open(SHEET_NAME)
-        try:
-            return ss.worksheet(BUDGET_SHEET)
-        except Exception:
-            ws = ss.add_worksheet(title=BUDGET_SHEET, rows=50, cols=4)
-            ws.update("A1:D1", [["AÑO", "MES", "PRESUPUESTO", "UPDATED"]])
-            return ws
-    except Exception:
+def selected_range(today: dt.date):
+    """(desde, hasta) del periodo elegido; None = mes del navegador."""
+    period = st.session_state.period
+    if period == "mes":
         return None
+    if period == "custom":
+        return st.session_state.range_custom
+    return range_preset(period, today)
 
 
-@st.cache_data(ttl=300, show_spinner=False)
-def load_budgets() -> dict:
-    """Carga todos los presupuestos → {(año, mes): valor}."""
-    ws = _get_budget_sheet()
-    if not ws:
-        return {}
-    try:
-        rows = ws.get_all_records()
-        out  = {}
-        for r in rows:
-            try:
-                anio = int(r.get("AÑO", 0))
-                mes  = str(r.get("MES", "")).strip()
-                val  = float(r.get("PRESUPUESTO", 0))
-                if anio > 0 and mes and val > 0:
-                    out[(anio, mes)] = val
-            except Exception:
-                pass
-        return out
-    except Exception:
-        return {}
-
-
-def save_budget(anio: int, mes: str, valor: float):
-    """Guarda o actualiza el presupuesto de un mes/año en Sheets."""
-    ws = _get_budget_sheet()
-    if not ws:
-        return False
-    try:
-        rows   = ws.get_all_values()
-        header = [h.upper() for h in rows[0]] if rows else []
-        # Buscar fila existente
-        for i, row in enumerate(rows[1:], start=2):
-            if len(row) >= 3:
-                try:
-                    if int(row[0]) == anio and row[1].strip() == mes:
-                        ws.update(f"C{i}:D{i}", [[valor, dt.datetime.now().strftime("%Y-%m-%d %H:%M")]])
-                        load_budgets.clear()
-                        return True
-                except Exception:
-                    pass
-        # Fila nueva
-        ws.append_row([anio, mes, valor, dt.datetime.now().strftime("%Y-%m-%d %H:%M")])
-        load_budgets.clear()
-        return True
-    except Exception:
-        return False
-
-
-def now_peru() -> dt.datetime:
-    return dt.datetime.now(TZ_OFFSET)
-
-
-def filter_data(df: pd.DataFrame, mes, anio: int) -> pd.DataFrame:
-    if df.empty:
-        return df
-    mask = df["AÑO"] == int(anio)
-    if mes is not None:
-        mask &= df["MES"] == mes
-    return df[mask].copy()
+def fmt_range(desde: dt.date, hasta: dt.date) -> str:
+    fmt = "%d/%m" if desde.year == hasta.year else "%d/%m/%y"
+    return f"{desde.strftime(fmt)} – {hasta.strftime(fmt)}"
 
 
-def compute_stats(dfm: pd.DataFrame, total: float) -> dict:
-    if dfm.empty or total <= 0:
-        return {}
-    now     = now_peru()
-    avg_day = total / max(now.day, 1)
-    return {
-        "avg_day": avg_day,
-        "proj":    avg_day * 30,
-        "n_tx":    len(dfm),
-        "top_cat": dfm.groupby("CATEGORÍA")["MONTO"].sum().idxmax(),
-    }
+def month_extras() -> dict:
+    """Piezas de interfaz que se arman junto con cada mes (sin leer session_state en el hilo)."""
+    mode   = st.session_state.hist_mode
+    extras = {"donut": lambda m: grp_donut_svg(m["grp"])}
+    if mode != "Mensual":   # el mensual es del año entero y ya se memoiza por año
+        extras[f"hist:{mode}"] = lambda m: history_series(m["dfm"], mode)
+    return extras
 
 
-def days_with_expense_streak(df: pd.DataFrame) -> int:
-    """Racha: días CONSECUTIVOS con al menos un gasto (hasta hoy)."""
-    if df.empty:
-        return 0
-    today = now_peru().date()
-    dates = set(df["FECHA"].dropna().dt.date.unique())
-    streak = 0
-    d = today
-    while d in dates:
-        streak += 1
-        d -= dt.timedelta(days=1)
-    return streak
-
+def set_state(key: str, value):
+    """Callback genérico: fija un valor antes del rerun (sin st.rerun extra)."""
+    st.session_state[key] = value
 
-def apply_sort(dfm: pd.DataFrame) -> pd.DataFrame:
-    col = "FECHA" if st.session_state.sort_by == "fecha" else "MONTO"
-    return dfm.sort_values(col, ascending=st.session_state.sort_asc)
 
+def toggle_cat(cat: str):
+    """Acordeón del detalle: abrir una categoría cierra la que estaba abierta.
 
-def export_csv(dfm: pd.DataFrame) -> bytes:
-    keep = [c for c in ["FECHA","MES","AÑO","CATEGORÍA","DESCRIPCION","MONTO","ID"] if c in dfm.columns]
-    buf  = io.StringIO()
-    dfm[keep].to_csv(buf, index=False)
-    return buf.getvalue().encode()
+    El expander siempre nace con expanded = (expanded_cat == cat), así que
+    un cambio en la abierta es cerrarla y en cualquier otra es abrirla.
+    """
+    st.session_state.expanded_cat = None if st.session_state.expanded_cat == cat else cat
 
 
-def prev_month():
-    idx = MESES_ORD.index(st.session_state.sel_month)
-    if idx == 0:
-        st.session_state.sel_month = MESES_ORD[11]
-        st.session_state.sel_year -= 1
+def toggle_sort(col: str):
+    if st.session_state.sort_by == col:
+        st.session_state.sort_asc = not st.session_state.sort_asc
     else:
-        st.session_state.sel_month = MESES_ORD[idx - 1]
+        st.session_state.sort_by  = col
+        st.session_state.sort_asc = False
 
 
-def next_month():
-    idx = MESES_ORD.index(st.session_state.sel_month)
-    if idx == 11:
-        st.session_state.sel_month = MESES_ORD[0]
-        st.session_state.sel_year += 1
-    else:
-        st.session_state.sel_month = MESES_ORD[idx + 1]
+def toggle_picker():
+    st.session_state.show_picker = not st.session_state.show_picker
+    st.session_state.picker_year = st.session_state.sel_year
 
 
 # ============================================================
@@ -774,7 +335,7 @@ def _fig_base(w=5, h=5, dpi=200):
     return fig, ax
 
 
-def render_donut(grp_df: pd.DataFrame, center_cat: str, center_pct: float):
+def donut_svg(grp_df: pd.DataFrame, center_cat: str, center_pct: float) -> str:
     """Donut SVG con stroke-dasharray — geometría correcta garantizada."""
     import math
     size = 200
@@ -808,7 +369,7 @@ def render_donut(grp_df: pd.DataFrame, center_cat: str, center_pct: float):
     label_short = center_cat[:9] + "…" if len(center_cat) > 9 else center_cat
     color_pct   = COLORS_MAP.get(center_cat, "#00E054")
 
-    svg = f"""<div style="width:100%;max-width:200px;margin:0 auto;">
+    return f"""<div style="width:100%;max-width:200px;margin:0 auto;">
 <svg viewBox="0 0 {size} {size}" xmlns="http://www.w3.org/2000/svg" style="width:100%;display:block;">
   <circle cx="{cx}" cy="{cy}" r="{r + 16}" fill="#080808"/>
   {rings_svg}
@@ -820,16 +381,38 @@ def render_donut(grp_df: pd.DataFrame, center_cat: str, center_pct: float):
         font-size="36" font-weight="800" fill="#f0f0f0"
         font-family="'JetBrains Mono',monospace">{int(center_pct)}<tspan font-size="15" fill="{color_pct}" font-weight="700">%</tspan></text>
 </svg></div>"""
-    st.markdown(svg, unsafe_allow_html=True)
 
 
-def render_history_chart(df: pd.DataFrame, view_mode="Diario"):
+def grp_donut_svg(grp: pd.DataFrame) -> str:
+    if grp.empty:
+        return ""
+    top = grp.iloc[0]
+    return donut_svg(grp, top["CATEGORÍA"], float(top["PCT"]))
+
+
+HIST_MAX_LABELS = 16   # en rangos largos se rotula una barra de cada k
+
+
+def history_series(df: pd.DataFrame, view_mode="Diario", by_date=False) -> tuple:
+    """
+    (x, y, etiquetas) del histórico. Por defecto agrupa dentro de un mes
+    (día del mes, semana del mes, mes del año); con by_date agrupa por
+    fecha real, para rangos que cruzan meses o años.
+    """
     if df.empty:
-        st.info("No hay datos para mostrar.")
-        return
+        return [], [], []
     df = df.copy()
     df["_dt"] = pd.to_datetime(df["FECHA"])
 
+    if by_date:
+        freq    = {"Diario": "D", "Semanal": "W", "Mensual": "M"}[view_mode]
+        grouped = df.groupby(df["_dt"].dt.to_period(freq))["MONTO"].sum()
+        fmt     = (lambda p: f"{MESES_ORD[p.month-1][:3].upper()} {p.year % 100:02d}") if freq == "M" \
+                  else (lambda p: p.start_time.strftime("%d/%m"))
+        step    = -(-len(grouped) // HIST_MAX_LABELS)
+        xlabels = [fmt(p) if i % step == 0 else "" for i, p in enumerate(grouped.index)]
+        return list(range(len(grouped))), list(grouped.values), xlabels
+
     if view_mode == "Diario":
         grouped = df.groupby(df["_dt"].dt.day)["MONTO"].sum()
         xlabels = [str(int(v)) for v in grouped.index]
@@ -840,8 +423,14 @@ def render_history_chart(df: pd.DataFrame, view_mode="Diario"):
     else:
         grouped = df.groupby(df["_dt"].dt.month)["MONTO"].sum()
         xlabels = [MESES_ORD[int(v)-1][:3].upper() for v in grouped.index]
+    return list(grouped.index), list(grouped.values), xlabels
 
-    x, y    = list(grouped.index), list(grouped.values)
+
+def render_history_chart(series: tuple):
+    x, y, xlabels = series
+    if not x:
+        st.info("No hay datos para mostrar.")
+        return
     fig, ax = _fig_base(6, 3, 180)
     bars    = ax.bar(x, y, color=THEME["primary"], alpha=0.85, edgecolor="none", width=0.6)
     if y:
@@ -879,23 +468,90 @@ def render_skeleton():
     """, unsafe_allow_html=True)
 
 
-def render_success_banner(cat: str, amount: float, desc: str):
+def render_success_banner(cat: str, amount: float, desc: str, title: str = "¡Gasto guardado!"):
     icon = ICON_MAP.get(cat, "✅")
     st.markdown(f"""
         <div class="success-flash"></div>
         <div class="success-banner">
           <div class="success-icon">{icon}</div>
           <div>
-            <div class="success-title">¡Gasto guardado!</div>
+            <div class="success-title">{title}</div>
             <div class="success-sub">{cat} · S/ {amount:,.2f} · {desc}</div>
           </div>
         </div>
     """, unsafe_allow_html=True)
 
 
+def _rgba(hex_color: str, alpha: float) -> str:
+    h = hex_color.lstrip("#")
+    return f"rgba({int(h[0:2], 16)},{int(h[2:4], 16)},{int(h[4:6], 16)},{alpha:.2f})"
+
+
+def budget_heatmap_html(year: pd.DataFrame) -> str:
+    """
+    Mapa mes × categoría del año (BudgetMatrix.year). Cada celda es la parte
+    del presupuesto del mes que se llevó la categoría (del total si el mes
+    no tiene presupuesto), teñida con el color del nivel de uso del mes.
+    """
+    cats  = year.columns.drop(["TOTAL", "PRESUPUESTO", "USO", "NIVEL"])
+    cells = year[cats[:HEAT_CATS]]
+    if len(cats) > HEAT_CATS:
+        cells = cells.assign(Resto=year[cats[HEAT_CATS:]].sum(axis=1))
+    base  = year["PRESUPUESTO"].fillna(year["TOTAL"])
+    share = cells.div(base.where(base > 0), axis=0).fillna(0.0)
+    alpha = (0.1 + 0.8 * (share / 0.5).clip(upper=1.0)).where(cells > 0, 0.0)   # media cuota = pleno
+
+    head = "".join(f'<th title="{c}">{ICON_MAP.get(c, "＋")}</th>' for c in cells.columns)
+    rows = []
+    for mes in year.index:
+        r     = year.loc[mes]
+        color = LEVEL_COLOR[r["NIVEL"]]
+        tds   = "".join(
+            f'<td title="{c} · S/ {cells.at[mes, c]:,.0f} · {share.at[mes, c] * 100:.0f}%"'
+            + (f' style="background:{_rgba(color, alpha.at[mes, c])};"' if alpha.at[mes, c] else "") + "></td>"
+            for c in cells.columns)
+        uso   = f"{r['USO']:.0f}%" if r["NIVEL"] else "—"
+        rows.append(f'<tr><th>{mes[:3]}</th>{tds}<td class="heat-total">{r["TOTAL"]:,.0f}</td>'
+                    f'<td class="heat-uso" style="color:{color};">{uso}</td></tr>')
+    over = int((year["NIVEL"] == "over").sum())
+    warn = int((year["NIVEL"] == "warn").sum())
+    return f"""
+        <table class="heat">
+          <thead><tr><th></th>{head}<th>S/</th><th>Uso</th></tr></thead>
+          <tbody>{"".join(rows)}</tbody>
+        </table>
+        <div class="heat-legend">
+          <span style="color:{THEME['primary']};">■</span> &lt;{BUDGET_WARN_PCT}%
+          <span style="color:{THEME['warning']};">■</span> {BUDGET_WARN_PCT}–{BUDGET_OVER_PCT - 1}%
+          <span style="color:{THEME['danger']};">■</span> ≥{BUDGET_OVER_PCT}%
+          <span style="color:{THEME['muted']};">■</span> sin presupuesto
+          · {over} {"mes" if over == 1 else "meses"} excedido{"" if over == 1 else "s"}, {warn} al límite
+        </div>
+    """
+
+
+def start_edit(gasto_id: str):
+    """Abre el formulario con los valores del gasto; el preview lo guarda con update_expense."""
+    df = load_data()
+    r  = df.loc[df["ID"] == gasto_id]
+    if r.empty:
+        st.toast("No se encontró el gasto")
+        return
+    r = r.iloc[0]
+    st.session_state.editing = {
+        "id":          gasto_id,
+        "date":        r["FECHA"].date() if pd.notna(r["FECHA"]) else now_peru().date(),
+        "amount":      float(r["MONTO"]),
+        "category":    r["CATEGORÍA"],
+        "description": r["DESCRIPCION"],
+    }
+    st.session_state.preview_data = None
+    st.session_state.view         = "add"
+
+
 def render_mov_item(desc: str, subtitle: str, amt: float, gasto_id: str, key_prefix: str):
-    """Fila de movimiento con botón eliminar compacto."""
-    c_mov, c_del = st.columns([11, 1])
+    """Fila de movimiento con botones editar y eliminar compactos."""
+    c_mov, c_edit, c_del = st.columns([10, 1, 1])
     with c_mov:
         st.markdown(f"""
             <div class="mov-item">
@@ -908,86 +564,55 @@ def render_mov_item(desc: str, subtitle: str, amt: float, gasto_id: str, key_pre
               </div>
             </div>
         """, unsafe_allow_html=True)
+    # Botones inline, solo visibles si hay ID real
+    if gasto_id.startswith("legacy_"):
+        return
+    with c_edit:
+        st.markdown("<div style='margin-top:8px;'>", unsafe_allow_html=True)
+        if st.button("✏️", key=f"{key_prefix}_ed_{gasto_id}", help="Editar gasto"):
+            start_edit(gasto_id)
+            st.rerun()
+        st.markdown("</div>", unsafe_allow_html=True)
     with c_del:
-        # Botón inline, solo visible si hay ID real
-        is_legacy = gasto_id.startswith("legacy_")
-        if not is_legacy:
-            st.markdown("<div style='margin-top:8px;'>", unsafe_allow_html=True)
-            if st.button("🗑", key=f"{key_prefix}_{gasto_id}", help="Eliminar gasto"):
-                st.session_state.confirm_delete = gasto_id
-                st.rerun()
-            st.markdown("</div>", unsafe_allow_html=True)
+        st.markdown("<div style='margin-top:8px;'>", unsafe_allow_html=True)
+        if st.button("🗑", key=f"{key_prefix}_{gasto_id}", help="Eliminar gasto"):
+            st.session_state.confirm_delete = gasto_id
+            st.rerun()
+        st.markdown("</div>", unsafe_allow_html=True)
 
 
 def render_sort_bar():
     c1, c2, c3, _ = st.columns([1.5, 2, 2, 4])
     with c1:
         st.markdown('<div class="sort-label">Ordenar:</div>', unsafe_allow_html=True)
-    with c2:
-        arrow = "↑" if st.session_state.sort_asc else "↓"
-        if st.button(
-            f"{arrow if st.session_state.sort_by == 'fecha' else '↕'} Fecha",
-            key="sort_f", use_container_width=True,
-            type="primary" if st.session_state.sort_by == "fecha" else "secondary",
-        ):
-            if st.session_state.sort_by == "fecha":
-                st.session_state.sort_asc = not st.session_state.sort_asc
-            else:
-                st.session_state.sort_by = "fecha"
-                st.session_state.sort_asc = False
-            st.rerun()
-    with c3:
-        if st.button(
-            f"{arrow if st.session_state.sort_by == 'monto' else '↕'} Monto",
-            key="sort_m", use_container_width=True,
-            type="primary" if st.session_state.sort_by == "monto" else "secondary",
-        ):
-            if st.session_state.sort_by == "monto":
-                st.session_state.sort_asc = not st.session_state.sort_asc
-            else:
-                st.session_state.sort_by = "monto"
-                st.session_state.sort_asc = False
-            st.rerun()
-
-
-# ============================================================
-# 9) VISTA PRINCIPAL
-# ============================================================
-def main_view():
-    # Skeleton en primera carga real
-    if not st.session_state.data_loaded:
-        ph = st.empty()
-        with ph.container():
-            render_skeleton()
-        df = load_data()
-        st.session_state.data_loaded = True
-        ph.empty()
-    else:
-        df = load_data()
-
-    now          = now_peru()
-    date_display = f"{DIAS_ORD[now.weekday()]}, {now.day} DE {MESES_ORD[now.month-1].upper()}"
-
-    # ── Banner éxito post-guardado ───────────────────────────
-    if st.session_state.show_success and st.session_state.preview_data:
-        pd_ = st.session_state.preview_data
-        render_success_banner(pd_.get("category",""), pd_.get("amount",0), pd_.get("description",""))
-        st.session_state.show_success = False
-        st.session_state.preview_data = None
-
-    # ── Header ──────────────────────────────────────────────
-    st.markdown(
-        f'<div class="badge"><span class="badge-dot"></span>{date_display}</div>'
-        f'<div class="greeting">Hola, Andrés 👋</div>',
-        unsafe_allow_html=True,
-    )
-    if st.button("➕  Nuevo gasto", type="primary", use_container_width=True, key="btn_nuevo_top"):
-        st.session_state.view = "add"
-        st.rerun()
-
-    st.write("")
-
-    # ── Navegación mes ───────────────────────────────────────
+    arrow = "↑" if st.session_state.sort_asc else "↓"
+    for col, label, key, box in [("fecha", "Fecha", "sort_f", c2), ("monto", "Monto", "sort_m", c3)]:
+        with box:
+            active = st.session_state.sort_by == col
+            st.button(f"{arrow if active else '↕'} {label}", key=key, use_container_width=True,
+                      type="primary" if active else "secondary",
+                      on_click=toggle_sort, args=(col,))
+
+
+PERIOD_LABELS = {"mes": "Mes", **RANGE_PRESETS, "custom": "Personalizado"}
+
+
+def render_period_bar():
+    """Mes (con navegador) o rango libre; cambiar de periodo sí es un rerun completo."""
+    opts = list(PERIOD_LABELS)
+    st.selectbox("Periodo", opts, index=opts.index(st.session_state.period),
+                 format_func=PERIOD_LABELS.get, key="period_sel", label_visibility="collapsed",
+                 on_change=lambda: set_state("period", st.session_state.period_sel))
+    if st.session_state.period == "custom":
+        sel = st.date_input("Rango", value=st.session_state.range_custom, format="DD/MM/YYYY",
+                            key="range_pick", label_visibility="collapsed")
+        if isinstance(sel, tuple) and len(sel) == 2:   # mientras se elige llega solo "desde"
+            st.session_state.range_custom = sel
+
+
+# ── Fragmentos: cada interacción rerenderiza solo su sección ─
+@st.fragment
+def render_month_nav():
     st.markdown(f"""
         <div style="text-align:center;font-size:.98rem;font-weight:700;
              color:#bbb;padding:8px 0 6px;letter-spacing:-.2px;">
@@ -1002,25 +627,25 @@ def main_view():
         if st.button("Siguiente  ›", key="nm", type="secondary", use_container_width=True):
             next_month(); st.rerun()
     with cn3:
-        if st.button("📅", key="openpick", type="secondary", use_container_width=True):
-            st.session_state.show_picker = not st.session_state.get("show_picker", False)
-            st.rerun()
+        st.button("📅", key="openpick", type="secondary", use_container_width=True,
+                  on_click=toggle_picker)
 
-    # Picker año+mes — aparece debajo cuando se abre
-    if st.session_state.get("show_picker", False):
+    # Picker año+mes — el año se elige dentro del fragmento y solo
+    # se aplica (rerun completo) al tocar un mes
+    if st.session_state.show_picker:
         with st.container():
-            # Selector de año
+            year = st.session_state.picker_year
             py1, py2, py3 = st.columns([1, 3, 1])
             with py1:
-                if st.button("‹", key="py", type="secondary", use_container_width=True):
-                    st.session_state.sel_year -= 1; st.rerun()
+                st.button("‹", key="py", type="secondary", use_container_width=True,
+                          on_click=set_state, args=("picker_year", year - 1))
             with py2:
                 st.markdown(
-                    f"<div style='text-align:center;font-weight:900;font-size:1.1rem;padding-top:6px;'>{st.session_state.sel_year}</div>",
+                    f"<div style='text-align:center;font-weight:900;font-size:1.1rem;padding-top:6px;'>{year}</div>",
                     unsafe_allow_html=True)
             with py3:
-                if st.button("›", key="ny", type="secondary", use_container_width=True):
-                    st.session_state.sel_year += 1; st.rerun()
+                st.button("›", key="ny", type="secondary", use_container_width=True,
+                          on_click=set_state, args=("picker_year", year + 1))
 
             st.write("")
             # Grid 3x4 de meses — siempre 3 columnas
@@ -1030,34 +655,217 @@ def main_view():
                 for i, abbr in enumerate(row):
                     full = MESES_ORD[abbrs.index(abbr)]
                     with cols[i]:
-                        t = "primary" if full == st.session_state.sel_month else "secondary"
+                        t = ("primary" if full == st.session_state.sel_month
+                             and year == st.session_state.sel_year else "secondary")
                         if st.button(abbr, key=f"mp_{abbr}", type=t, use_container_width=True):
-                            st.session_state.sel_month = full
+                            st.session_state.sel_month   = full
+                            st.session_state.sel_year    = year
                             st.session_state.show_picker = False
                             st.rerun()
 
+
+@st.fragment
+def render_category_details(dfm: pd.DataFrame, grp: pd.DataFrame, trends: dict, vkey: tuple):
+    render_sort_bar()
+    slices = category_slices(dfm, vkey)
+    for _, r in grp.iterrows():
+        cat  = r["CATEGORÍA"]
+        icon = ICON_MAP.get(cat, "•")
+        # Cerrada = solo el encabezado: con on_change el expander sabe si está
+        # abierto (sin él, Streamlit ejecuta el cuerpo igual). expanded entra en
+        # el id del widget, así la que deja de ser expanded_cat se recrea cerrada.
+        exp = st.expander(f"{icon}  {cat}", expanded=(st.session_state.expanded_cat == cat),
+                          key=f"cat_exp_{cat}", on_change=toggle_cat, args=(cat,))
+        if not exp.open:
+            continue
+        amt     = float(r["MONTO"])
+        pct     = float(r["PCT"])
+        color   = COLORS_MAP.get(cat, "#888")
+        details = slices.get(cat, dfm.iloc[:0])
+
+        with exp:
+            st.markdown(f"""
+                <div class="rich-card">
+                  <div class="rich-header">
+                    <div class="rich-left">
+                      <div class="rich-cat">{cat}</div>
+                      <div class="rich-sub">{len(details)} MOVIMIENTOS{f" · S/ {trends['mom_cat'].get(cat, 0.0):+,.0f} VS MES ANT." if trends else ""}</div>
+                    </div>
+                    <div class="rich-right">
+                      <div class="rich-amt">S/ {amt:,.2f}</div>
+                      <div class="rich-pct" style="color:{color};">{int(pct+.5)}%</div>
+                    </div>
+                  </div>
+                  <div class="rich-bar-bg">
+                    <div class="rich-bar-fill" style="width:{pct}%;background:{color};"></div>
+                  </div>
+                </div>
+            """, unsafe_allow_html=True)
+
+            for _, d in details.iterrows():
+                dstr = d["FECHA"].strftime("%d/%m") if pd.notna(d["FECHA"]) else ""
+                desc = str(d.get("DESCRIPCION","")).strip() or cat
+                render_mov_item(desc, dstr, float(d.get("MONTO",0)),
+                                str(d.get("ID","")), f"c_{cat[:3]}")
+
+
+@st.fragment
+def render_movements(dfm: pd.DataFrame, vkey: tuple):
+    render_sort_bar()
+    for _, d in sorted_view(dfm, vkey).iterrows():
+        cat  = d["CATEGORÍA"]
+        dstr = d["FECHA"].strftime("%d/%m") if pd.notna(d["FECHA"]) else ""
+        desc = str(d.get("DESCRIPCION","")).strip() or cat
+        render_mov_item(desc, f"{cat} · {dstr}", float(d.get("MONTO",0)),
+                        str(d.get("ID","")), "h")
+
+
+@st.fragment
+def render_distribution(dfm: pd.DataFrame, grp: pd.DataFrame, trends: dict, vkey: tuple,
+                        by_date: bool = False, ready: dict | None = None):
+    # ready: piezas ya armadas por el prefetch del mes ("donut", "hist:<modo>")
+    ready = ready or {}
+    # ── Tabs distribución — compactos ───────────────────────
+    st.markdown('<div class="section-title">DISTRIBUCIÓN</div>', unsafe_allow_html=True)
+    cv1, cv2, _ = st.columns([1, 1, 1])
+    for mode, key, col in [("Categorías", "vc", cv1), ("Histórico", "vh", cv2)]:
+        with col:
+            st.button(mode, key=key, use_container_width=True,
+                      type="primary" if st.session_state.chart_mode == mode else "secondary",
+                      on_click=set_state, args=("chart_mode", mode))
+
+    st.write("")
+
+    # ── Vista CATEGORÍAS ─────────────────────────────────────
+    if st.session_state.chart_mode == "Categorías":
+        cc, cl = st.columns([1, 1], vertical_alignment="center")
+        with cc:
+            st.markdown(ready.get("donut") or grp_donut_svg(grp), unsafe_allow_html=True)
+        with cl:
+            for _, r in grp.iterrows():
+                color = COLORS_MAP.get(r["CATEGORÍA"], "#888")
+                st.markdown(f"""
+                    <div class="legend-row">
+                      <div class="legend-left">
+                        <div class="legend-dot" style="background:{color};box-shadow:0 0 6px {color};"></div>
+                        <div class="legend-name">{r['CATEGORÍA']}</div>
+                      </div>
+                      <div class="legend-pct">{int(float(r['PCT'])+.5)}%</div>
+                    </div>
+                """, unsafe_allow_html=True)
+
+        st.write("")
+        st.markdown('<div class="section-title">DETALLE POR CATEGORÍA</div>', unsafe_allow_html=True)
+        render_category_details(dfm, grp, trends, vkey)
+
+    # ── Vista HISTÓRICO ──────────────────────────────────────
+    else:
+        ch1, ch2, ch3, _ = st.columns([1.5,1.5,1.5,2.5])
+        for label, col in [("Diario",ch1),("Semanal",ch2),("Mensual",ch3)]:
+            with col:
+                st.button(label, key=f"hm_{label}", use_container_width=True,
+                          type="primary" if st.session_state.hist_mode == label else "secondary",
+                          on_click=set_state, args=("hist_mode", label))
+
+        st.write("")
+        mode = st.session_state.hist_mode
+        if f"hist:{mode}" in ready:
+            series = ready[f"hist:{mode}"]
+        elif by_date:             # rango libre: el propio rango, por fecha real
+            series = view_memo("hist", lambda: history_series(dfm, mode, by_date=True), *vkey, mode)
+        elif mode == "Mensual":   # todo el año: no depende de mes ni búsqueda
+            series = view_memo("hist", lambda: history_series(get_backend().query(vkey[0]), mode),
+                               vkey[0], mode)
+        else:
+            series = view_memo("hist", lambda: history_series(dfm, mode), *vkey, mode)
+        render_history_chart(series)
+
+        st.markdown('<div class="section-title">MOVIMIENTOS</div>', unsafe_allow_html=True)
+        render_movements(dfm, vkey)
+
+
+# ============================================================
+# 9) VISTA PRINCIPAL
+# ============================================================
+def main_view():
+    # Skeleton en primera carga real
+    if not st.session_state.data_loaded:
+        ph = st.empty()
+        with ph.container():
+            render_skeleton()
+        load_data()
+        st.session_state.data_loaded = True
+        ph.empty()
+
+    now          = now_peru()
+    date_display = f"{DIAS_ORD[now.weekday()]}, {now.day} DE {MESES_ORD[now.month-1].upper()}"
+
+    # ── Banner éxito post-guardado ───────────────────────────
+    if st.session_state.show_success and st.session_state.preview_data:
+        pd_ = st.session_state.preview_data
+        render_success_banner(pd_.get("category",""), pd_.get("amount",0), pd_.get("description",""),
+                              "¡Gasto actualizado!" if pd_.get("edit_id") else "¡Gasto guardado!")
+        st.session_state.show_success = False
+        st.session_state.preview_data = None
+
+    # ── Header ──────────────────────────────────────────────
+    st.markdown(
+        f'<div class="badge"><span class="badge-dot"></span>{date_display}</div>'
+        f'<div class="greeting">Hola, {current_tenant().name} 👋</div>',
+        unsafe_allow_html=True,
+    )
+    if st.button("➕  Nuevo gasto", type="primary", use_container_width=True, key="btn_nuevo_top"):
+        st.session_state.view = "add"
+        st.rerun()
+
+    st.write("")
+
+    render_period_bar()
+    rng = selected_range(now.date())
+    if rng is None:
+        render_month_nav()
+
     mes_sel  = st.session_state.sel_month
     anio_sel = st.session_state.sel_year
-    dfm      = filter_data(df, mes_sel, anio_sel)
-    total    = float(dfm["MONTO"].sum()) if not dfm.empty else 0.0
-    stats    = compute_stats(dfm, total)
-
-    # ── Cargar presupuesto persistente ──────────────────────
+    backend  = get_backend()
+    if rng is None:
+        pkey   = (anio_sel, mes_sel)
+        fetch  = lambda q: backend.query(anio_sel, mes_sel, q)
+        totals = lambda q: backend.totals_by_category(anio_sel, mes_sel, q)
+        titulo = mes_sel.upper()
+        # El mes llega armado por el prefetch (o se arma aquí), y mientras
+        # se dibuja este se encolan el anterior y el siguiente
+        extras = month_extras()
+        month  = view_memo("month", lambda: get_month(anio_sel, mes_sel, extras), *pkey, now.date(), *extras)
+        prefetch_months(adjacent_months(anio_sel, mes_sel), extras)
+        dfm, total, stats, trends = month["dfm"], month["total"], month["stats"], month["trends"]
+    else:
+        # Rango libre: búsqueda binaria y sumas prefijas sobre el ledger ordenado por fecha
+        pkey   = rng
+        fetch  = lambda q: backend.query_range(*rng, texto=q)
+        totals = lambda q: backend.totals_by_range(*rng, q)
+        titulo = fmt_range(*rng)
+        month  = {}
+        dfm    = view_memo("dfm", lambda: fetch(""), *pkey, "")
+        total  = view_memo("total", lambda: backend.total_range(*rng), *pkey)
+        # sin comparativos mes/año: no aplican a un rango arbitrario
+        stats  = view_memo("stats", lambda: range_stats(dfm, total, *rng), *pkey, now.date())
+        trends = {}
+
+    # ── Cargar presupuesto persistente (solo por mes) ───────
     budgets = load_budgets()
-    presup  = budgets.get((anio_sel, mes_sel), 0.0)
+    presup  = budgets.get((anio_sel, mes_sel), 0.0) if rng is None else 0.0
     presup_pct   = min(total / presup * 100, 100) if presup > 0 else 0
-    presup_color = (THEME["primary"] if presup_pct < 80
-                    else THEME["warning"] if presup_pct < 100
-                    else THEME["danger"])
+    presup_color = LEVEL_COLOR[budget_level(presup_pct)] if presup > 0 else THEME["primary"]
 
     st.markdown(f"""
         <div class="card">
-          <div class="card-title">TOTAL GASTADO · {mes_sel.upper()}</div>
+          <div class="card-title">TOTAL GASTADO · {titulo}</div>
           <div class="card-amount-wrap">
             <span class="card-currency">S/</span>
             <span class="card-amount">{total:,.2f}</span>
           </div>
-          {"" if not presup else f'<div class="card-sub">de S/ {presup:,.0f} presupuestado · <span style="color:{"#00E054" if presup_pct < 80 else "#FFC700" if presup_pct < 100 else "#FF4B4B"}">{presup_pct:.0f}%</span></div>'}
+          {"" if not presup else f'<div class="card-sub">de S/ {presup:,.0f} presupuestado · <span style="color:{presup_color}">{presup_pct:.0f}%</span></div>'}
         </div>
     """, unsafe_allow_html=True)
 
@@ -1076,7 +884,8 @@ def main_view():
 
     # ── Stats ────────────────────────────────────────────────
     if stats:
-        streak     = days_with_expense_streak(df)
+        streak     = days_with_expense_streak()
+        record     = get_streak_index().longest
         streak_cls = "streak" if streak > 0 else ""
         st.markdown(f"""
             <div class="stat-row">
@@ -1092,21 +901,52 @@ def main_view():
                 <div class="stat-label">Movimientos</div>
                 <div class="stat-value">{stats['n_tx']}</div>
               </div>
-              <div class="stat-pill">
+              <div class="stat-pill" title="Récord: {record}d">
                 <div class="stat-label">🔥 Racha</div>
                 <div class="stat-value {streak_cls}">{streak}d</div>
               </div>
             </div>
         """, unsafe_allow_html=True)
+    if stats and trends:
+        st.markdown(f"""
+            <div class="stat-row">
+              <div class="stat-pill">
+                <div class="stat-label">Últimos 7d</div>
+                <div class="stat-value">S/ {trends['roll_7d']:,.0f}</div>
+              </div>
+              <div class="stat-pill">
+                <div class="stat-label">Últimos 30d</div>
+                <div class="stat-value">S/ {trends['roll_30d']:,.0f}</div>
+              </div>
+              <div class="stat-pill">
+                <div class="stat-label">vs mes ant.</div>
+                <div class="stat-value">{fmt_delta(trends['mom_pct'])}</div>
+              </div>
+              <div class="stat-pill">
+                <div class="stat-label">vs año ant.</div>
+                <div class="stat-value">{fmt_delta(trends['yoy_pct'])}</div>
+              </div>
+            </div>
+        """, unsafe_allow_html=True)
+
+    # ── Presupuesto vs real del año elegido ─────────────────
+    # Por mes: el año del navegador (así se revisan años pasados); con
+    # "Este año", el del rango. Los rangos libres no tienen un año propio.
+    anio_heat = anio_sel if rng is None else rng[1].year if st.session_state.period == "anio" else None
+    if anio_heat is not None:
+        st.markdown(f'<div class="section-title">PRESUPUESTO VS REAL · {anio_heat}</div>', unsafe_allow_html=True)
+        st.markdown(view_memo("heat", lambda: budget_heatmap_html(get_budget_matrix().year(anio_heat)),
+                              anio_heat, load_budgets.version, now.date()),
+                    unsafe_allow_html=True)
 
     # ── Alerta presupuesto ──────────────────────────────────
     if presup > 0:
-        if presup_pct >= 100:
+        if presup_pct >= BUDGET_OVER_PCT:
             st.markdown(
                 f'<div class="budget-alert danger">🚨 Superaste el presupuesto de S/ {presup:,.0f} — llevas S/ {total:,.2f}</div>',
                 unsafe_allow_html=True,
             )
-        elif presup_pct >= 80:
+        elif presup_pct >= BUDGET_WARN_PCT:
             st.markdown(
                 f'<div class="budget-alert warn">⚠️ Ya usaste el {presup_pct:.0f}% — te quedan S/ {max(presup-total,0):,.2f}</div>',
                 unsafe_allow_html=True,
@@ -1118,17 +958,30 @@ def main_view():
         ca, cb, cc = st.columns([1, 1, 2])
         with ca:
             st.download_button(
-                "⬇️ CSV", data=export_csv(dfm),
-                file_name=f"gastos_{mes_sel}_{anio_sel}.csv",
+                "⬇️ CSV", data=view_memo("csv", lambda: export_csv(dfm), *pkey),
+                file_name=(f"gastos_{mes_sel}_{anio_sel}.csv" if rng is None
+                           else f"gastos_{rng[0]:%Y%m%d}_{rng[1]:%Y%m%d}.csv"),
                 mime="text/csv", type="secondary", use_container_width=True,
             )
         with cb:
             lbl = "🎯 Presupuesto" if not st.session_state.budget_mode else "✕ Cerrar"
-            if st.button(lbl, type="secondary", use_container_width=True):
+            if rng is None and st.button(lbl, type="secondary", use_container_width=True):
                 st.session_state.budget_mode = not st.session_state.budget_mode
                 st.rerun()
+        with cc:
+            rep_key = (anio_sel, load_data.version)
+            if st.session_state.report_zip and st.session_state.report_zip[0] == rep_key:
+                st.download_button(f"⬇️ Reporte {anio_sel}", data=st.session_state.report_zip[1],
+                                   file_name=f"reporte_{anio_sel}.zip", mime="application/zip",
+                                   type="secondary", use_container_width=True)
+            elif st.button(f"📄 Reporte {anio_sel}", type="secondary", use_container_width=True):
+                with st.spinner("Dibujando un mes por núcleo…"):
+                    jobs  = reports.month_jobs(load_columns(ANALYTICS_COLS), [anio_sel], budgets)
+                    files = reports.render_reports(jobs)
+                st.session_state.report_zip = (rep_key, reports.zip_reports(files))
+                st.rerun()
 
-    if st.session_state.budget_mode:
+    if st.session_state.budget_mode and rng is None:
         with st.expander("🎯 Presupuesto mensual", expanded=True):
             bv = st.number_input(
                 f"Presupuesto para {mes_sel} {anio_sel} (S/)", min_value=0.0, step=50.0,
@@ -1153,125 +1006,28 @@ def main_view():
                            label_visibility="collapsed")
         st.session_state.search_query = sq
         if sq:
-            mask = (
-                dfm["DESCRIPCION"].str.contains(sq, case=False, na=False) |
-                dfm["CATEGORÍA"].str.contains(sq, case=False, na=False)
-            )
-            dfm = dfm[mask]
+            dfm = view_memo("dfm", lambda: fetch(sq), *pkey, sq)
 
     # ── Sin datos ─────────────────────────────────────────────
     if dfm.empty or total <= 0:
-        st.markdown("""
+        st.markdown(f"""
             <div class="empty-state">
               <div class="empty-icon">🪴</div>
-              <div class="empty-title">Sin gastos este mes</div>
+              <div class="empty-title">Sin gastos {"este mes" if rng is None else "en este periodo"}</div>
               <div class="empty-sub">Presiona "➕ Nuevo gasto" para empezar.</div>
             </div>
         """, unsafe_allow_html=True)
         return
 
     # ── Distribución ─────────────────────────────────────────
-    grp = (dfm.groupby("CATEGORÍA")["MONTO"].sum()
-              .reset_index()
-              .sort_values("MONTO", ascending=False))
-    grp["PCT"] = grp["MONTO"] / total * 100
-
-    # ── Tabs distribución — compactos ───────────────────────
-    st.markdown('<div class="section-title">DISTRIBUCIÓN</div>', unsafe_allow_html=True)
-    cv1, cv2, cv3 = st.columns([1, 1, 1])
-    with cv1:
-        if st.button("Categorías", key="vc",
-                     type="primary" if st.session_state.chart_mode == "Categorías" else "secondary",
-                     use_container_width=True):
-            st.session_state.chart_mode = "Categorías"; st.rerun()
-    with cv2:
-        if st.button("Histórico", key="vh",
-                     type="primary" if st.session_state.chart_mode == "Histórico" else "secondary",
-                     use_container_width=True):
-            st.session_state.chart_mode = "Histórico"; st.rerun()
-    with cv3:
-        pass
-
-    st.write("")
-
-    # ── Vista CATEGORÍAS ─────────────────────────────────────
-    if st.session_state.chart_mode == "Categorías":
-        top = grp.iloc[0]
-        cc, cl = st.columns([1, 1], vertical_alignment="center")
-        with cc:
-            render_donut(grp, top["CATEGORÍA"], float(top["PCT"]))
-        with cl:
-            for _, r in grp.iterrows():
-                color = COLORS_MAP.get(r["CATEGORÍA"], "#888")
-                st.markdown(f"""
-                    <div class="legend-row">
-                      <div class="legend-left">
-                        <div class="legend-dot" style="background:{color};box-shadow:0 0 6px {color};"></div>
-                        <div class="legend-name">{r['CATEGORÍA']}</div>
-                      </div>
-                      <div class="legend-pct">{int(float(r['PCT'])+.5)}%</div>
-                    </div>
-                """, unsafe_allow_html=True)
-
-        st.write("")
-        st.markdown('<div class="section-title">DETALLE POR CATEGORÍA</div>', unsafe_allow_html=True)
-        render_sort_bar()
-
-        for _, r in grp.iterrows():
-            cat     = r["CATEGORÍA"]
-            amt     = float(r["MONTO"])
-            pct     = float(r["PCT"])
-            color   = COLORS_MAP.get(cat, "#888")
-            icon    = ICON_MAP.get(cat, "•")
-            details = apply_sort(dfm[dfm["CATEGORÍA"] == cat])
-
-            with st.expander(f"{icon}  {cat}", expanded=(st.session_state.expanded_cat == cat)):
-                st.markdown(f"""
-                    <div class="rich-card">
-                      <div class="rich-header">
-                        <div class="rich-left">
-                          <div class="rich-cat">{cat}</div>
-                          <div class="rich-sub">{len(details)} MOVIMIENTOS</div>
-                        </div>
-                        <div class="rich-right">
-                          <div class="rich-amt">S/ {amt:,.2f}</div>
-                          <div class="rich-pct" style="color:{color};">{int(pct+.5)}%</div>
-                        </div>
-                      </div>
-                      <div class="rich-bar-bg">
-                        <div class="rich-bar-fill" style="width:{pct}%;background:{color};"></div>
-                      </div>
-                    </div>
-                """, unsafe_allow_html=True)
-
-                for _, d in details.iterrows():
-                    dstr = d["FECHA"].strftime("%d/%m") if pd.notna(d["FECHA"]) else ""
-                    desc = str(d.get("DESCRIPCION","")).strip() or cat
-                    render_mov_item(desc, dstr, float(d.get("MONTO",0)),
-                                    str(d.get("ID","")), f"c_{cat[:3]}")
-
-    # ── Vista HISTÓRICO ──────────────────────────────────────
-    else:
-        ch1, ch2, ch3, _ = st.columns([1.5,1.5,1.5,2.5])
-        for label, col in [("Diario",ch1),("Semanal",ch2),("Mensual",ch3)]:
-            with col:
-                if st.button(label, key=f"hm_{label}",
-                             type="primary" if st.session_state.hist_mode == label else "secondary",
-                             use_container_width=True):
-                    st.session_state.hist_mode = label; st.rerun()
-
-        st.write("")
-        chart_df = filter_data(df, None, anio_sel) if st.session_state.hist_mode == "Mensual" else dfm
-        render_history_chart(chart_df, st.session_state.hist_mode)
-
-        st.markdown('<div class="section-title">MOVIMIENTOS</div>', unsafe_allow_html=True)
-        render_sort_bar()
-        for _, d in apply_sort(dfm).iterrows():
-            cat  = d["CATEGORÍA"]
-            dstr = d["FECHA"].strftime("%d/%m") if pd.notna(d["FECHA"]) else ""
-            desc = str(d.get("DESCRIPCION","")).strip() or cat
-            render_mov_item(desc, f"{cat} · {dstr}", float(d.get("MONTO",0)),
-                            str(d.get("ID","")), "h")
+    vkey = (*pkey, st.session_state.search_query)
+    def _grp():
+        grp = totals(vkey[-1])
+        grp["PCT"] = grp["MONTO"] / total * 100
+        return grp
+    ready = month if not vkey[-1] else {}   # con búsqueda, todo sale del filtro
+    grp   = ready["grp"] if ready else view_memo("grp", _grp, *vkey)
+    render_distribution(dfm, grp, trends, vkey, by_date=rng is not None, ready=ready)
 
     # ── Confirm delete ───────────────────────────────────────
     if st.session_state.confirm_delete:
@@ -1297,6 +1053,8 @@ def main_view():
 # 10) VISTA AÑADIR (con pantalla de preview)
 # ============================================================
 def add_view():
+    ed = st.session_state.editing   # corrección de un gasto existente, o None
+
     # ── Preview / confirmación ───────────────────────────────
     if st.session_state.preview_data:
         pd_   = st.session_state.preview_data
@@ -1306,14 +1064,15 @@ def add_view():
         fecha = pd_["date"]
         color = COLORS_MAP.get(cat, "#888")
         icon  = ICON_MAP.get(cat, "•")
+        habit = get_category_stats().assess(cat, amt)   # O(1): sketch ya armado
 
         cb, ct, _ = st.columns([1.2, 6, 1.2], vertical_alignment="center")
         with cb:
             if st.button("←", type="secondary"):
                 st.session_state.preview_data = None; st.rerun()
         with ct:
-            st.markdown("<div style='text-align:center;font-size:1.5rem;font-weight:900;'>Confirmar gasto</div>",
-                        unsafe_allow_html=True)
+            st.markdown("<div style='text-align:center;font-size:1.5rem;font-weight:900;'>"
+                        f"{'Confirmar cambios' if ed else 'Confirmar gasto'}</div>", unsafe_allow_html=True)
 
         st.write("")
         st.markdown(f"""
@@ -1334,21 +1093,59 @@ def add_view():
                 <span class="preview-label">Monto</span>
                 <span class="preview-amount" style="color:{color};">S/ {amt:,.2f}</span>
               </div>
+              {"" if not habit else f'''<div class="preview-row">
+                <span class="preview-label">Habitual</span>
+                <span class="preview-value">S/ {habit["mediana"]:,.0f} · p95 S/ {habit["p95"]:,.0f}</span>
+              </div>'''}
             </div>
         """, unsafe_allow_html=True)
+        if habit.get("nivel") == "inusual":
+            st.markdown(f'<div class="budget-alert danger">🚨 Monto inusual para {cat}: '
+                        f'{amt / habit["mediana"]:.1f}× lo habitual — revisa que esté bien</div>',
+                        unsafe_allow_html=True)
+        elif habit.get("nivel") == "alto":
+            st.markdown(f'<div class="budget-alert warn">⚠️ Más alto que el 95% de tus gastos en {cat}</div>',
+                        unsafe_allow_html=True)
+
+        if pd_.get("duplicate"):
+            st.markdown(f'<div class="budget-alert warn">⚠️ {pd_["duplicate"]} ¿Es otro gasto igual?</div>',
+                        unsafe_allow_html=True)
 
         c1, c2 = st.columns(2)
         with c1:
             if st.button("✏️ Editar", type="secondary", use_container_width=True):
+                if ed:   # el formulario reabre con lo que se estaba revisando
+                    st.session_state.editing = {**ed, "date": fecha.date(), "amount": amt,
+                                                "category": cat, "description": desc}
                 st.session_state.preview_data = None; st.rerun()
         with c2:
-            if st.button("✅ Confirmar y guardar", type="primary", use_container_width=True):
+            if ed:
+                if st.button("✅ Guardar cambios", type="primary", use_container_width=True):
+                    with st.spinner("Guardando…"):
+                        ok, msg = update_expense(ed["id"], pd_)
+                    if ok:
+                        st.session_state.editing      = None
+                        st.session_state.show_success = True
+                        st.session_state.view         = "main"
+                        st.rerun()
+                    else:
+                        st.error(f"❌ Error: {msg}")
+                return
+            label = "✅ Guardar de todos modos" if pd_.get("duplicate") else "✅ Confirmar y guardar"
+            if st.button(label, type="primary", use_container_width=True):
                 with st.spinner("Guardando…"):
-                    ok, msg = save_to_sheet(pd_)
+                    # El token hace idempotente un doble toque; force salta el aviso de duplicado
+                    ok, msg = save_to_sheet({**pd_, "force": bool(pd_.get("duplicate"))})
                 if ok:
                     st.session_state.show_success = True
                     st.session_state.view = "main"
                     st.rerun()
+                elif msg == SAVE_IN_FLIGHT:
+                    # Doble toque con el primero aún en vuelo: no falló nada
+                    st.info("⏳ Ya se está guardando este gasto, en un momento aparece en la lista.")
+                elif recent_duplicate(pd_) is not None:
+                    pd_["duplicate"] = msg
+                    st.rerun()
                 else:
                     st.error(f"❌ Error: {msg}")
         return
@@ -1358,10 +1155,12 @@ def add_view():
     cb, ct, _ = st.columns([1, 5, 1], vertical_alignment="center")
     with cb:
         if st.button("←", type="secondary", use_container_width=True):
-            st.session_state.view = "main"; st.rerun()
+            st.session_state.editing = None
+            st.session_state.view    = "main"; st.rerun()
     with ct:
         st.markdown(
-            "<div style='text-align:center;font-size:1rem;font-weight:700;color:#666;letter-spacing:-.2px;'>Nuevo Gasto</div>",
+            "<div style='text-align:center;font-size:1rem;font-weight:700;color:#666;letter-spacing:-.2px;'>"
+            f"{'Editar Gasto' if ed else 'Nuevo Gasto'}</div>",
             unsafe_allow_html=True)
 
     # ── Monto ────────────────────────────────────────────────
@@ -1371,7 +1170,7 @@ def add_view():
     """, unsafe_allow_html=True)
 
     monto_str = st.text_input(
-        "Monto", value="0",
+        "Monto", value=f"{ed['amount']:g}" if ed else "0",
         label_visibility="collapsed",
         placeholder="0.00",
         key="monto_input"
@@ -1404,7 +1203,8 @@ def add_view():
     }
     cats_display = list(CAT_SHORT.values())
     cats_keys    = list(CAT_SHORT.keys())
-    cat_sel_disp = st.radio("Cat", cats_display, horizontal=True, label_visibility="collapsed")
+    cat_sel_disp = st.radio("Cat", cats_display, horizontal=True, label_visibility="collapsed",
+                            index=cats_keys.index(ed["category"]) if ed and ed["category"] in cats_keys else 0)
     cat_clean    = cats_keys[cats_display.index(cat_sel_disp)] if cat_sel_disp in cats_display else "Otros"
     if cat_clean not in VALID_CATS:
         cat_clean = "Otros"
@@ -1414,20 +1214,22 @@ def add_view():
         <div style='text-align:center;font-size:.63rem;font-weight:600;color:#242424;
              letter-spacing:3px;text-transform:uppercase;margin:20px 0 8px;'>FECHA</div>
     """, unsafe_allow_html=True)
-    fecha = st.date_input("Fecha", value=now_peru().date(), label_visibility="collapsed")
+    fecha = st.date_input("Fecha", value=ed["date"] if ed else now_peru().date(), label_visibility="collapsed")
 
     # ── Nota ─────────────────────────────────────────────────
     st.markdown("""
         <div style='text-align:center;font-size:.63rem;font-weight:600;color:#242424;
              letter-spacing:3px;text-transform:uppercase;margin:16px 0 8px;'>NOTA</div>
     """, unsafe_allow_html=True)
-    nota = st.text_input("Nota", placeholder="Descripción (opcional)…", label_visibility="collapsed")
+    nota = st.text_input("Nota", placeholder="Descripción (opcional)…", label_visibility="collapsed",
+                         value=ed["description"] if ed and ed["description"] != ed["category"] else "")
 
     st.write("")
     c1, c2 = st.columns(2)
     with c1:
         if st.button("Cancelar", type="secondary", use_container_width=True):
-            st.session_state.view = "main"; st.rerun()
+            st.session_state.editing = None
+            st.session_state.view    = "main"; st.rerun()
     with c2:
         if st.button("Revisar →", type="primary", disabled=(monto <= 0), use_container_width=True):
             st.session_state.preview_data = {
@@ -1435,6 +1237,8 @@ def add_view():
                 "amount":      float(monto),
                 "category":    cat_clean,
                 "description": nota.strip() or cat_clean,
+                "token":       uuid.uuid4().hex,   # idempotencia del guardado
+                "edit_id":     ed["id"] if ed else None,
             }
             st.rerun()
 
@@ -1442,29 +1246,26 @@ def add_view():
 # ============================================================
 # 11) ENTRY POINT
 # ============================================================
-inject_css()
-
-# Forzar teclado numérico en iPhone para campos de monto
-st.markdown("""
-<script>
-(function() {
-  function patchInputs() {
-    document.querySelectorAll('input[type="number"]').forEach(function(el) {
-      el.setAttribute('inputmode', 'decimal');
-      el.setAttribute('pattern', '[0-9]*');
-    });
-  }
-  patchInputs();
-  var obs = new MutationObserver(patchInputs);
-  obs.observe(document.body, { childList: true, subtree: true });
-})();
-</script>
-""", unsafe_allow_html=True)
+inject_assets()
 try:
-    if st.session_state.view == "main":
-        main_view()
-    else:
-        add_view()
+    gastos.configure_secrets(st.secrets.to_dict())
+except Exception:   # sin secrets.toml: entorno / .env
+    pass
+gastos.enable_background_sync()
+gastos.enable_metrics_export()
+use_tenant(resolve_tenant())
+st.set_page_config(page_title=f"Gastos · {current_tenant().name}")
+gastos.get_client()   # inicializa el pool y registra errores de credenciales
+if gastos.connection_error() is not None:
+    st.error("❌ Error conectando con Google Sheets")
+    st.exception(gastos.connection_error())
+try:
+    with RERUN_SECONDS.time(view=st.session_state.view):
+        if st.session_state.view == "main":
+            main_view()
+        else:
+            add_view()
 except Exception:
+    FATAL_ERRORS.inc()
     st.error("Error fatal en la app")
     st.code(traceback.format_exc())
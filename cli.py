@@ -0,0 +1,314 @@
+# ============================================================
+# GESTOR DE GASTOS — línea de comandos
+# ============================================================
+# Tareas pesadas fuera del request de la app (cron, workers):
+#   python cli.py sync                    → envía pendientes y baja Sheets
+#   python cli.py rebuild-snapshot        → reconstruye el SQLite desde Sheets
+#   python cli.py export -y 2026 -m Marzo -o marzo.csv
+#   python cli.py export --desde 2026-01-15 --hasta 2026-02-28
+#   python cli.py stats  -y 2026 -m Marzo
+#   python cli.py report -y 2025 -y 2026 -f pdf -o reportes/   → una lámina por mes
+#   python cli.py fetch-fonts             → empaqueta las fuentes en static/fonts
+#   python cli.py bench --rows 10000 100000 1000000   → cadenas object vs Arrow
+#   python cli.py loadtest --sessions 1 5 10 20       → latencia de rerun con N sesiones
+#   python cli.py partition               → una hoja por año (Gastos_AAAA), con la app detenida
+# Con TENANTS configurado, --tenant EMAIL elige la hoja del usuario.
+# --metrics ARCHIVO deja las métricas del comando en formato Prometheus
+# (p. ej. para el textfile collector de node_exporter en un cron de sync).
+# ============================================================
+
+import argparse
+import contextlib
+import datetime as dt
+import hashlib
+import re
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import gastos
+import loadtest
+import metrics
+import reports
+from gastos import MESES_ORD, load_data, filter_data, compute_stats, now_peru
+
+
+def _store() -> "gastos.SQLiteBackend":
+    store = gastos.get_backend()
+    if not isinstance(store, gastos.SQLiteBackend):
+        sys.exit("Este comando requiere el almacén local (GASTOS_BACKEND=sqlite).")
+    return store
+
+
+def _print_ingest():
+    rep = gastos.ingest_report()
+    if rep is None:
+        return
+    print(f"Ingesta: {rep['cargadas']}/{rep['filas']} filas cargadas"
+          f" · {rep['fechas_inferidas']} fechas fuera de formato · {rep['fechas_ilegibles']} ilegibles")
+    for motivo, n in rep["descartadas"].items():
+        print(f"  descartadas ({motivo}): {n}")
+
+
+def cmd_sync(args) -> int:
+    store = _store()
+    sent  = store.sync.push()
+    changed = store.sync.pull()
+    print(f"Enviados a Sheets: {sent} · Copia local {'actualizada' if changed else 'sin cambios'}")
+    _print_ingest()
+    return 0
+
+
+def cmd_rebuild_snapshot(args) -> int:
+    store = _store()
+    gastos.thaw_partitions()   # releer también los años cerrados
+    store.sync.push()   # nada local se pierde al reemplazar
+    store.sync.pull()
+    df = store.load_ledger()
+    print(f"Snapshot reconstruido: {len(df)} gastos, {len(store.load_budgets())} presupuestos → {store.path}")
+    _print_ingest()
+    return 0
+
+
+def cmd_export(args) -> int:
+    df = load_data()
+    if args.desde is not None or args.hasta is not None:
+        df = gastos.get_backend().query_range(args.desde or dt.date.min,
+                                              args.hasta or now_peru().date())
+    elif args.year is not None or args.month is not None:
+        df = filter_data(df, args.month, args.year or now_peru().year)
+    data = gastos.export_csv(df)
+    if args.output == "-":
+        sys.stdout.write(data.decode())
+    else:
+        with open(args.output, "wb") as f:
+            f.write(data)
+        print(f"{len(df)} gastos → {args.output}")
+    return 0
+
+
+def cmd_stats(args) -> int:
+    df    = load_data()
+    dfm   = filter_data(df, args.month, args.year)
+    total = float(dfm["MONTO"].sum()) if not dfm.empty else 0.0
+    print(f"{args.month or 'Año'} {args.year}: S/ {total:,.2f}")
+    if args.month is None or dfm.empty:
+        return 0
+    stats  = compute_stats(dfm, total)
+    trends = gastos.get_analytics().month(args.year, args.month)
+    index  = gastos.get_streak_index()
+    print(f"  Movimientos   {stats['n_tx']}")
+    print(f"  Prom / día    S/ {stats['avg_day']:,.2f}")
+    print(f"  Proyección    S/ {stats['proj']:,.2f}")
+    print(f"  Top categoría {stats['top_cat']}")
+    print(f"  Últimos 7d    S/ {trends['roll_7d']:,.2f}")
+    print(f"  Últimos 30d   S/ {trends['roll_30d']:,.2f}")
+    print(f"  Racha         {index.current(now_peru().date())}d (récord {index.longest}d)")
+    return 0
+
+
+def cmd_report(args) -> int:
+    df   = gastos.load_columns(gastos.ANALYTICS_COLS)   # los reportes no leen descripción ni ID
+    jobs = reports.month_jobs(df, args.year or [now_peru().year], gastos.load_budgets(), args.format)
+    if not jobs:
+        print("Sin gastos en los años pedidos.")
+        return 0
+    t0    = time.perf_counter()
+    paths = reports.write_reports(reports.render_reports(jobs, args.jobs), args.output)
+    print(f"{len(paths)} reportes → {args.output} ({time.perf_counter() - t0:.1f}s)")
+    return 0
+
+
+def cmd_partition(args) -> int:
+    store = gastos.get_backend()
+    local = isinstance(store, gastos.SQLiteBackend)
+    if local:
+        store.sync.push()   # que no quede nada pendiente en la hoja vieja
+    res = gastos.migrate_to_partitions()
+    if not res["años"]:
+        print("Nada que migrar: el libro ya está particionado o vacío.")
+        return 0
+    if local:
+        store.sync.pull()   # la migración asigna IDs a las filas legacy
+    for year, n in res["años"].items():
+        print(f"  {gastos.PARTITION_PREFIX}{year}: {n} filas")
+    if res["sin_año"]:
+        print(f"  {res['sin_año']} filas sin año quedaron solo en {gastos.ARCHIVE_TITLE}")
+    print(f"Hoja original archivada como {gastos.ARCHIVE_TITLE}.")
+    return 0
+
+
+def cmd_fetch_fonts(args) -> int:
+    out = Path(__file__).parent / "static" / "fonts"
+    out.mkdir(parents=True, exist_ok=True)
+    # Google sirve woff2 solo a navegadores modernos
+    ua  = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0) AppleWebKit/605.1.15 "
+                         "(KHTML, like Gecko) Version/17.0 Safari/605.1.15"}
+    css = urllib.request.urlopen(urllib.request.Request(gastos.FONTS_CSS_URL, headers=ua), timeout=30) \
+                        .read().decode()
+
+    def _local(m: re.Match) -> str:
+        url  = m.group(1)
+        name = hashlib.sha1(url.encode()).hexdigest()[:12] + Path(url).suffix
+        if not (out / name).exists():
+            (out / name).write_bytes(urllib.request.urlopen(url, timeout=30).read())
+        return f"url({name})"
+
+    css = re.sub(r"url\((https://[^)]+)\)", _local, css)
+    (out / "fonts.css").write_text(css, encoding="utf-8")
+    print(f"{len(list(out.glob('*.woff2')))} archivos de fuente → {out}")
+    return 0
+
+
+def _synthetic_columns(n: int, seed: int = 0) -> dict:
+    """Ledger sintético con la forma de _read_columns(): seriales, números y texto."""
+    rng  = np.random.default_rng(seed)
+    days = rng.integers(0, 6 * 365, n)
+    fech = pd.Timestamp("2020-01-01") + pd.to_timedelta(days, unit="D")
+    words = np.array(["almuerzo", "taxi", "cine", "farmacia", "mercado", "luz", "agua", "regalo"])
+    return {
+        "FECHA":       pd.Series((days + 43831).astype(float), dtype=object),   # serial de Sheets
+        "MES":         pd.Series(np.array(MESES_ORD)[fech.month - 1], dtype=object),
+        "AÑO":         pd.Series(fech.year.to_numpy(), dtype=object),
+        "CATEGORÍA":   pd.Series(rng.choice(gastos.VALID_CATS, n), dtype=object),
+        "DESCRIPCION": pd.Series(np.char.add(rng.choice(words, n), rng.integers(0, 500, n).astype(str)),
+                                 dtype=object),
+        "MONTO":       pd.Series(rng.gamma(2.0, 15.0, n).round(2) + 0.1, dtype=object),
+        "ID":          pd.Series([f"{i:08x}" for i in range(n)], dtype=object),
+    }
+
+
+@contextlib.contextmanager
+def _str_storage(dtype):
+    prev, gastos.STR_DTYPE = gastos.STR_DTYPE, dtype
+    try:
+        yield
+    finally:
+        gastos.STR_DTYPE = prev
+
+
+def _timed(fn, repeat: int = 3) -> tuple[float, object]:
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0  = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, out
+
+
+def cmd_bench(args) -> int:
+    print(f"{'filas':>9} {'cadenas':>7} {'ingesta':>10} {'memoria':>10} {'búsqueda':>10} {'CSV':>10}")
+    for n in args.rows:
+        cu = _synthetic_columns(n)
+        for label, dtype in (("object", object), ("arrow", gastos.STR_DTYPE)):
+            with _str_storage(dtype):
+                t_ing, (df, _) = _timed(lambda: gastos._ingest(cu), repeat=1)
+                t_sea, _       = _timed(lambda: gastos._search(df, args.query))
+                t_csv, _       = _timed(lambda: gastos.export_csv(df), repeat=1)
+            mem = df.memory_usage(deep=True).sum() / 2**20
+            print(f"{n:>9,} {label:>7} {t_ing:>8.0f}ms {mem:>8.1f}MB {t_sea:>8.1f}ms {t_csv:>8.0f}ms")
+    return 0
+
+
+def _print_level(res: dict):
+    p50, p95, p99 = res["pcts"]
+    rss = f"{res['rss_mb']:>7.0f}MB" if res["rss_mb"] is not None else f"{'n/d':>9}"
+    print(f"{res['sesiones']:>8} {res['reruns']:>7} {res['rps']:>7.1f} {p50:>7.0f}ms {p95:>7.0f}ms"
+          f" {p99:>7.0f}ms {rss} {res['errores']:>7} {res['caidas']:>6}", flush=True)
+
+
+def cmd_loadtest(args) -> int:
+    try:
+        import websockets  # noqa: F401  (cliente del protocolo del navegador)
+    except ImportError:
+        sys.exit("loadtest necesita el paquete websockets: pip install websockets")
+    print(f"Servidor con {args.rows:,} gastos · Sheets a {args.latency:.0f}ms · backend {args.backend}"
+          f" · {args.duration:.0f}s por nivel")
+    print(f"{'sesiones':>8} {'reruns':>7} {'rerun/s':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'RSS':>9}"
+          f" {'errores':>7} {'caídas':>6}")
+    levels = loadtest.run(args.sessions, args.duration, args.rows, args.latency / 1000, args.think / 1000,
+                          args.backend, on_level=_print_level)
+    last = levels[-1]
+    print(f"\nPor acción con {last['sesiones']} sesiones:")
+    for accion, (n, p50, p95, p99) in last["acciones"].items():
+        print(f"  {accion:<8} {n:>5} reruns · p50 {p50:>6.0f}ms · p95 {p95:>6.0f}ms · p99 {p99:>6.0f}ms")
+    return 1 if any(r["errores"] or r["caidas"] for r in levels) else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    now = now_peru()
+    parser = argparse.ArgumentParser(prog="cli.py", description="Gestor de gastos sin interfaz.")
+    parser.add_argument("--tenant", metavar="EMAIL", help="usuario (modo multiusuario)")
+    parser.add_argument("--metrics", metavar="ARCHIVO", help="escribe las métricas al terminar (formato Prometheus)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("sync", help="envía cambios locales y descarga Sheets").set_defaults(func=cmd_sync)
+    sub.add_parser("rebuild-snapshot", help="reconstruye el almacén local desde Sheets") \
+       .set_defaults(func=cmd_rebuild_snapshot)
+
+    p = sub.add_parser("export", help="exporta gastos a CSV")
+    p.add_argument("-y", "--year", type=int)
+    p.add_argument("-m", "--month", choices=MESES_ORD)
+    p.add_argument("--desde", type=dt.date.fromisoformat, metavar="AAAA-MM-DD", help="rango de fechas (incluido)")
+    p.add_argument("--hasta", type=dt.date.fromisoformat, metavar="AAAA-MM-DD")
+    p.add_argument("-o", "--output", default="-", help="archivo de salida (- = stdout)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("stats", help="resumen de un mes o un año")
+    p.add_argument("-y", "--year", type=int, default=now.year)
+    p.add_argument("-m", "--month", choices=MESES_ORD, default=MESES_ORD[now.month - 1])
+    p.add_argument("--whole-year", dest="month", action="store_const", const=None,
+                   help="total del año en lugar de un mes")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("report", help="láminas mensuales (total, donut, histórico) en paralelo")
+    p.add_argument("-y", "--year", type=int, action="append", help="año (repetible; por defecto el actual)")
+    p.add_argument("-f", "--format", choices=reports.REPORT_FORMATS, default="png")
+    p.add_argument("-o", "--output", default="reportes", help="carpeta de salida")
+    p.add_argument("-j", "--jobs", type=int, help="procesos (por defecto, uno por núcleo)")
+    p.set_defaults(func=cmd_report)
+
+    sub.add_parser("partition", help="migra la hoja única a una hoja por año") \
+       .set_defaults(func=cmd_partition)
+
+    p = sub.add_parser("bench", help="mide ingesta, memoria, búsqueda y CSV en ledgers sintéticos")
+    p.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--query", default="taxi1", help="texto del buscador")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("loadtest", help="sesiones simultáneas contra la app con Sheets en memoria")
+    p.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20], help="niveles de concurrencia")
+    p.add_argument("--duration", type=float, default=30.0, help="segundos por nivel")
+    p.add_argument("--rows", type=int, default=5000, help="gastos sembrados en la hoja falsa")
+    p.add_argument("--latency", type=float, default=200.0, help="ms por llamada a la hoja falsa")
+    p.add_argument("--think", type=float, default=0.0, help="ms de pausa media entre acciones")
+    p.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    p.set_defaults(func=cmd_loadtest)
+
+    sub.add_parser("fetch-fonts", help="descarga Inter y JetBrains Mono a static/fonts") \
+       .set_defaults(func=cmd_fetch_fonts)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.tenant:
+        tenant = gastos.get_tenants().get(args.tenant.strip().lower())
+        if tenant is None:
+            sys.exit(f"Tenant desconocido: {args.tenant}")
+        gastos.use_tenant(tenant)
+    if gastos.get_client() is None and gastos.connection_error() is not None:
+        print(f"Aviso: sin conexión con Google Sheets ({gastos.connection_error()})", file=sys.stderr)
+    try:
+        return args.func(args)
+    finally:
+        if args.metrics:
+            metrics.write_file(args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
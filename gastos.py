@@ -0,0 +1,2749 @@
+# ============================================================
+# GESTOR DE GASTOS — capa de datos
+# ============================================================
+# Todo lo que no es interfaz: Sheets, almacén local, cachés, rachas y
+# analítica. No importa Streamlit, así que lo pueden usar la app, el CLI
+# (cli.py), jobs programados o benchmarks. El estado vive a nivel de
+# módulo y dura lo que el proceso.
+# ============================================================
+
+import datetime as dt
+import gspread
+from google.oauth2.service_account import Credentials
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import pathlib
+import tomllib
+import hashlib
+import itertools
+import collections
+import contextvars
+import sqlite3
+import uuid
+import io
+import bisect
+import calendar
+import math
+import contextlib
+import time
+import threading
+import functools
+import logging
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import metrics
+
+# ============================================================
+# 1) CONFIG
+# ============================================================
+env_path = pathlib.Path(".") / ".env"
+if not env_path.exists():
+    env_path = pathlib.Path(".") / ".env.local"
+load_dotenv(dotenv_path=env_path)
+_LOGGER = logging.getLogger(__name__)
+
+SHEET_NAME = "Gastos_Diarios"
+
+# ============================================================
+# 2) CONSTANTES
+# ============================================================
+MESES_ORD = [
+    "Enero","Febrero","Marzo","Abril","Mayo","Junio",
+    "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre",
+]
+DIAS_ORD = ["LUNES","MARTES","MIÉRCOLES","JUEVES","VIERNES","SÁBADO","DOMINGO"]
+
+TZ_OFFSET = dt.timezone(dt.timedelta(hours=-5))  # Perú UTC-5
+
+CATEGORIES = {
+    "Alimentación":      ("🍽️", "#00E054"),
+    "Transporte":        ("🚗", "#00F0FF"),
+    "Salud":             ("💊", "#FFC700"),
+    "Trabajo":           ("💼", "#FF4B4B"),
+    "Ocio":              ("🎵", "#FFFFFF"),
+    "Casa":              ("🏠", "#A259FF"),
+    "Inversión":         ("📈", "#4A90E2"),
+    "Pareja":            ("❤️", "#FF69B4"),
+    "Estudios":          ("📚", "#F5A623"),
+    "Viaje":             ("✈️", "#50E3C2"),
+    "Frutas":            ("🍎", "#7ED321"),
+    "Golosinas":         ("🍬", "#FF8AD8"),
+    "Compras Generales": ("🛒", "#B8E986"),
+    "Otros":             ("📦", "#888888"),
+}
+
+VALID_CATS  = list(CATEGORIES.keys())
+ICON_MAP    = {k: v[0] for k, v in CATEGORIES.items()}
+COLORS_MAP  = {k: v[1] for k, v in CATEGORIES.items()}
+CAT_ALIASES = {"Comida": "Alimentación", "comida": "Alimentación"}
+
+# Tipografías del tema; `cli.py fetch-fonts` las empaqueta en static/fonts
+FONTS_CSS_URL = ("https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800;900"
+                 "&family=JetBrains+Mono:wght@500;700&display=swap")
+
+# ============================================================
+# 3) MULTIUSUARIO
+# ============================================================
+# Sin TENANTS en secrets la app es de un solo usuario (SHEET_NAME).
+# Con TENANTS, cada usuario autenticado (st.login) usa su propia hoja:
+#   TENANTS = '{"ana@mail.com": {"sheet": "Gastos_Ana", "name": "Ana"}}'
+# Todo el estado por proceso (cachés, índices, almacén local) cuelga de
+# un registro por tenant con desalojo LRU y techo global de memoria.
+OWNER_NAME          = "Andrés"
+SHEETS_POOL_SIZE    = int(os.getenv("GASTOS_SHEETS_POOL", "4"))
+TENANT_MAX_ACTIVE   = int(os.getenv("GASTOS_TENANT_MAX", "32"))
+TENANT_MEMORY_LIMIT = int(os.getenv("GASTOS_TENANT_MEMORY_MB", "512")) * 1024 * 1024
+
+
+class Tenant:
+    def __init__(self, key: str, sheet: str, name: str):
+        self.key   = key     # identificador estable (archivos locales, cachés)
+        self.sheet = sheet   # nombre del spreadsheet en Google Drive
+        self.name  = name    # nombre para el saludo
+
+
+DEFAULT_TENANT = Tenant("default", SHEET_NAME, OWNER_NAME)
+_TENANT        = contextvars.ContextVar("tenant", default=DEFAULT_TENANT)
+
+
+# Secretos: lo que pase la app (st.secrets), luego variables de entorno
+# y por último .streamlit/secrets.toml, para que el CLI vea lo mismo.
+_SECRETS: dict = {}
+SECRETS_FILE   = pathlib.Path(".streamlit") / "secrets.toml"
+
+
+def configure_secrets(secrets):
+    """Usa estos secretos para el proceso (la app le pasa st.secrets)."""
+    global _TENANTS
+    secrets = dict(secrets)
+    if secrets != _SECRETS:
+        _SECRETS.clear()
+        _SECRETS.update(secrets)
+        _TENANTS = None
+
+
+def _secret(key: str, default=None):
+    if key in _SECRETS:
+        return _SECRETS[key]
+    if key in os.environ:
+        return os.environ[key]
+    try:
+        with open(SECRETS_FILE, "rb") as f:
+            return tomllib.load(f).get(key, default)
+    except (OSError, tomllib.TOMLDecodeError):
+        return default
+
+
+def _load_tenants() -> dict:
+    raw = _secret("TENANTS") or os.getenv("GASTOS_TENANTS")
+    if not raw:
+        return {}
+    conf = json.loads(raw) if isinstance(raw, str) else dict(raw)
+    out  = {}
+    for email, t in conf.items():
+        email = email.strip().lower()
+        key   = hashlib.sha1(email.encode()).hexdigest()[:12]
+        out[email] = Tenant(key, t["sheet"], t.get("name") or email.split("@")[0].capitalize())
+    return out
+
+
+_TENANTS = None
+
+
+def get_tenants() -> dict:
+    """{email: Tenant}; vacío en modo de un solo usuario."""
+    global _TENANTS
+    if _TENANTS is None:
+        _TENANTS = _load_tenants()
+    return _TENANTS
+
+
+def current_tenant() -> Tenant:
+    return _TENANT.get()
+
+
+def use_tenant(tenant: Tenant):
+    """Fija el tenant del contexto actual (sesión, hilo o comando)."""
+    _TENANT.set(tenant)
+
+
+def _nbytes(value, seen: set | None = None) -> int:
+    """
+    Tamaño aproximado en memoria de un valor cacheado. Recorre dicts,
+    listas, tuplas y los atributos de los índices (StreakIndex,
+    LedgerIndex...); un Future cuenta su resultado si ya terminó. Lo
+    compartido se cuenta una sola vez.
+    """
+    seen = set() if seen is None else seen
+    if value is None or id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, Future):
+        ok = value.done() and not value.cancelled() and value.exception() is None
+        return _nbytes(value.result(), seen) if ok else 0
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_nbytes(k, seen) + _nbytes(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(_nbytes(v, seen) for v in value)
+    attrs = getattr(value, "__dict__", None)
+    if attrs is None and hasattr(type(value), "__slots__"):
+        attrs = {k: getattr(value, k, None) for k in type(value).__slots__}
+    if isinstance(attrs, dict) and not isinstance(value, type):
+        return sys.getsizeof(value) + _nbytes(attrs, seen)
+    return sys.getsizeof(value)
+
+
+class TenantRegistry:
+    """Estado por tenant con desalojo LRU por cantidad y por memoria.
+
+    Cada estado es un dict: "swr" (slots de caché), "derived" (índices y
+    agregados), "nbytes" (tamaño declarado de cada entrada), "backend",
+    handles de Sheets e "ingest" (reporte de la última descarga). Al desalojar se detiene su sincronización; el
+    tenant se recarga en frío si vuelve a aparecer.
+
+    El límite de memoria suma lo declarado con account(): el ledger y los
+    presupuestos, los años congelados, los índices (rachas, categorías,
+    filas por ID, por fecha), la analítica, la matriz de presupuesto, los
+    meses del prefetch y las guardas de guardado. El SQLite local vive en
+    disco y no cuenta.
+    """
+
+    def __init__(self, max_active: int, max_bytes: int):
+        self.max_active = max_active
+        self.max_bytes  = max_bytes
+        self._lock      = threading.RLock()
+        self._states    = collections.OrderedDict()
+
+    def state(self, tenant: Tenant) -> dict:
+        with self._lock:
+            st_ = self._states.get(tenant.key)
+            if st_ is None:
+                st_ = {
+                    "tenant":  tenant,
+                    "lock":    threading.RLock(),
+                    "swr":     {},
+                    "derived": {},
+                    "nbytes":  {},
+                    "backend": None,
+                    "handles": {},
+                    "ingest":  None,
+                }
+                self._states[tenant.key] = st_
+            self._states.move_to_end(tenant.key)
+            return st_
+
+    def account(self, tenant: Tenant, name: str, value):
+        """Declara el tamaño de una entrada y aplica los límites."""
+        size = _nbytes(value)
+        with self._lock:
+            st_ = self._states.get(tenant.key)
+            if st_ is None:
+                return     # ya desalojado (p. ej. un prefetch que terminó tarde)
+            st_["nbytes"][name] = size
+            self._enforce()
+
+    def total_bytes(self) -> int:
+        return sum(sum(s["nbytes"].values()) for s in self._states.values())
+
+    def _enforce(self):
+        # Nunca se desaloja el tenant más reciente (el que está pidiendo)
+        while len(self._states) > 1 and (
+            len(self._states) > self.max_active or self.total_bytes() > self.max_bytes
+        ):
+            _, evicted = self._states.popitem(last=False)
+            backend = evicted.get("backend")
+            if backend is not None:
+                backend.close()
+
+
+_REGISTRY = TenantRegistry(TENANT_MAX_ACTIVE, TENANT_MEMORY_LIMIT)
+metrics.gauge("gastos_tenants_active", "Tenants con estado en memoria", lambda: len(_REGISTRY._states))
+metrics.gauge("gastos_cache_bytes", "Bytes declarados por las cachés de todos los tenants",
+              lambda: _REGISTRY.total_bytes())
+
+
+def _tenant_registry() -> TenantRegistry:
+    return _REGISTRY
+
+
+def _tenant_state() -> dict:
+    return _tenant_registry().state(current_tenant())
+
+
+def _account(name: str, value):
+    """account() para el tenant actual."""
+    _tenant_registry().account(current_tenant(), name, value)
+
+
+def _spawn(target, name: str, *args) -> threading.Thread:
+    """Hilo de fondo que hereda el tenant (contextvars) de quien lo lanza."""
+    ctx = contextvars.copy_context()
+    th  = threading.Thread(target=ctx.run, args=(target, *args), name=name, daemon=True)
+    th.start()
+    return th
+
+
+# ============================================================
+# 4) GOOGLE SHEETS
+# ============================================================
+# ── Métricas ────────────────────────────────────────────────
+# Cada request a la API (por operación y código HTTP, 429 incluido), las
+# cachés y las excepciones que la capa de datos atrapa sin propagar.
+# Se exponen con enable_metrics_export() o `cli.py --metrics ARCHIVO`.
+_SHEETS_REQUESTS = metrics.counter("gastos_sheets_requests_total",
+                                   "Requests a la API de Sheets/Drive por operación y código",
+                                   ("op", "status"))
+_SHEETS_SECONDS  = metrics.histogram("gastos_sheets_request_seconds",
+                                     "Latencia de la API de Sheets/Drive (con reintentos)", ("op",))
+_CACHE_REQUESTS  = metrics.counter("gastos_cache_requests_total",
+                                   "Lecturas de caché: hit, stale (servido vencido), wait o miss",
+                                   ("cache", "result"))
+_CACHE_REFILLS   = metrics.counter("gastos_cache_refills_total",
+                                   "Recargas: ok, error, primed (vino con otra lectura) o discarded (hubo un clear)",
+                                   ("cache", "result"))
+_CACHE_SECONDS   = metrics.histogram("gastos_cache_load_seconds",
+                                     "Duración de la carga de un valor cacheado (red + ingesta)", ("cache",))
+_SWALLOWED       = metrics.counter("gastos_swallowed_errors_total",
+                                   "Excepciones atrapadas en la capa de datos sin propagar",
+                                   ("where", "error"))
+
+_SHEETS_VERBS = {"append": "append", "batchGet": "batch_get", "batchUpdate": "batch_update",
+                 "clear": "clear", "batchClear": "batch_clear", "copyTo": "copy_to"}
+
+
+def _swallowed(where: str, e: BaseException):
+    _SWALLOWED.inc(where=where, error=type(e).__name__)
+
+
+def _sheets_op(method: str, endpoint: str) -> str:
+    """GET …/values/Hoja1!A:G → values_get · POST …:batchUpdate → spreadsheet_batch_update."""
+    path = endpoint.split("?")[0]
+    if "/drive/" in path:
+        return f"drive_{method.lower()}"
+    verb = _SHEETS_VERBS.get(path.rsplit(":", 1)[-1])
+    kind = "values" if "/values" in path else "spreadsheet"
+    return f"{kind}_{verb or method.lower()}"
+
+
+def _instrument(client):
+    """Mide cada request del cliente gspread (su http_client es el único camino a la red)."""
+    http = getattr(client, "http_client", None)
+    if http is None or getattr(http, "_metered", False):
+        return client
+    request = http.request
+
+    def metered(method, endpoint, *args, **kwargs):
+        op, status, t0 = _sheets_op(method, endpoint), "error", time.perf_counter()
+        try:
+            resp   = request(method, endpoint, *args, **kwargs)
+            status = str(resp.status_code)
+            return resp
+        except gspread.exceptions.APIError as e:
+            status = str(e.code)
+            raise
+        finally:
+            _SHEETS_SECONDS.observe(time.perf_counter() - t0, op=op)
+            _SHEETS_REQUESTS.inc(op=op, status=status)
+
+    http.request, http._metered = metered, True
+    return client
+
+
+class ClientPool:
+    """Pool de clientes gspread autorizados, repartidos en round-robin.
+
+    Cada cliente tiene su propia sesión HTTP, así las sesiones y los
+    hilos de sync de distintos tenants no se serializan en una sola.
+    """
+
+    def __init__(self, creds, size: int):
+        self._creds   = creds
+        self._size    = max(1, size)
+        self._clients = []
+        self._next    = itertools.count()
+        self._lock    = threading.Lock()
+
+    def get(self) -> gspread.Client:
+        with self._lock:
+            i = next(self._next) % self._size
+            if i >= len(self._clients):
+                self._clients.append(_instrument(gspread.authorize(self._creds)))
+                i = len(self._clients) - 1
+            return self._clients[i]
+
+
+_POOL       = None
+_POOL_ERROR = None
+_POOL_LOCK  = threading.Lock()
+
+
+def _client_pool():
+    """Pool del proceso; si las credenciales fallan se recuerda el error."""
+    global _POOL, _POOL_ERROR
+    with _POOL_LOCK:
+        if _POOL is None and _POOL_ERROR is None:
+            try:
+                scope = [
+                    "https://www.googleapis.com/auth/spreadsheets",
+                    "https://www.googleapis.com/auth/drive",
+                ]
+                info  = _secret("GCP_SERVICE_ACCOUNT")
+                info  = json.loads(info) if isinstance(info, str) else dict(info)
+                creds = Credentials.from_service_account_info(info, scopes=scope)
+                pool  = ClientPool(creds, SHEETS_POOL_SIZE)
+                pool.get()   # valida las credenciales ya
+                _POOL = pool
+            except Exception as e:
+                _POOL_ERROR = e
+                _swallowed("credentials", e)
+        return _POOL
+
+
+def use_client_pool(pool):
+    """Reemplaza el pool del proceso; loadtest.py instala uno con Sheets en memoria."""
+    global _POOL, _POOL_ERROR
+    with _POOL_LOCK:
+        _POOL, _POOL_ERROR = pool, None
+
+
+def connection_error():
+    """Excepción al conectar con Google Sheets, o None."""
+    return _POOL_ERROR
+
+
+def get_client():
+    pool = _client_pool()
+    return pool.get() if pool else None
+
+
+def open_spreadsheet():
+    """Spreadsheet del tenant actual; el handle se reutiliza entre llamadas.
+
+    client.open() hace una búsqueda en Drive; guardarlo ahorra esa
+    llamada en cada lectura o escritura.
+    """
+    handles = _tenant_state()["handles"]
+    ss = handles.get("spreadsheet")
+    if ss is None:
+        client = get_client()
+        if not client:
+            return None
+        ss = handles["spreadsheet"] = client.open(current_tenant().sheet)
+    return ss
+
+
+def _ledger_sheet():
+    handles = _tenant_state()["handles"]
+    ws = handles.get("ledger")
+    if ws is None:
+        ss = open_spreadsheet()
+        if ss is None:
+            return None
+        ws = handles["ledger"] = ss.sheet1
+    return ws
+
+
+def normalize_mes(m):
+    if not isinstance(m, str):
+        return None
+    return {k.lower(): k for k in MESES_ORD}.get(m.strip().lower(), m.strip().capitalize())
+
+
+def normalize_cat(c):
+    c = str(c).strip()
+    return CAT_ALIASES.get(c, c if c in VALID_CATS else "Otros")
+
+
+# ── Caché stale-while-revalidate ────────────────────────────
+# Con st.cache_data, al vencer el TTL el siguiente clic espera la descarga
+# completa del Sheet. Aquí se sirve siempre el último valor bueno y, si ya
+# pasó su ventana de frescura, se refresca en un hilo de fondo: el próximo
+# rerun recoge los datos nuevos. Solo la primera carga espera a la red.
+# Si esa primera carga falla no se cachea nada: se sirve el valor vacío y
+# se reintenta en primer plano pasados SWR_RETRY_BACKOFF segundos.
+SWR_RETRY_BACKOFF = 10.0   # s
+
+
+def _swr_slot(name: str) -> dict:
+    """Estado de una función SWR para el tenant actual (sobrevive a los reruns)."""
+    slots = _tenant_state()["swr"]
+    if name not in slots:
+        slots.setdefault(name, {
+            "lock":       threading.RLock(),
+            "value":      None,
+            "fetched_at": None,    # time.monotonic() de la última carga
+            "version":    0,       # sube con cada clear() o recarga de fondo
+            "refreshing": False,
+            "retry_at":   None,    # tras una primera carga fallida, cuándo reintentar
+        })
+    return slots[name]
+
+
+class _SWRFunction:
+    def __init__(self, fn, ttl: float, fallback, share=None):
+        functools.update_wrapper(self, fn)
+        self._fn       = fn
+        self._ttl      = ttl
+        self._fallback = fallback
+        self._share    = share or (lambda v: v)   # lo que recibe cada llamada
+
+    @property
+    def _slot(self) -> dict:
+        return _swr_slot(self._fn.__name__)
+
+    def __call__(self):
+        return self.snapshot()[0]
+
+    def snapshot(self) -> tuple:
+        """
+        (valor, versión) leídos juntos bajo el lock: lo que se derive del
+        valor queda etiquetado con la versión de ese mismo valor y no con
+        la de un write que llegó entre medio.
+        """
+        slot, name = self._slot, self._fn.__name__
+        with slot["lock"]:
+            if slot["fetched_at"] is None:
+                # Primera carga: la única que bloquea
+                _CACHE_REQUESTS.inc(cache=name, result="miss")
+                if slot["retry_at"] is not None and time.monotonic() < slot["retry_at"]:
+                    return self._share(self._fallback()), slot["version"]
+                try:
+                    with _CACHE_SECONDS.time(cache=name):
+                        value = self._fn()
+                except Exception as e:
+                    # Sin cachear: el vacío no debe servirse todo un TTL ni
+                    # recibir patch() de writes. Es una versión propia, así
+                    # lo derivado de él no sobrevive a la carga buena.
+                    _swallowed(f"swr_load:{name}", e)
+                    slot["retry_at"]  = time.monotonic() + SWR_RETRY_BACKOFF
+                    slot["version"]  += 1
+                    return self._share(self._fallback()), slot["version"]
+                self._store(slot, value, bump=slot["retry_at"] is not None)
+                slot["retry_at"] = None
+                version = slot["version"]
+                _tenant_registry().account(current_tenant(), name, value)
+                return self._share(value), version
+            if time.monotonic() - slot["fetched_at"] > self._ttl:
+                _CACHE_REQUESTS.inc(cache=name, result="stale")
+                if not slot["refreshing"]:
+                    slot["refreshing"] = True
+                    _spawn(self._refresh, f"swr-{name}", slot, slot["version"])
+            else:
+                _CACHE_REQUESTS.inc(cache=name, result="hit")
+            return self._share(slot["value"]), slot["version"]
+
+    def _refresh(self, slot: dict, version: int):
+        name = self._fn.__name__
+        try:
+            with _CACHE_SECONDS.time(cache=name):
+                value = self._fn()
+        except Exception as e:
+            _swallowed(f"swr_refresh:{name}", e)
+            value = None   # se mantiene el último valor bueno
+        with slot["lock"]:
+            slot["refreshing"] = False
+            if slot["version"] != version:
+                _CACHE_REFILLS.inc(cache=name, result="discarded")
+                return     # hubo un clear() mientras tanto: descartar
+            _CACHE_REFILLS.inc(cache=name, result="error" if value is None else "ok")
+            if value is None:
+                slot["fetched_at"] = time.monotonic()
+                return
+            self._store(slot, value)
+        _tenant_registry().account(current_tenant(), self._fn.__name__, value)
+
+    @staticmethod
+    def _store(slot: dict, value, bump: bool = True):
+        # La recarga tras un clear() materializa la versión que abrió clear(),
+        # así los índices parchados tras un write siguen siendo válidos.
+        slot["value"]      = value
+        slot["fetched_at"] = time.monotonic()
+        if bump:
+            slot["version"] += 1
+
+    @property
+    def version(self) -> int:
+        """Versión de los datos servidos; cambia con cada recarga o clear()."""
+        return self._slot["version"]
+
+    def patch(self, delta) -> int | None:
+        """
+        Aplica un delta al valor cacheado sin volver a leer la fuente.
+        Sube la versión (así se descartan recargas de fondo en vuelo y se
+        invalidan las vistas derivadas) pero conserva fetched_at: la
+        reconciliación con la fuente llega con el siguiente refresco por TTL.
+        Devuelve la versión nueva (la anterior es esa - 1), o None si no hay
+        valor cacheado; la próxima llamada lo carga.
+        """
+        slot = self._slot
+        with slot["lock"]:
+            if slot["fetched_at"] is None:
+                return None
+            value = slot["value"] = delta(slot["value"])
+            slot["version"] += 1
+            version = slot["version"]
+        _tenant_registry().account(current_tenant(), self._fn.__name__, value)
+        return version
+
+    def prime(self, value, version: int) -> bool:
+        """
+        Guarda un valor leído por otra función (p. ej. junto con el ledger).
+        Si la versión cambió desde que empezó esa lectura (un write o un
+        clear() en medio) el valor ya es viejo y se descarta.
+        """
+        slot, name = self._slot, self._fn.__name__
+        with slot["lock"]:
+            if slot["version"] != version:
+                _CACHE_REFILLS.inc(cache=name, result="discarded")
+                return False
+            _CACHE_REFILLS.inc(cache=name, result="primed")
+            self._store(slot, value, bump=slot["fetched_at"] is not None or slot["retry_at"] is not None)
+            slot["retry_at"] = None
+        _tenant_registry().account(current_tenant(), name, value)
+        return True
+
+    def clear(self):
+        """Descarta el valor: la próxima llamada vuelve a leer del Sheet."""
+        slot = self._slot
+        with slot["lock"]:
+            slot["value"]      = None
+            slot["fetched_at"] = None
+            slot["retry_at"]   = None
+            slot["version"]   += 1
+        _tenant_registry().account(current_tenant(), self._fn.__name__, None)
+
+
+def swr_cache(ttl: float, fallback, share=None):
+    """
+    Decorador: como st.cache_data(ttl=...), pero sin bloquear al vencer.
+    A diferencia de st.cache_data no hay pickle por llamada: todas las
+    sesiones del tenant reciben el mismo valor, pasado por share() si se da.
+    """
+    return lambda fn: _SWRFunction(fn, ttl, fallback, share)
+
+
+# ── Ingesta columnar ────────────────────────────────────────
+# Una sola lectura del rango con valores sin formato, por columnas: los
+# montos llegan como números, las fechas-celda como serial de Sheets y
+# el texto tal cual. El frame se arma columna a columna (sin un dict por
+# fila) y las fechas se parsean con el formato conocido; la inferencia
+# lenta solo corre sobre el residuo que no encaja.
+_SHEETS_EPOCH = pd.Timestamp("1899-12-30")
+_DATE_FMT     = "%d/%m/%Y"
+
+
+def _read_raw(sheet) -> list:
+    """Columnas crudas (encabezado incluido) con una lectura UNFORMATTED_VALUE."""
+    return sheet.get_values(major_dimension=gspread.utils.Dimension.cols,
+                            value_render_option=gspread.utils.ValueRenderOption.unformatted)
+
+
+def _read_columns(sheet) -> dict:
+    """{ENCABEZADO: valores} con una lectura UNFORMATTED_VALUE por columnas."""
+    return _columns(_read_raw(sheet))
+
+
+def _columns(cols: list) -> dict:
+    """Columnas crudas (encabezado + valores) → {ENCABEZADO: Series}, rellenas a la misma altura."""
+    out = {}
+    for col in cols:
+        if col and str(col[0]).strip():
+            out.setdefault(str(col[0]).strip().upper(), col[1:])
+    n = max((len(v) for v in out.values()), default=0)
+    return {k: pd.Series(v + [""] * (n - len(v)), dtype=object) for k, v in out.items()}
+
+
+def _parse_fechas(raw: pd.Series) -> tuple[pd.Series, int]:
+    """Serial de Sheets o texto dd/mm/aaaa; el resto pasa por inferencia. → (fechas, n_fallback)"""
+    out    = pd.Series(pd.NaT, index=raw.index, dtype="datetime64[us]")
+    serial = pd.to_numeric(raw, errors="coerce")
+    hit    = serial.notna()
+    out[hit] = (_SHEETS_EPOCH + pd.to_timedelta(serial[hit].astype(float), unit="D")).dt.normalize()
+
+    text   = raw[~hit].astype(str).str.strip()
+    text   = text[text != ""]
+    parsed = pd.to_datetime(text, format=_DATE_FMT, errors="coerce")
+    out[parsed.index] = parsed
+    residue = parsed.index[parsed.isna()]
+    if len(residue):
+        iso  = pd.to_datetime(text[residue], format="ISO8601", errors="coerce")
+        rest = iso.index[iso.isna()]
+        out[iso.index] = iso
+        out[rest] = pd.to_datetime(text[rest], format="mixed", dayfirst=True, errors="coerce")
+    return out, len(residue)
+
+
+def _parse_montos(raw: pd.Series) -> pd.Series:
+    """Números tal cual; solo el texto con separadores de miles se limpia."""
+    num  = pd.to_numeric(raw, errors="coerce")
+    rest = raw[num.isna() & raw.ne("")]
+    if len(rest):
+        num[rest.index] = pd.to_numeric(rest.astype(str).str.replace(",", "", regex=False), errors="coerce")
+    return num.fillna(0.0).astype(float)
+
+
+def _by_unique(raw: pd.Series, fn) -> pd.Series:
+    """Aplica fn una vez por valor distinto (MES y CATEGORÍA repiten mucho)."""
+    return raw.map({v: fn(v) for v in raw.unique()})
+
+
+def ingest_report() -> dict | None:
+    """Resumen de la última descarga del ledger para el tenant actual."""
+    return _tenant_state()["ingest"]
+
+
+def _ingest(cu: dict, legacy_prefix: str = "legacy_") -> tuple[pd.DataFrame, dict]:
+    """Columnas crudas → (ledger normalizado, reporte de ingesta)."""
+    n = len(next(iter(cu.values()))) if cu else 0
+    if n == 0:
+        return pd.DataFrame(), {"filas": 0, "cargadas": 0, "descartadas": {}, "fechas_inferidas": 0,
+                                "fechas_ilegibles": 0}
+
+    df = pd.DataFrame(index=pd.RangeIndex(n))
+
+    # FECHA
+    if "FECHA" in cu:
+        df["FECHA"], inferidas = _parse_fechas(cu["FECHA"])
+    else:
+        df["FECHA"], inferidas = pd.Series(pd.NaT, index=df.index, dtype="datetime64[us]"), 0
+
+    # MES
+    df["MES"] = (
+        _by_unique(cu["MES"], normalize_mes).astype(STR_DTYPE) if "MES" in cu
+        else df["FECHA"].dt.month.map(lambda x: MESES_ORD[int(x)-1] if pd.notna(x) else None)
+    )
+
+    # AÑO
+    df["AÑO"] = (
+        pd.to_numeric(cu["AÑO"], errors="coerce").fillna(0).astype(int) if "AÑO" in cu
+        else df["FECHA"].dt.year.fillna(0).astype(int)
+    )
+
+    # CATEGORÍA
+    ccat = cu.get("CATEGORÍA", cu.get("CATEGORIA"))
+    df["CATEGORÍA"] = _by_unique(ccat, normalize_cat).astype(STR_DTYPE) if ccat is not None else "Otros"
+
+    # DESCRIPCION
+    cdesc = cu.get("DESCRIPCION", cu.get("DESCRIPCIÓN"))
+    df["DESCRIPCION"] = cdesc.astype(STR_DTYPE).str.strip() if cdesc is not None else ""
+
+    # MONTO
+    df["MONTO"] = _parse_montos(cu["MONTO"]) if "MONTO" in cu else 0.0
+
+    # ID — columna clave para eliminar de forma segura
+    if "ID" in cu:
+        df["ID"] = cu["ID"].astype(STR_DTYPE).str.strip()
+    else:
+        # Gastos legacy sin ID: asignamos temporal (no se puede borrar de forma segura)
+        df["ID"] = [f"{legacy_prefix}{i}" for i in range(len(df))]
+
+    # Filtro final + reporte de descartes (cada fila cuenta por su primer motivo)
+    vacias = np.logical_and.reduce([v.eq("").to_numpy() for v in cu.values()])
+    motivos = [("vacías", vacias), ("sin_año", df["AÑO"] <= 0),
+               ("sin_mes", df["MES"].isna()), ("monto_no_positivo", df["MONTO"] <= 0)]
+    drop, descartadas = pd.Series(False, index=df.index), {}
+    for motivo, mask in motivos:
+        nuevo = mask & ~drop
+        if nuevo.any():
+            descartadas[motivo] = int(nuevo.sum())
+        drop |= mask
+    df = _as_arrow(df[~drop])   # también las columnas que llegaron como constante
+    return df.reset_index(drop=True), {
+        "filas":            n,
+        "cargadas":         len(df),
+        "descartadas":      descartadas,
+        "fechas_inferidas": inferidas,
+        "fechas_ilegibles": int(df["FECHA"].isna().sum()),
+    }
+
+
+def _merge_reports(reports: list) -> dict:
+    out = {"filas": 0, "cargadas": 0, "descartadas": {}, "fechas_inferidas": 0, "fechas_ilegibles": 0}
+    for r in reports:
+        for k in ("filas", "cargadas", "fechas_inferidas", "fechas_ilegibles"):
+            out[k] += r[k]
+        for motivo, n in r["descartadas"].items():
+            out["descartadas"][motivo] = out["descartadas"].get(motivo, 0) + n
+    return out
+
+
+# ── Particiones por año ─────────────────────────────────────
+# Con el libro migrado (`cli.py partition`) cada año vive en su propia
+# hoja "Gastos_AAAA". Los años cerrados no cambian: se descargan una vez
+# por proceso y quedan congelados en memoria, así cada refresco solo lee
+# el año en curso (y los años nuevos). Varias particiones pendientes se
+# descargan en paralelo. Sin hojas "Gastos_AAAA" se usa la hoja única.
+PARTITION_PREFIX = "Gastos_"
+_PARTITION_RE    = re.compile(rf"^{PARTITION_PREFIX}(\d{{4}})$")
+ARCHIVE_TITLE    = "Archivo_Gastos_Diarios"
+
+
+def _partition_title(year: int) -> str:
+    return f"{PARTITION_PREFIX}{int(year)}"
+
+
+def _partitions(refresh: bool = False) -> dict | None:
+    """{año: worksheet} si el libro está particionado; None con la hoja única."""
+    handles = _tenant_state()["handles"]
+    if refresh or "partitions" not in handles:
+        ss = open_spreadsheet()
+        if ss is None:
+            return None
+        parts = {}
+        for ws in ss.worksheets():
+            m = _PARTITION_RE.match(ws.title)
+            if m:
+                parts[int(m.group(1))] = ws
+        handles["partitions"] = parts or None
+    return handles["partitions"]
+
+
+def _frozen() -> dict:
+    """{año cerrado: (ledger, reporte)} ya descargados."""
+    return _tenant_state()["derived"].setdefault("frozen", {})
+
+
+def thaw_partitions(year: int | None = None):
+    """Olvida los años congelados (o uno) para releerlos del Sheet."""
+    if year is None:
+        _frozen().clear()
+    else:
+        _frozen().pop(int(year), None)
+
+
+def _parallel(fn, items: list) -> list:
+    """map en un pool de hilos; cada tarea hereda el contexto (tenant)."""
+    if len(items) <= 1:
+        return [fn(it) for it in items]
+    with ThreadPoolExecutor(max_workers=min(SHEETS_POOL_SIZE, len(items))) as ex:
+        futures = [ex.submit(contextvars.copy_context().run, fn, it) for it in items]
+        return [f.result() for f in futures]
+
+
+# ── Índice de filas por ID ──────────────────────────────────
+# Cada lectura completa de una hoja del ledger deja {ID: fila} y
+# {ENCABEZADO: columna}: editar un gasto escribe directo en sus celdas,
+# sin volver a leer la hoja. Un alta suma su fila (si la API la informa)
+# y un borrado corre las de abajo; si el ID no aparece, se relee la hoja.
+_COL_ALIASES = {"CATEGORÍA": "CATEGORIA", "DESCRIPCION": "DESCRIPCIÓN"}
+_ROW_RE      = re.compile(r"![A-Z]+(\d+)")
+
+
+def _row_index() -> dict:
+    """{título de hoja: {"cols": {ENCABEZADO: columna 1..n}, "rows": {ID: fila}}}."""
+    return _tenant_state()["derived"].setdefault("rows", {})
+
+
+def _remember_rows(title: str, raw: list):
+    """Indexa las columnas crudas (encabezado incluido) de una hoja del ledger."""
+    cols = {}
+    for j, col in enumerate(raw):
+        h = str(col[0]).strip().upper() if col else ""
+        if h:
+            cols.setdefault(h, j + 1)
+    ids  = raw[cols["ID"] - 1][1:] if "ID" in cols else []
+    rows = {}
+    for i, v in enumerate(ids):
+        v = str(v).strip()
+        if v:
+            rows.setdefault(v, i + 2)
+    _row_index()[title] = {"cols": cols, "rows": rows}
+    _account("rows", _row_index())
+
+
+def _note_append(title: str, resp, gasto_id: str):
+    """Suma al índice la fila que append_row informa en updatedRange."""
+    idx = _row_index().get(title)
+    m   = _ROW_RE.search(str(((resp or {}).get("updates") or {}).get("updatedRange", "")))
+    if idx is not None and m:
+        idx["rows"][gasto_id] = int(m.group(1))
+        _account("rows", _row_index())
+
+
+def _note_delete(title: str, row: int):
+    """Tras borrar `row`, las filas de abajo suben una."""
+    idx = _row_index().get(title)
+    if idx is not None:
+        idx["rows"] = {k: v - (v > row) for k, v in idx["rows"].items() if v != row}
+        _account("rows", _row_index())
+
+
+def _fetch_sheet_ledger(read_many=None) -> pd.DataFrame:
+    """Descarga el ledger (hoja única o particiones) y lo normaliza. Lanza excepción si falla.
+
+    read_many(hojas) → [columnas crudas, en el mismo orden]; por defecto una
+    lectura por hoja en paralelo. _fetch_sheet_all() la reemplaza para pedir
+    las hojas junto con el presupuesto en un solo batchGet.
+    """
+    read_many = read_many or (lambda sheets: _parallel(_read_raw, sheets))
+    parts = _partitions(refresh=True)
+    if parts is None:
+        sheet = _ledger_sheet()
+        if not sheet:
+            raise RuntimeError("Sin credenciales.")
+        raw = read_many([sheet])[0]
+        _remember_rows(sheet.title, raw)
+        df, report = _ingest(_columns(raw))
+        _tenant_state()["ingest"] = report
+        return df
+
+    frozen  = _frozen()
+    pending = [y for y in sorted(parts) if y not in frozen]
+    fetched = {}
+    for y, raw in zip(pending, read_many([parts[y] for y in pending])):
+        _remember_rows(parts[y].title, raw)
+        fetched[y] = _ingest(_columns(raw), f"legacy_{y}_")
+    this_year = now_peru().year
+    for y, res in fetched.items():
+        if y < this_year:
+            frozen[y] = res
+    _account("frozen", frozen)
+    results = [fetched.get(y) or frozen[y] for y in sorted(parts)]
+    frames  = [df for df, _ in results if not df.empty]
+    _tenant_state()["ingest"] = _merge_reports([r for _, r in results])
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _ledger_row(data: dict, gasto_id: str) -> list:
+    """Fila de Gastos_Diarios para un gasto del formulario."""
+    return [
+        data["date"].strftime("%d/%m/%Y"),
+        MESES_ORD[data["date"].month - 1],
+        int(data["date"].year),
+        data["category"],
+        data["description"],
+        float(data["amount"]),
+        gasto_id,
+    ]
+
+
+def _partition_for(year: int):
+    """Hoja del año, creándola (con encabezado) si aún no existe."""
+    parts = _partitions()
+    if year not in parts:
+        parts = _partitions(refresh=True)
+    if year not in parts:
+        ws = open_spreadsheet().add_worksheet(title=_partition_title(year), rows=1000, cols=len(_LEDGER_COLS))
+        ws.update("A1", [_LEDGER_COLS])
+        parts[year] = ws
+    return parts[year]
+
+
+def _sheet_append(row: list):
+    if _partitions() is not None:
+        year = int(row[2])
+        ws   = _partition_for(year)
+        _note_append(ws.title, ws.append_row(row), row[6])
+        thaw_partitions(year)   # si era un año cerrado, se relee entero
+        return
+
+    sheet = _ledger_sheet()
+    if not sheet:
+        raise RuntimeError("Sin credenciales.")
+
+    # Asegurar que existe la columna ID en el header
+    headers = sheet.row_values(1)
+    if "ID" not in headers:
+        sheet.update_cell(1, len(headers) + 1, "ID")
+        _row_index().pop(sheet.title, None)
+    _note_append(sheet.title, sheet.append_row(row), row[6])
+
+
+def _delete_row(sheet, gasto_id: str) -> bool | None:
+    """Borra la fila con ese ID. False si no está; None si la hoja no tiene columna ID."""
+    values  = sheet.get_all_values()
+    headers = [h.strip().upper() for h in values[0]] if values else []
+    id_col  = next((i for i, h in enumerate(headers) if h == "ID"), None)
+    if id_col is None:
+        return None
+
+    row_to_delete = next(
+        (i + 2 for i, row in enumerate(values[1:])
+         if len(row) > id_col and str(row[id_col]).strip() == gasto_id),
+        None,
+    )
+    if row_to_delete is None:
+        return False
+    sheet.delete_rows(row_to_delete)
+    _note_delete(sheet.title, row_to_delete)
+    return True
+
+
+def _sheet_delete(gasto_id: str, missing_ok: bool = False) -> tuple[bool, str]:
+    """Busca la fila por ID único y la elimina. Nunca borra la fila equivocada."""
+    try:
+        parts = _partitions()
+        if parts is not None:
+            # Primero el año congelado que lo contiene; si no, de más nuevo a más viejo
+            frozen = _frozen()
+            known  = [y for y, (df, _) in frozen.items() if not df.empty and (df["ID"] == gasto_id).any()]
+            found  = False
+            for year in known + [y for y in sorted(parts, reverse=True) if y not in known]:
+                found = _delete_row(parts[year], gasto_id)
+                if found:
+                    thaw_partitions(year)
+                    break
+        else:
+            sheet = _ledger_sheet()
+            if not sheet:
+                return False, "Sin credenciales."
+            found = _delete_row(sheet, gasto_id)
+            if found is None:
+                return False, "Columna ID no encontrada. Agrega la columna ID al Sheet."
+
+        if not found:
+            if missing_ok:
+                return True, "OK"
+            return False, f"No se encontró el gasto con ID '{gasto_id}'."
+        return True, "OK"
+    except Exception as e:
+        _swallowed("sheet_delete", e)
+        return False, str(e)
+
+
+def _id_at(ws, cols: dict, n: int) -> str:
+    """ID que la hoja tiene hoy en la fila n (lectura de una sola celda)."""
+    got = ws.get_values(gspread.utils.rowcol_to_a1(n, cols["ID"]),
+                        value_render_option=gspread.utils.ValueRenderOption.unformatted)
+    return str(got[0][0]).strip() if got and got[0] else ""
+
+
+def _find_row(gasto_id: str, year: int):
+    """
+    (hoja, {ENCABEZADO: columna}, fila) del gasto, o None. Un acierto del
+    índice se confirma leyendo la celda ID de esa fila (un request): si
+    alguien borró o insertó filas desde fuera de la app, el índice de la
+    hoja se descarta y se relee (otro más), en vez de escribir sobre el
+    gasto que quedó en esa fila.
+    """
+    parts  = _partitions()
+    sheets = ([_ledger_sheet()] if parts is None
+              else [parts[y] for y in sorted(parts, key=lambda y: (y != year, -y))])   # su año primero
+    index  = _row_index()
+    for ws in sheets:
+        idx = index.get(ws.title)
+        if idx is not None and gasto_id in idx["rows"]:
+            n = idx["rows"][gasto_id]
+            if _id_at(ws, idx["cols"], n) == gasto_id:
+                return ws, idx["cols"], n
+            index.pop(ws.title, None)
+            break
+    for ws in sheets:
+        _remember_rows(ws.title, _read_raw(ws))
+        idx = index[ws.title]
+        if gasto_id in idx["rows"]:
+            return ws, idx["cols"], idx["rows"][gasto_id]
+    return None
+
+
+def _sheet_update(gasto_id: str, row: list, fields: list, year: int | None = None,
+                  missing_ok: bool = False) -> tuple[bool, str]:
+    """
+    Reescribe en su lugar las celdas `fields` (nombres de _LEDGER_COLS) de la
+    fila con ese ID, en un solo batch_update; el ID no cambia. `year` es el
+    año previo del gasto: ubica la partición sin recorrer las demás.
+    Con el índice al día son dos requests a Sheets: la lectura de la celda
+    ID que hace _find_row y el batch_update; tres si hubo que releer la hoja.
+    """
+    try:
+        parts = _partitions()
+        if parts is None and not _ledger_sheet():
+            return False, "Sin credenciales."
+        year  = int(row[2]) if year is None else int(year)
+        found = _find_row(gasto_id, year)
+        if found is None:
+            if missing_ok:
+                return True, "OK"
+            return False, f"No se encontró el gasto con ID '{gasto_id}'."
+        ws, cols, n = found
+
+        if parts is not None and ws.title != _partition_title(int(row[2])):
+            # Cambió de año: la fila se muda de partición (baja + alta, mismo ID)
+            if not _delete_row(ws, gasto_id):
+                return False, f"No se encontró el gasto con ID '{gasto_id}'."
+            thaw_partitions(year)
+            _sheet_append(row)
+            return True, "OK"
+
+        cells = []
+        for f in fields:
+            col = cols.get(f) or cols.get(_COL_ALIASES.get(f, ""))
+            if col is not None:
+                cells.append({"range": gspread.utils.rowcol_to_a1(n, col),
+                              "values": [[row[_LEDGER_COLS.index(f)]]]})
+        if cells:
+            ws.batch_update(cells)
+        if parts is not None:
+            thaw_partitions(int(row[2]))   # año cerrado: su copia congelada quedó vieja
+        return True, "OK"
+    except Exception as e:
+        _swallowed("sheet_update", e)
+        return False, str(e)
+
+
+def migrate_to_partitions() -> dict:
+    """
+    Reparte la hoja única en hojas "Gastos_AAAA" y renombra la original a
+    ARCHIVE_TITLE (no borra nada). Las fechas-celda se escriben como texto
+    dd/mm/aaaa, igual que las altas de la app, y las filas sin ID reciben
+    uno para poder borrarlas con seguridad. Si ya hay particiones no hace nada.
+    → {"años": {año: filas}, "sin_año": n}
+    """
+    if _partitions(refresh=True) is not None:
+        return {"años": {}, "sin_año": 0}
+    sheet = _ledger_sheet()
+    if not sheet:
+        raise RuntimeError("Sin credenciales.")
+    values = sheet.get_values(value_render_option=gspread.utils.ValueRenderOption.unformatted)
+    if len(values) < 2:
+        return {"años": {}, "sin_año": 0}
+
+    header = [str(h).strip() for h in values[0]]
+    upper  = [h.upper() for h in header]
+    if "ID" not in upper:
+        header.append("ID")
+        upper.append("ID")
+    rows = [list(r) + [""] * (len(header) - len(r)) for r in values[1:]
+            if any(str(v).strip() for v in r)]
+    cols = {h: pd.Series([r[i] for r in rows], dtype=object) for i, h in enumerate(upper)}
+
+    fechas, _ = _parse_fechas(cols["FECHA"]) if "FECHA" in cols else (pd.Series(pd.NaT, index=range(len(rows))), 0)
+    years = pd.to_numeric(cols["AÑO"], errors="coerce") if "AÑO" in cols else pd.Series(np.nan, index=fechas.index)
+    years = years.where(years > 0, fechas.dt.year).fillna(0).astype(int)
+
+    i_fecha, i_id = upper.index("FECHA") if "FECHA" in upper else None, upper.index("ID")
+    by_year, sin_anio = collections.defaultdict(list), 0
+    for k, r in enumerate(rows):
+        if i_fecha is not None and pd.notna(fechas[k]) and not isinstance(r[i_fecha], str):
+            r[i_fecha] = fechas[k].strftime(_DATE_FMT)
+        if not str(r[i_id]).strip():
+            r[i_id] = str(uuid.uuid4())[:8]
+        if years[k] > 0:
+            by_year[int(years[k])].append(r)
+        else:
+            sin_anio += 1
+
+    ss = open_spreadsheet()
+    for year, rs in sorted(by_year.items()):
+        ws = ss.add_worksheet(title=_partition_title(year), rows=len(rs) + 1000, cols=len(header))
+        ws.update(values=[header] + rs, range_name="A1")
+    sheet.update_title(ARCHIVE_TITLE)
+    _tenant_state()["handles"].pop("ledger", None)
+    _row_index().clear()
+    _partitions(refresh=True)
+    thaw_partitions()
+    return {"años": {y: len(rs) for y, rs in sorted(by_year.items())}, "sin_año": sin_anio}
+
+
+# ============================================================
+# 4b) PRESUPUESTO PERSISTENTE (tab "Presupuesto" en el Sheet)
+# ============================================================
+BUDGET_SHEET = "Presupuesto"   # nombre de la segunda hoja
+
+
+def _get_budget_sheet():
+    """Devuelve la hoja Presupuesto, creándola si no existe."""
+    handles = _tenant_state()["handles"]
+    if handles.get("budget") is not None:
+        return handles["budget"]
+    try:
+        ss = open_spreadsheet()
+        if ss is None:
+            return None
+        try:
+            ws = ss.worksheet(BUDGET_SHEET)
+        except Exception:
+            ws = ss.add_worksheet(title=BUDGET_SHEET, rows=50, cols=4)
+            ws.update("A1:D1", [["AÑO", "MES", "PRESUPUESTO", "UPDATED"]])
+        handles["budget"] = ws
+        return ws
+    except Exception as e:
+        _swallowed("budget_sheet", e)
+        return None
+
+
+def _parse_budgets(cu: dict) -> dict:
+    """Columnas de la hoja Presupuesto → {(año, mes): valor}."""
+    out = {}
+    for anio, mes, val in zip(cu.get("AÑO", ()), cu.get("MES", ()), cu.get("PRESUPUESTO", ())):
+        try:
+            anio, mes, val = int(anio or 0), str(mes).strip(), float(val or 0)
+            if anio > 0 and mes and val > 0:
+                out[(anio, mes)] = val
+        except Exception as e:
+            _swallowed("budget_row", e)
+    return out
+
+
+def _fetch_sheet_budgets() -> dict:
+    """Lee todos los presupuestos del Sheet → {(año, mes): valor}."""
+    ws = _get_budget_sheet()
+    if not ws:
+        raise RuntimeError("Hoja Presupuesto no disponible.")
+    return _parse_budgets(_read_columns(ws))
+
+
+# ── Lectura conjunta ────────────────────────────────────────
+# Ledger y presupuesto en un solo values:batchGet: un round-trip en vez
+# de una lectura (y un worksheet()) por hoja, y los dos conjuntos salen
+# del mismo instante del libro. Si el batch falla, lo usual es que la
+# pestaña Presupuesto aún no exista: se vuelve a las lecturas separadas,
+# que la crean, y la siguiente carga ya va en un solo pedido.
+def _fetch_sheet_all() -> tuple[pd.DataFrame, dict | None]:
+    """(ledger, presupuestos). Presupuestos es None si no se pudieron leer."""
+    ss = open_spreadsheet()
+    if ss is None:
+        raise RuntimeError("Sin credenciales.")
+    budgets = None
+
+    def read_many(sheets: list) -> list:
+        nonlocal budgets
+        ranges = [gspread.utils.absolute_range_name(ws.title) for ws in sheets]
+        try:
+            resp = ss.values_batch_get(
+                ranges + [gspread.utils.absolute_range_name(BUDGET_SHEET)],
+                params={"majorDimension": "COLUMNS", "valueRenderOption": "UNFORMATTED_VALUE"},
+            )
+        except Exception as e:
+            _swallowed("batch_get", e)
+            return _parallel(_read_raw, sheets)
+        raw     = [vr.get("values", []) for vr in resp["valueRanges"]]
+        budgets = _parse_budgets(_columns(raw.pop()))
+        return raw
+
+    ledger = _fetch_sheet_ledger(read_many)
+    if budgets is None:
+        try:
+            budgets = _fetch_sheet_budgets()
+        except Exception as e:
+            _swallowed("budget", e)
+    return ledger, budgets
+
+
+def _sheet_save_budget(anio: int, mes: str, valor: float) -> bool:
+    """Guarda o actualiza el presupuesto de un mes/año en Sheets."""
+    ws = _get_budget_sheet()
+    if not ws:
+        return False
+    try:
+        rows   = ws.get_all_values()
+        # Buscar fila existente
+        for i, row in enumerate(rows[1:], start=2):
+            if len(row) >= 3:
+                try:
+                    if int(row[0]) == anio and row[1].strip() == mes:
+                        ws.update(f"C{i}:D{i}", [[valor, dt.datetime.now().strftime("%Y-%m-%d %H:%M")]])
+                        return True
+                except Exception:
+                    pass
+        # Fila nueva
+        ws.append_row([anio, mes, valor, dt.datetime.now().strftime("%Y-%m-%d %H:%M")])
+        return True
+    except Exception as e:
+        _swallowed("budget_save", e)
+        return False
+
+
+# ============================================================
+# 5) ALMACENAMIENTO: SQLite local + sincronización con Sheets
+# ============================================================
+# La app lee y escribe contra un backend. Con "sheets" (por defecto) se usa
+# el Sheet directamente. Con GASTOS_BACKEND=sqlite el almacén primario es
+# un archivo local indexado: las consultas del mes se resuelven en SQL y los
+# writes son transacciones locales que un hilo de sincronización replica a
+# Gastos_Diarios / Presupuesto, así Sheets lento o caído no bloquea la UI.
+# Es opcional porque cambia la durabilidad: un write confirmado puede estar
+# solo en el outbox local, y en un host efímero se pierde con el disco.
+STORAGE_BACKEND = os.getenv("GASTOS_BACKEND", "sheets").strip().lower()
+LOCAL_DB_PATH   = os.getenv("GASTOS_DB", ".gastos.sqlite3")
+SYNC_INTERVAL   = 180   # s entre descargas completas desde Sheets
+
+_LEDGER_COLS = ["FECHA", "MES", "AÑO", "CATEGORÍA", "DESCRIPCION", "MONTO", "ID"]
+_STR_COLS    = ["MES", "CATEGORÍA", "DESCRIPCION", "ID"]
+
+
+def _str_dtype():
+    """Cadenas en Arrow (búsqueda y strip vectorizados en C++, sin un objeto
+    Python por celda) con NaN como faltante, igual que el dtype str."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:   # sin pyarrow: mismo comportamiento, más lento
+        return pd.StringDtype("python", na_value=np.nan)
+    return pd.StringDtype("pyarrow", na_value=np.nan)
+
+
+STR_DTYPE = _str_dtype()
+
+
+def _as_arrow(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype({c: STR_DTYPE for c in _STR_COLS if c in df.columns})
+
+
+def _empty_ledger() -> pd.DataFrame:
+    return pd.DataFrame({
+        "FECHA": pd.Series(dtype="datetime64[us]"), "MES": pd.Series(dtype=STR_DTYPE),
+        "AÑO": pd.Series(dtype=int), "CATEGORÍA": pd.Series(dtype=STR_DTYPE),
+        "DESCRIPCION": pd.Series(dtype=STR_DTYPE), "MONTO": pd.Series(dtype=float),
+        "ID": pd.Series(dtype=STR_DTYPE),
+    })
+
+
+def _group_by_category(dfm: pd.DataFrame) -> pd.DataFrame:
+    """Total por categoría, de mayor a menor (columnas CATEGORÍA, MONTO)."""
+    return (dfm.groupby("CATEGORÍA")["MONTO"].sum()
+               .reset_index()
+               .sort_values("MONTO", ascending=False))
+
+
+def _search(df: pd.DataFrame, texto: str) -> pd.DataFrame:
+    """Filtro del buscador: subcadena sin mayúsculas en descripción o categoría."""
+    if not texto or df.empty:
+        return df
+    return df[df["DESCRIPCION"].str.contains(texto, case=False, na=False, regex=False) |
+              df["CATEGORÍA"].str.contains(texto, case=False, na=False, regex=False)]
+
+
+class StorageBackend:
+    """Interfaz común de los almacenes de gastos y presupuestos."""
+
+    def close(self):
+        """Libera recursos de fondo al desalojar el tenant."""
+
+    def load_ledger(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def load_budgets(self) -> dict:
+        raise NotImplementedError
+
+    def load_all(self) -> tuple[pd.DataFrame, dict | None]:
+        """(ledger, presupuestos) de una vez; presupuestos None si no se pudieron leer."""
+        return self.load_ledger(), self.load_budgets()
+
+    def add_expense(self, row: list):
+        """Agrega una fila con el formato de _ledger_row()."""
+        raise NotImplementedError
+
+    def delete_expense(self, gasto_id: str) -> tuple[bool, str]:
+        raise NotImplementedError
+
+    def update_expense(self, gasto_id: str, row: list, fields: list,
+                       year: int | None = None) -> tuple[bool, str]:
+        """Reemplaza el gasto por `row` (formato _ledger_row, mismo ID); fields: columnas que cambian."""
+        raise NotImplementedError
+
+    def save_budget(self, anio: int, mes: str, valor: float) -> bool:
+        raise NotImplementedError
+
+    def query(self, anio: int, mes=None, texto: str = "") -> pd.DataFrame:
+        """Gastos de un año (y mes), opcionalmente filtrados por texto."""
+        return _search(filter_data(load_data(), mes, anio), texto)
+
+    def totals_by_category(self, anio: int, mes=None, texto: str = "") -> pd.DataFrame:
+        return _group_by_category(self.query(anio, mes, texto))
+
+    def query_range(self, desde: dt.date, hasta: dt.date, categoria=None,
+                    texto: str = "") -> pd.DataFrame:
+        """Gastos con FECHA en [desde, hasta] (ambos incluidos), por búsqueda binaria."""
+        return _search(get_ledger_index().range(desde, hasta, categoria), texto)
+
+    def total_range(self, desde: dt.date, hasta: dt.date) -> float:
+        """Total con FECHA en [desde, hasta], por sumas prefijas."""
+        return get_ledger_index().total(desde, hasta)
+
+    def totals_by_range(self, desde: dt.date, hasta: dt.date, texto: str = "") -> pd.DataFrame:
+        if texto:
+            return _group_by_category(self.query_range(desde, hasta, texto=texto))
+        return get_ledger_index().totals(desde, hasta)
+
+
+class SheetsBackend(StorageBackend):
+    """Google Sheets como único almacén (comportamiento clásico)."""
+
+    def load_ledger(self) -> pd.DataFrame:
+        return _fetch_sheet_ledger()
+
+    def load_budgets(self) -> dict:
+        return _fetch_sheet_budgets()
+
+    def load_all(self) -> tuple[pd.DataFrame, dict | None]:
+        return _fetch_sheet_all()
+
+    def add_expense(self, row: list):
+        _sheet_append(row)
+
+    def delete_expense(self, gasto_id: str) -> tuple[bool, str]:
+        return _sheet_delete(gasto_id)
+
+    def update_expense(self, gasto_id: str, row: list, fields: list,
+                       year: int | None = None) -> tuple[bool, str]:
+        return _sheet_update(gasto_id, row, fields, year)
+
+    def save_budget(self, anio: int, mes: str, valor: float) -> bool:
+        return _sheet_save_budget(anio, mes, valor)
+
+
+class SQLiteBackend(StorageBackend):
+    """Almacén local indexado; Sheets queda como réplica (ver SheetsSync)."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS gastos (
+            pos         INTEGER PRIMARY KEY,   -- orden de llegada
+            id          TEXT NOT NULL,
+            fecha       TEXT,                  -- ISO YYYY-MM-DD
+            anio        INTEGER NOT NULL,
+            mes         TEXT NOT NULL,
+            categoria   TEXT NOT NULL,
+            descripcion TEXT NOT NULL DEFAULT '',
+            monto       REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_gastos_fecha     ON gastos(fecha);
+        CREATE INDEX IF NOT EXISTS ix_gastos_anio_mes  ON gastos(anio, mes);
+        CREATE INDEX IF NOT EXISTS ix_gastos_categoria ON gastos(categoria);
+        CREATE INDEX IF NOT EXISTS ix_gastos_id        ON gastos(id);
+        CREATE TABLE IF NOT EXISTS presupuestos (
+            anio    INTEGER NOT NULL,
+            mes     TEXT NOT NULL,
+            valor   REAL NOT NULL,
+            updated TEXT,
+            PRIMARY KEY (anio, mes)
+        );
+        -- Cambios locales aún no replicados a Sheets, en orden
+        CREATE TABLE IF NOT EXISTS outbox (
+            seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+            op      TEXT NOT NULL,             -- add | delete | update | budget
+            payload TEXT NOT NULL              -- JSON
+        );
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+    _SELECT = ("SELECT fecha, mes, anio, categoria, descripcion, monto, id "
+               "FROM gastos")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sync = SheetsSync(self)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(self.SCHEMA)
+
+    def close(self):
+        self.sync.stop()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Conexión por operación (segura entre hilos) dentro de una transacción."""
+        con = sqlite3.connect(self.path, timeout=10)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # ── Lectura ───────────────────────────────────────────────
+    @staticmethod
+    def _to_frame(rows: list) -> pd.DataFrame:
+        if not rows:
+            return _empty_ledger()
+        df = pd.DataFrame(rows, columns=_LEDGER_COLS)
+        df["FECHA"] = pd.to_datetime(df["FECHA"], format="%Y-%m-%d", errors="coerce")
+        return _as_arrow(df)
+
+    def load_ledger(self) -> pd.DataFrame:
+        if self.get_meta("pulled_at") is None:
+            self.sync.pull_if_due()   # almacén vacío: primera carga desde Sheets
+        with self._connect() as con:
+            return self._to_frame(con.execute(f"{self._SELECT} ORDER BY pos").fetchall())
+
+    def load_budgets(self) -> dict:
+        with self._connect() as con:
+            rows = con.execute("SELECT anio, mes, valor FROM presupuestos WHERE valor > 0").fetchall()
+        return {(a, m): v for a, m, v in rows}
+
+    @staticmethod
+    def _like(sql: str, params: list, texto: str) -> tuple[str, list]:
+        if texto:
+            esc  = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            like = f"%{esc}%"
+            sql += " AND (descripcion LIKE ? ESCAPE '\\' OR categoria LIKE ? ESCAPE '\\')"
+            params += [like, like]
+        return sql, params
+
+    def _where(self, anio: int, mes, texto: str) -> tuple[str, list]:
+        sql, params = " WHERE anio = ?", [int(anio)]
+        if mes is not None:
+            sql += " AND mes = ?"
+            params.append(mes)
+        return self._like(sql, params, texto)
+
+    def _where_range(self, desde: dt.date, hasta: dt.date, categoria, texto: str) -> tuple[str, list]:
+        # fecha es ISO: el BETWEEN de texto recorre ix_gastos_fecha
+        sql, params = " WHERE fecha BETWEEN ? AND ?", [desde.isoformat(), hasta.isoformat()]
+        if categoria is not None:
+            sql += " AND categoria = ?"
+            params.append(categoria)
+        return self._like(sql, params, texto)
+
+    def query(self, anio: int, mes=None, texto: str = "") -> pd.DataFrame:
+        where, params = self._where(anio, mes, texto)
+        with self._connect() as con:
+            rows = con.execute(f"{self._SELECT}{where} ORDER BY pos", params).fetchall()
+        return self._to_frame(rows)
+
+    def totals_by_category(self, anio: int, mes=None, texto: str = "") -> pd.DataFrame:
+        where, params = self._where(anio, mes, texto)
+        with self._connect() as con:
+            rows = con.execute(
+                f"SELECT categoria, SUM(monto) AS total FROM gastos{where} "
+                f"GROUP BY categoria ORDER BY total DESC", params,
+            ).fetchall()
+        return pd.DataFrame(rows, columns=["CATEGORÍA", "MONTO"])
+
+    def query_range(self, desde: dt.date, hasta: dt.date, categoria=None,
+                    texto: str = "") -> pd.DataFrame:
+        where, params = self._where_range(desde, hasta, categoria, texto)
+        with self._connect() as con:
+            rows = con.execute(f"{self._SELECT}{where} ORDER BY fecha, pos", params).fetchall()
+        return self._to_frame(rows)
+
+    def total_range(self, desde: dt.date, hasta: dt.date) -> float:
+        where, params = self._where_range(desde, hasta, None, "")
+        with self._connect() as con:
+            return float(con.execute(f"SELECT COALESCE(SUM(monto), 0) FROM gastos{where}", params).fetchone()[0])
+
+    def totals_by_range(self, desde: dt.date, hasta: dt.date, texto: str = "") -> pd.DataFrame:
+        where, params = self._where_range(desde, hasta, None, texto)
+        with self._connect() as con:
+            rows = con.execute(
+                f"SELECT categoria, SUM(monto) AS total FROM gastos{where} "
+                f"GROUP BY categoria ORDER BY total DESC", params,
+            ).fetchall()
+        return pd.DataFrame(rows, columns=["CATEGORÍA", "MONTO"])
+
+    # ── Escritura (transacción local + outbox) ────────────────
+    def _insert(self, con, row: list):
+        fecha = dt.datetime.strptime(row[0], "%d/%m/%Y").date().isoformat()
+        con.execute(
+            "INSERT INTO gastos (fecha, mes, anio, categoria, descripcion, monto, id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fecha, row[1], row[2], row[3], row[4], row[5], row[6]),
+        )
+
+    @staticmethod
+    def _update(con, gasto_id: str, row: list):
+        fecha = dt.datetime.strptime(row[0], "%d/%m/%Y").date().isoformat()
+        return con.execute(
+            "UPDATE gastos SET fecha = ?, mes = ?, anio = ?, categoria = ?, descripcion = ?, monto = ? "
+            "WHERE id = ?",
+            (fecha, row[1], row[2], row[3], row[4], row[5], gasto_id),
+        )
+
+    def add_expense(self, row: list):
+        with self._connect() as con:
+            self._insert(con, row)
+            con.execute("INSERT INTO outbox (op, payload) VALUES ('add', ?)", (json.dumps(row),))
+        self.sync.wake()
+
+    def delete_expense(self, gasto_id: str) -> tuple[bool, str]:
+        with self._connect() as con:
+            cur = con.execute("DELETE FROM gastos WHERE id = ?", (gasto_id,))
+            if cur.rowcount == 0:
+                return False, f"No se encontró el gasto con ID '{gasto_id}'."
+            con.execute("INSERT INTO outbox (op, payload) VALUES ('delete', ?)", (json.dumps(gasto_id),))
+        self.sync.wake()
+        return True, "OK"
+
+    def update_expense(self, gasto_id: str, row: list, fields: list,
+                       year: int | None = None) -> tuple[bool, str]:
+        with self._connect() as con:
+            if self._update(con, gasto_id, row).rowcount == 0:
+                return False, f"No se encontró el gasto con ID '{gasto_id}'."
+            con.execute("INSERT INTO outbox (op, payload) VALUES ('update', ?)",
+                        (json.dumps([gasto_id, row, fields, year]),))
+        self.sync.wake()
+        return True, "OK"
+
+    def save_budget(self, anio: int, mes: str, valor: float) -> bool:
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO presupuestos VALUES (?, ?, ?, ?)",
+                (anio, mes, valor, dt.datetime.now().strftime("%Y-%m-%d %H:%M")),
+            )
+            con.execute("INSERT INTO outbox (op, payload) VALUES ('budget', ?)",
+                        (json.dumps([anio, mes, valor]),))
+        self.sync.wake()
+        return True
+
+    # ── Soporte para el sync ──────────────────────────────────
+    def get_meta(self, key: str):
+        with self._connect() as con:
+            row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def pending(self) -> list:
+        with self._connect() as con:
+            return con.execute("SELECT seq, op, payload FROM outbox ORDER BY seq").fetchall()
+
+    def ack(self, seq: int):
+        with self._connect() as con:
+            con.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+
+    @staticmethod
+    def _fingerprint(con) -> tuple:
+        return con.execute(
+            "SELECT COUNT(*), TOTAL(monto), GROUP_CONCAT(id || '|' || monto || '|' || categoria "
+            "|| '|' || descripcion || '|' || COALESCE(fecha, ''), char(10)) "
+            "FROM (SELECT * FROM gastos ORDER BY pos)"
+        ).fetchone() + tuple(con.execute("SELECT * FROM presupuestos ORDER BY anio, mes").fetchall())
+
+    def replace_all(self, ledger: pd.DataFrame, budgets: dict) -> bool:
+        """Reemplaza el contenido con el del Sheet, conservando el outbox.
+
+        Devuelve True si algo cambió respecto de la copia local.
+        """
+        fechas = ledger["FECHA"].dt.strftime("%Y-%m-%d") if not ledger.empty else []
+        rows = list(zip(
+            [f if isinstance(f, str) else None for f in fechas],
+            ledger.get("MES", []), [int(a) for a in ledger.get("AÑO", [])],
+            ledger.get("CATEGORÍA", []), ledger.get("DESCRIPCION", []),
+            [float(m) for m in ledger.get("MONTO", [])], ledger.get("ID", []),
+        ))
+        with self._connect() as con:
+            before = self._fingerprint(con)
+            con.execute("DELETE FROM gastos")
+            con.executemany(
+                "INSERT INTO gastos (fecha, mes, anio, categoria, descripcion, monto, id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+            con.execute("DELETE FROM presupuestos")
+            con.executemany(
+                "INSERT INTO presupuestos (anio, mes, valor) VALUES (?, ?, ?)",
+                [(a, m, v) for (a, m), v in budgets.items()],
+            )
+            # Lo que aún no llegó a Sheets se vuelve a aplicar encima
+            for _, op, payload in con.execute("SELECT seq, op, payload FROM outbox ORDER BY seq").fetchall():
+                arg = json.loads(payload)
+                if op == "add":
+                    self._insert(con, arg)
+                elif op == "delete":
+                    con.execute("DELETE FROM gastos WHERE id = ?", (arg,))
+                elif op == "update":
+                    self._update(con, arg[0], arg[1])
+                elif op == "budget":
+                    con.execute("INSERT OR REPLACE INTO presupuestos (anio, mes, valor) VALUES (?, ?, ?)", arg)
+            changed = self._fingerprint(con) != before
+            con.execute("INSERT OR REPLACE INTO meta VALUES ('pulled_at', ?)", (dt.datetime.now().isoformat(),))
+        return changed
+
+
+class SheetsSync:
+    """Replica el SQLite local hacia/desde Sheets en un hilo de fondo.
+
+    push(): envía el outbox en orden; se detiene en el primer error y
+    reintenta en la siguiente vuelta. pull(): descarga el Sheet completo
+    y lo vuelca localmente en una transacción.
+    """
+
+    def __init__(self, store: "SQLiteBackend", interval: float = SYNC_INTERVAL):
+        self.store     = store
+        self.interval  = interval
+        self._wake     = threading.Event()
+        self._lock     = threading.RLock()
+        self._thread   = None
+        self._stopped  = False
+        self.last_pull = None   # time.monotonic() de la última descarga
+
+    def start(self):
+        if self._thread is None:
+            self._thread = _spawn(self._run, f"sheets-sync-{current_tenant().key}")
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def push(self) -> int:
+        # Bajo el mismo lock que pull(): si un replace_all() cayera entre el
+        # write a Sheets y el ack, el op aún pendiente se volvería a aplicar
+        # encima de filas que ya lo traen (duplicado local y, luego, en Sheets)
+        with self._lock:
+            return self._push()
+
+    def _push(self) -> int:
+        sent = 0
+        for seq, op, payload in self.store.pending():
+            arg = json.loads(payload)
+            if op == "add":
+                _sheet_append(arg)
+            elif op == "delete":
+                ok, msg = _sheet_delete(arg, missing_ok=True)
+                if not ok:
+                    raise RuntimeError(msg)
+            elif op == "update":
+                ok, msg = _sheet_update(*arg, missing_ok=True)
+                if not ok:
+                    raise RuntimeError(msg)
+            elif op == "budget":
+                if not _sheet_save_budget(*arg):
+                    raise RuntimeError("No se pudo guardar el presupuesto en Sheets.")
+            self.store.ack(seq)
+            sent += 1
+        return sent
+
+    def pull(self) -> bool:
+        """Descarga Sheets y lo vuelca en local. True si cambió algo."""
+        with self._lock:
+            ledger, budgets = _fetch_sheet_all()
+            if budgets is None:
+                raise RuntimeError("Hoja Presupuesto no disponible.")
+            changed = self.store.replace_all(ledger, budgets)
+            self.last_pull = time.monotonic()
+        return changed
+
+    def pull_if_due(self) -> bool:
+        with self._lock:
+            if self.last_pull is not None and time.monotonic() - self.last_pull < self.interval:
+                return False
+            return self.pull()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.push()
+                if self.pull_if_due():
+                    load_data.clear()
+                    load_budgets.clear()
+            except Exception as e:
+                _swallowed("sync", e)   # Sheets no disponible: se reintenta en la próxima vuelta
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+def _tenant_db_path(tenant: Tenant) -> str:
+    if tenant is DEFAULT_TENANT:
+        return LOCAL_DB_PATH
+    base, ext = os.path.splitext(LOCAL_DB_PATH)
+    return f"{base}-{tenant.key}{ext}"
+
+
+_BACKGROUND_SYNC     = False
+_METRICS_EXPORTED    = False
+_METRICS_EXPORT_LOCK = threading.Lock()
+
+
+def enable_background_sync():
+    """Arranca un hilo de sync por almacén local (la app lo activa; el CLI no)."""
+    global _BACKGROUND_SYNC
+    _BACKGROUND_SYNC = True
+
+
+def enable_metrics_export():
+    """
+    Expone las métricas del proceso (la app lo activa; el CLI usa --metrics):
+    GASTOS_METRICS_PORT → /metrics por HTTP (en GASTOS_METRICS_ADDR, 127.0.0.1
+    por defecto); GASTOS_METRICS_FILE → archivo reescrito cada 15 s.
+    Solo la primera llamada del proceso hace algo (la app la repite en cada
+    rerun). Si el puerto está ocupado, p. ej. por otro worker, se registra
+    y la app sigue sin /metrics.
+    """
+    global _METRICS_EXPORTED
+    with _METRICS_EXPORT_LOCK:
+        if _METRICS_EXPORTED:
+            return
+        _METRICS_EXPORTED = True
+    port, path = _secret("GASTOS_METRICS_PORT"), _secret("GASTOS_METRICS_FILE")
+    if port:
+        try:
+            metrics.serve(int(port), _secret("GASTOS_METRICS_ADDR", "127.0.0.1"))
+        except (OSError, ValueError) as e:
+            _swallowed("metrics_export", e)
+            _LOGGER.warning("No se pudo exponer /metrics en el puerto %s: %s", port, e)
+    if path:
+        metrics.write_every(path, 15.0)
+
+
+def get_backend() -> StorageBackend:
+    """Almacén del tenant actual (uno por tenant activo en el proceso)."""
+    state = _tenant_state()
+    with state["lock"]:
+        if state["backend"] is None:
+            if STORAGE_BACKEND == "sqlite":
+                state["backend"] = SQLiteBackend(_tenant_db_path(current_tenant()))
+                if _BACKGROUND_SYNC:
+                    state["backend"].sync.start()
+            else:
+                state["backend"] = SheetsBackend()
+        return state["backend"]
+
+
+# ============================================================
+# 6) API DE DATOS
+# ============================================================
+def _by_period(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ledger compartido: ordenado (estable) por año-mes y con PERIODO =
+    año*12 + mes-1, así cada mes o año es un tramo contiguo y
+    filter_data() entrega vistas en vez de copias.
+    """
+    if df.empty:
+        return df
+    codes = pd.Categorical(df["MES"], categories=MESES_ORD).codes
+    per   = np.where(codes < 0, -1, df["AÑO"].to_numpy(dtype=np.int64) * 12 + codes)
+    if np.any(per[1:] < per[:-1]):
+        order = np.argsort(per, kind="stable")
+        df, per = df.take(order).reset_index(drop=True), per[order]
+    return df.assign(PERIODO=per.astype(np.int32))
+
+
+def _cow_view(df: pd.DataFrame) -> pd.DataFrame:
+    # Copia superficial: comparte los buffers, pero con copy-on-write (siempre
+    # activo desde pandas 3, ver requirements.txt) una sesión que escriba en
+    # su frame nunca toca el de las demás
+    return df.copy(deep=False)
+
+
+@swr_cache(ttl=180, fallback=_empty_ledger, share=_cow_view)
+def load_data() -> pd.DataFrame:
+    # Los presupuestos llegan en la misma lectura: load_budgets queda
+    # lleno (y coherente con este ledger) sin otro viaje a Sheets
+    version = load_budgets.version
+    ledger, budgets = get_backend().load_all()
+    if budgets is not None:
+        load_budgets.prime(budgets, version)
+    return _by_period(ledger)
+
+
+@swr_cache(ttl=300, fallback=dict)
+def load_budgets() -> dict:
+    """Carga todos los presupuestos → {(año, mes): valor}."""
+    return get_backend().load_budgets()
+
+
+def _ledger_frame(row: list) -> pd.DataFrame:
+    """Una fila de _ledger_row() con los mismos tipos que load_data()."""
+    new = pd.DataFrame([row], columns=_LEDGER_COLS)
+    new["FECHA"] = pd.to_datetime(new["FECHA"], format="%d/%m/%Y")
+    return _by_period(_as_arrow(new.astype({"AÑO": int, "MONTO": float})))
+
+
+def _ledger_append(df: pd.DataFrame, row: list) -> pd.DataFrame:
+    """Delta de alta: la fila nueva, con los mismos tipos que load_data(), al final de su mes."""
+    new = _ledger_frame(row)
+    if df.empty:
+        return new
+    at = int(np.searchsorted(df["PERIODO"].to_numpy(), new["PERIODO"].iloc[0], side="right"))
+    return pd.concat([df.iloc[:at], new, df.iloc[at:]], ignore_index=True)
+
+
+def _ledger_drop(df: pd.DataFrame, gasto_id: str) -> pd.DataFrame:
+    """Delta de baja: todo menos el ID eliminado."""
+    return df if df.empty else df[df["ID"] != gasto_id].reset_index(drop=True)
+
+
+def _ledger_replace(df: pd.DataFrame, gasto_id: str, row: list) -> pd.DataFrame:
+    """Delta de edición: la fila del ID toma los valores de row; si cambia de mes, se reubica."""
+    hit = np.flatnonzero(df["ID"].to_numpy() == gasto_id) if not df.empty else []
+    if not len(hit):
+        return df
+    new = _ledger_frame(row)
+    if df["PERIODO"].iat[hit[0]] != new["PERIODO"].iat[0]:
+        return _ledger_append(_ledger_drop(df, gasto_id), row)
+    out = df.copy(deep=False)   # copy-on-write: solo se copian las columnas tocadas
+    for c in new.columns:
+        out.iloc[hit[0], out.columns.get_loc(c)] = new[c].iat[0]
+    return out
+
+
+# ── Guardas contra doble envío ──────────────────────────────
+# Un doble toque en "Confirmar y guardar" con la conexión lenta llega como
+# dos reruns con el mismo preview_data. Cada preview trae un token: si ya
+# se guardó (o se está guardando) la segunda llamada no toca la API. Y un
+# índice hash de (fecha, monto, categoría, descripción) de lo guardado en
+# los últimos DUP_WINDOW segundos frena el mismo gasto enviado desde otra
+# pestaña o dispositivo, salvo que se confirme con data["force"].
+# Ambos viven en memoria del proceso (estado del tenant): cubren a todas
+# las sesiones servidas por este proceso, no a otras réplicas ni a lo
+# guardado antes de un reinicio.
+SAVE_TOKENS    = 512     # tokens recordados por tenant
+DUP_WINDOW     = 120.0   # s
+SAVE_IN_FLIGHT = "Este gasto ya se está guardando."   # motivo de un doble toque: no es un error
+
+_SAVE_DEDUP = metrics.counter("gastos_save_dedup_total",
+                              "Altas frenadas antes de llamar a la API, por motivo", ("reason",))
+
+
+def _save_guard() -> dict:
+    return _tenant_state()["derived"].setdefault("save_guard", {
+        "lock":   threading.Lock(),
+        "tokens": collections.OrderedDict(),   # token → id guardado (None = en curso)
+        "recent": collections.OrderedDict(),   # huella → time.monotonic() del alta
+    })
+
+
+def _fingerprint(data: dict) -> tuple:
+    return (pd.Timestamp(data["date"]).date(), round(float(data["amount"]), 2),
+            data["category"], str(data["description"]).strip().lower())
+
+
+def _prune_recent(recent: collections.OrderedDict, now: float):
+    # Orden de inserción = orden temporal: se corta por el frente
+    while recent and now - next(iter(recent.values())) > DUP_WINDOW:
+        recent.popitem(last=False)
+
+
+def recent_duplicate(data: dict) -> float | None:
+    """
+    Segundos desde que se guardó un gasto idéntico (cualquier sesión del
+    tenant en este proceso), o None. Solo ve las altas de este proceso.
+    """
+    guard = _save_guard()
+    with guard["lock"]:
+        now = time.monotonic()
+        _prune_recent(guard["recent"], now)
+        t = guard["recent"].get(_fingerprint(data))
+    return None if t is None else now - t
+
+
+def save_to_sheet(data: dict) -> tuple[bool, str]:
+    """
+    Agrega un gasto → (True, id) o (False, motivo).
+    Con GASTOS_BACKEND=sqlite (opcional) True significa guardado en
+    el almacén local: el hilo de sync lo replica a Sheets después, y si
+    Sheets no responde queda en el outbox hasta la próxima vuelta.
+    Con data["token"] es idempotente: repetirlo devuelve el mismo id sin
+    escribir. Un gasto idéntico a otro guardado hace menos de DUP_WINDOW
+    segundos se rechaza, salvo con data["force"].
+    """
+    guard, token, fp = _save_guard(), data.get("token"), _fingerprint(data)
+    with guard["lock"]:
+        now = time.monotonic()
+        _prune_recent(guard["recent"], now)
+        if token is not None and token in guard["tokens"]:
+            done = guard["tokens"][token]
+            _SAVE_DEDUP.inc(reason="token" if done else "in_flight")
+            return (True, done) if done else (False, SAVE_IN_FLIGHT)
+        if fp in guard["recent"] and not data.get("force"):
+            _SAVE_DEDUP.inc(reason="recent")
+            return False, f"Ya guardaste este mismo gasto hace {now - guard['recent'][fp]:.0f} s."
+        if token is not None:
+            guard["tokens"][token] = None
+            while len(guard["tokens"]) > SAVE_TOKENS:
+                guard["tokens"].popitem(last=False)
+
+    gasto_id = str(uuid.uuid4())[:8]
+    row      = _ledger_row(data, gasto_id)
+    try:
+        get_backend().add_expense(row)
+    except Exception as e:
+        _swallowed("save", e)
+        with guard["lock"]:
+            guard["tokens"].pop(token, None)   # falló: se puede reintentar
+        return False, str(e)
+    with guard["lock"]:
+        if token is not None:
+            guard["tokens"][token] = gasto_id
+        guard["recent"][fp] = time.monotonic()
+        guard["recent"].move_to_end(fp)
+    _account("save_guard", guard)
+    version = load_data.patch(lambda df: _ledger_append(df, row))
+    if version is not None:
+        _patch_index("streak", version, lambda idx: idx.add(data["date"]))
+        _patch_index("cat_stats", version, lambda idx: idx.add(row[3], row[5]))
+    return True, gasto_id
+
+
+def delete_from_sheet(gasto_id: str) -> tuple[bool, str]:
+    """Elimina un gasto por su ID único. Nunca borra la fila equivocada."""
+    df   = load_data()
+    gone = df.loc[df["ID"] == gasto_id] if not df.empty else df
+    try:
+        ok, msg = get_backend().delete_expense(gasto_id)
+    except Exception as e:
+        _swallowed("delete", e)
+        return False, str(e)
+    if not ok:
+        return ok, msg
+    version = load_data.patch(lambda df: _ledger_drop(df, gasto_id))
+    if version is not None and len(gone):
+        r = gone.iloc[0]
+        if pd.notna(r["FECHA"]):
+            _patch_index("streak", version, lambda idx: idx.remove(r["FECHA"]))
+        _patch_index("cat_stats", version, lambda idx: idx.remove(r["CATEGORÍA"], r["MONTO"]))
+    return True, "OK"
+
+
+def _cached_row(r: pd.Series) -> list:
+    """Fila del ledger cacheado en el formato de _ledger_row()."""
+    fecha = r["FECHA"].strftime("%d/%m/%Y") if pd.notna(r["FECHA"]) else ""
+    return [fecha, r["MES"], int(r["AÑO"]), r["CATEGORÍA"], r["DESCRIPCION"], float(r["MONTO"]), r["ID"]]
+
+
+def update_expense(gasto_id: str, data: dict) -> tuple[bool, str]:
+    """
+    Corrige un gasto en su lugar (mismo formulario que save_to_sheet, mismo
+    ID). Solo se escriben las celdas que cambian, en un batch_update a la
+    fila que da el índice de IDs, previa lectura de su celda ID para
+    confirmar que sigue siendo ese gasto (dos requests en total, ver
+    _sheet_update); el ledger cacheado se parcha.
+    """
+    df  = load_data()
+    old = df.loc[df["ID"] == gasto_id] if not df.empty else df
+    if not len(old):
+        return False, f"No se encontró el gasto con ID '{gasto_id}'."
+    r      = old.iloc[0]
+    before = _cached_row(r)
+    row    = _ledger_row(data, gasto_id)
+    fields = [c for c, a, b in zip(_LEDGER_COLS, before, row) if a != b]
+    if not fields:
+        return True, "OK"
+    try:
+        ok, msg = get_backend().update_expense(gasto_id, row, fields, before[2])
+    except Exception as e:
+        _swallowed("update", e)
+        return False, str(e)
+    if not ok:
+        return ok, msg
+    version = load_data.patch(lambda df: _ledger_replace(df, gasto_id, row))
+    if version is not None:
+        def restreak(idx):
+            if pd.notna(r["FECHA"]):
+                idx.remove(r["FECHA"])
+            idx.add(data["date"])
+
+        def recat(idx):
+            idx.remove(r["CATEGORÍA"], r["MONTO"])
+            idx.add(row[3], row[5])
+        _patch_index("streak", version, restreak)
+        _patch_index("cat_stats", version, recat)
+    return True, "OK"
+
+
+def _budget_set(budgets: dict, anio: int, mes: str, valor: float) -> dict:
+    out = {k: v for k, v in budgets.items() if k != (anio, mes)}
+    if valor > 0:
+        out[(anio, mes)] = float(valor)
+    return out
+
+
+def save_budget(anio: int, mes: str, valor: float):
+    """Guarda o actualiza el presupuesto de un mes/año."""
+    try:
+        ok = get_backend().save_budget(anio, mes, valor)
+    except Exception as e:
+        _swallowed("budget", e)
+        return False
+    if ok:
+        load_budgets.patch(lambda b: _budget_set(b, anio, mes, valor))
+    return ok
+
+
+# ============================================================
+# 7) CONSULTAS Y ESTADÍSTICAS
+# ============================================================
+def now_peru() -> dt.datetime:
+    return dt.datetime.now(TZ_OFFSET)
+
+
+def filter_data(df: pd.DataFrame, mes, anio: int) -> pd.DataFrame:
+    """
+    Gastos de un año (y mes). Sobre el ledger de load_data() (ordenado por
+    PERIODO) es una búsqueda binaria y devuelve una vista, sin copiar filas.
+    """
+    if df.empty:
+        return df
+    if "PERIODO" in df.columns:
+        k0  = int(anio) * 12 + (MES_NUM[mes] - 1 if mes is not None else 0)
+        k1  = k0 if mes is not None else k0 + 11
+        per = df["PERIODO"].to_numpy()
+        return df.iloc[np.searchsorted(per, k0, side="left"):np.searchsorted(per, k1, side="right")]
+    mask = df["AÑO"] == int(anio)
+    if mes is not None:
+        mask &= df["MES"] == mes
+    return df[mask]
+
+
+# ── Motor de rachas ─────────────────────────────────────────
+_EPOCH = dt.date(1970, 1, 1)
+
+
+def _day_num(d) -> int:
+    """Día como entero (días desde 1970-01-01), igual que datetime64[D]."""
+    if isinstance(d, dt.datetime):
+        d = d.date()
+    return (d - _EPOCH).days
+
+
+class StreakIndex:
+    """Rachas sobre el arreglo ordenado de días únicos con gasto.
+
+    Guarda, para cada día con gasto, la longitud de la racha que termina
+    en él; así la racha actual es un lookup O(1). Se construye vectorizado
+    una vez por versión del ledger y luego se mantiene con add()/remove().
+    """
+
+    def __init__(self, fechas: pd.Series):
+        days = fechas.dropna().to_numpy(dtype="datetime64[D]").astype(np.int64)
+        uniq, counts = np.unique(days, return_counts=True)
+        brk    = np.diff(uniq, prepend=uniq[:1] - 2) != 1   # inicio de cada racha
+        starts = np.flatnonzero(brk)
+        runs   = np.arange(len(uniq)) - starts[np.cumsum(brk) - 1] + 1
+
+        self._days    = uniq.tolist()                        # ordenado
+        self._count   = dict(zip(self._days, counts.tolist()))
+        self._run     = dict(zip(self._days, runs.tolist()))
+        self._longest = int(runs.max()) if len(runs) else 0
+
+    def _relink(self, d: int):
+        """Recalcula las rachas desde el día d hacia adelante mientras sigan."""
+        while d in self._run:
+            self._run[d] = self._run.get(d - 1, 0) + 1
+            if self._longest is not None:
+                self._longest = max(self._longest, self._run[d])
+            d += 1
+
+    def add(self, fecha):
+        d = _day_num(fecha)
+        if d in self._count:
+            self._count[d] += 1
+            return
+        bisect.insort(self._days, d)
+        self._count[d] = 1
+        self._run[d]   = 0
+        self._relink(d)
+
+    def remove(self, fecha):
+        d = _day_num(fecha)
+        if d not in self._count:
+            return
+        self._count[d] -= 1
+        if self._count[d] > 0:
+            return
+        del self._count[d], self._run[d]
+        del self._days[bisect.bisect_left(self._days, d)]
+        self._longest = None          # se recalcula al pedirlo
+        self._relink(d + 1)
+
+    def current(self, today: dt.date) -> int:
+        """Días consecutivos con gasto que terminan hoy."""
+        return self._run.get(_day_num(today), 0)
+
+    @property
+    def longest(self) -> int:
+        if self._longest is None:
+            self._longest = max(self._run.values(), default=0)
+        return self._longest
+
+    def monthly(self) -> pd.DataFrame:
+        """Por mes: días con gasto y racha más larga dentro del mes."""
+        if not self._days:
+            return pd.DataFrame(columns=["AÑO", "MES", "DIAS", "RACHA_MAX"])
+        days  = np.array(self._days, dtype="datetime64[D]")
+        fecha = pd.Series(days)
+        runs  = np.array([self._run[d] for d in self._days])
+        # Una racha que viene del mes anterior solo cuenta desde el día 1
+        out = pd.DataFrame({
+            "AÑO":   fecha.dt.year,
+            "MES_N": fecha.dt.month,
+            "RACHA": np.minimum(runs, fecha.dt.day.to_numpy()),
+        }).groupby(["AÑO", "MES_N"]).agg(DIAS=("RACHA", "size"), RACHA_MAX=("RACHA", "max"))
+        out = out.reset_index()
+        out.insert(1, "MES", [MESES_ORD[m - 1] for m in out["MES_N"]])
+        return out.drop(columns="MES_N")
+
+
+# ── Proyección de columnas ──────────────────────────────────
+# Las vistas numéricas (analítica, la matriz de presupuesto encima de
+# ella y los reportes por mes) no leen descripción ni ID: se arman sobre
+# las columnas que usan. Con copy-on-write la proyección no copia datos, y una columna que
+# la vista no pidió no puede colarse en su cálculo.
+ANALYTICS_COLS = ["FECHA", "AÑO", "MES", "CATEGORÍA", "MONTO"]
+
+
+def project(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Solo `columns`, en ese orden. KeyError si el ledger no tiene alguna."""
+    columns = list(columns)
+    if df.empty:
+        return df.reindex(columns=columns)   # el fallback vacío puede no traer esquema
+    return df[columns]
+
+
+def load_columns(columns: list) -> pd.DataFrame:
+    """Ledger vigente proyectado a `columns` (ver project())."""
+    return project(load_data(), columns)
+
+
+def _index_store(name: str) -> dict:
+    return _tenant_state()["derived"].setdefault(
+        name, {"lock": threading.Lock(), "version": None, "index": None})
+
+
+def _get_derived(name: str, build, key=lambda version: version, columns=None) -> tuple:
+    """
+    (vista, clave) de una vista derivada del ledger. build(df) recibe el
+    ledger de load_data.snapshot() (proyectado a `columns` si se dan) y la
+    clave sale de su misma versión; el lock del store hace que concurrentes
+    esperen una sola construcción.
+    """
+    store = _index_store(name)
+    with store["lock"]:
+        df, version = load_data.snapshot()
+        k = key(version)
+        if store["version"] != k or store["index"] is None:
+            store["index"]   = build(df if columns is None else project(df, columns))
+            store["version"] = k
+            _account(name, store["index"])
+        return store["index"], k
+
+
+def _get_index(name: str, build):
+    """Índice incremental del ledger actual; se reconstruye solo si cambió."""
+    return _get_derived(name, build)[0]
+
+
+def _patch_index(name: str, version: int, patch):
+    """
+    Aplica un cambio puntual al índice si estaba al día justo antes del
+    write que dejó el ledger en `version` (lo que devolvió patch()).
+    """
+    store = _index_store(name)
+    with store["lock"]:
+        if store["index"] is not None and store["version"] == version - 1:
+            patch(store["index"])
+            store["version"] = version
+            _account(name, store["index"])
+
+
+def get_streak_index() -> StreakIndex:
+    """Rachas del ledger vigente (el de load_data.snapshot())."""
+    return _get_index("streak", lambda df: StreakIndex(df["FECHA"]))
+
+
+def days_with_expense_streak() -> int:
+    """Racha: días CONSECUTIVOS con al menos un gasto (hasta hoy)."""
+    return get_streak_index().current(now_peru().date())
+
+
+# ── Estadística por categoría (sketches incrementales) ─────
+class CategorySketch:
+    """Resumen de los montos de una categoría, con altas y bajas en O(1).
+
+    - n, mean, m2: Welford (reversible, así que remove() es exacto)
+    - buckets:     histograma logarítmico tipo DDSketch; los cuantiles
+                   tienen error relativo ≤ ALPHA y el tamaño depende del
+                   rango de montos (~250 buckets de S/ 1 a S/ 10.000)
+    """
+
+    ALPHA = 0.02
+    GAMMA = (1 + ALPHA) / (1 - ALPHA)
+    _LOG  = math.log(GAMMA)
+    QS    = (0.5, 0.95, 0.99)
+
+    __slots__ = ("n", "mean", "m2", "buckets", "_q")
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, buckets=None):
+        self.n, self.mean, self.m2 = n, mean, m2
+        self.buckets = buckets or {}
+        self._q      = None              # cuantiles cacheados hasta el próximo cambio
+
+    @classmethod
+    def bucket(cls, x):
+        """Índice del bucket de x (escalar o arreglo); x > 0."""
+        return np.ceil(np.log(x) / cls._LOG).astype(int)
+
+    def add(self, x: float):
+        self.n   += 1
+        d         = x - self.mean
+        self.mean += d / self.n
+        self.m2  += d * (x - self.mean)
+        k = int(self.bucket(x))
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        self._q = None
+
+    def remove(self, x: float):
+        k = int(self.bucket(x))
+        if self.buckets.get(k, 0) == 0:
+            return
+        self.buckets[k] -= 1
+        if not self.buckets[k]:
+            del self.buckets[k]
+        if self.n == 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+        else:
+            mean      = (self.mean * self.n - x) / (self.n - 1)
+            self.m2  -= (x - mean) * (x - self.mean)
+            self.n   -= 1
+            self.mean = mean
+        self._q = None
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(max(self.m2, 0.0) / self.n) if self.n > 1 else 0.0
+
+    def quantiles(self) -> dict:
+        """{q: monto} para QS, en una pasada por los buckets (cacheado)."""
+        if self._q is None:
+            ks, out, acc = sorted(self.buckets), {}, 0
+            qs = iter(self.QS)
+            q  = next(qs)
+            for k in ks:
+                acc += self.buckets[k]
+                while q is not None and acc > q * (self.n - 1):
+                    out[q] = 2 * self.GAMMA ** k / (self.GAMMA + 1)   # centro del bucket
+                    q = next(qs, None)
+            self._q = out
+        return self._q
+
+
+class CategoryStats:
+    """Un CategorySketch por categoría; se construye vectorizado una vez por
+    versión del ledger y luego se mantiene con add()/remove()."""
+
+    MIN_N = 8   # con menos historia no se marca nada
+
+    def __init__(self, df: pd.DataFrame):
+        d = df[df["MONTO"] > 0]
+        self.sketches = {}
+        if d.empty:
+            return
+        agg = d.groupby("CATEGORÍA")["MONTO"].agg(["size", "mean", "var"])
+        bk  = (d.assign(_k=CategorySketch.bucket(d["MONTO"].to_numpy(dtype=float)))
+                .groupby(["CATEGORÍA", "_k"]).size())
+        for cat, r in agg.iterrows():
+            n  = int(r["size"])
+            m2 = float(r["var"]) * (n - 1) if n > 1 else 0.0
+            self.sketches[cat] = CategorySketch(n, float(r["mean"]), m2,
+                                                {int(k): int(c) for k, c in bk[cat].items()})
+
+    def add(self, cat: str, monto: float):
+        if monto > 0:
+            self.sketches.setdefault(cat, CategorySketch()).add(float(monto))
+
+    def remove(self, cat: str, monto: float):
+        if cat in self.sketches and monto > 0:
+            self.sketches[cat].remove(float(monto))
+
+    def assess(self, cat: str, monto: float) -> dict:
+        """
+        Qué tan habitual es un monto en su categoría:
+        {n, mediana, p95, z, nivel} con nivel None | "alto" (> p95 y al menos
+        1.5× la mediana) | "inusual" (> p99 y z ≥ 3). Vacío si no hay
+        historia suficiente. Exigir ambas condiciones evita marcar montos
+        apenas sobre el máximo en categorías muy parejas.
+        """
+        sk = self.sketches.get(cat)
+        if sk is None or sk.n < self.MIN_N:
+            return {}
+        q = sk.quantiles()
+        z = (monto - sk.mean) / sk.std if sk.std > 0 else 0.0
+        nivel = ("inusual" if monto > q[0.99] and z >= 3 else
+                 "alto"    if monto > q[0.95] and monto >= 1.5 * q[0.5] else None)
+        return {"n": sk.n, "mediana": q[0.5], "p95": q[0.95], "z": z, "nivel": nivel}
+
+
+def get_category_stats() -> CategoryStats:
+    """Sketches por categoría del ledger vigente (el de load_data.snapshot())."""
+    return _get_index("cat_stats", CategoryStats)
+
+
+# ── Analítica: series diarias, rolling y comparativos ───────
+MES_NUM = {m: i + 1 for i, m in enumerate(MESES_ORD)}
+
+
+def month_progress(anio: int, mes_n: int, today: dt.date) -> tuple[int, int]:
+    """(días transcurridos, días del mes). Meses pasados o futuros cuentan completos."""
+    dim = calendar.monthrange(anio, mes_n)[1]
+    if (anio, mes_n) == (today.year, today.month):
+        return today.day, dim
+    return dim, dim
+
+
+def project_month(total: float, anio: int, mes_n: int, today: dt.date) -> tuple[float, float]:
+    """(promedio diario, proyección al cierre) del mes."""
+    elapsed, dim = month_progress(anio, mes_n, today)
+    avg_day = total / max(elapsed, 1)
+    return avg_day, avg_day * dim
+
+
+def compute_stats(dfm: pd.DataFrame, total: float) -> dict:
+    if dfm.empty or total <= 0:
+        return {}
+    anio, mes = int(dfm["AÑO"].iloc[0]), dfm["MES"].iloc[0]
+    avg_day, proj = project_month(total, anio, MES_NUM.get(mes, 1), now_peru().date())
+    return {
+        "avg_day": avg_day,
+        "proj":    proj,
+        "n_tx":    len(dfm),
+        "top_cat": dfm.groupby("CATEGORÍA")["MONTO"].sum().idxmax(),
+    }
+
+
+# Rangos libres: clave → etiqueta (ver range_preset)
+RANGE_PRESETS = {
+    "7d":        "Últimos 7 días",
+    "30d":       "Últimos 30 días",
+    "45d":       "Últimos 45 días",
+    "trimestre": "Este trimestre",
+    "anio":      "Este año",
+}
+
+
+def range_preset(key: str, today: dt.date) -> tuple[dt.date, dt.date]:
+    """(desde, hasta) de un rango predefinido, ambos incluidos y terminando hoy."""
+    if key.endswith("d"):
+        return today - dt.timedelta(days=int(key[:-1]) - 1), today
+    if key == "trimestre":
+        return dt.date(today.year, 3 * ((today.month - 1) // 3) + 1, 1), today
+    if key == "anio":
+        return dt.date(today.year, 1, 1), today
+    raise ValueError(f"Rango desconocido: {key}")
+
+
+def range_stats(dfr: pd.DataFrame, total: float, desde: dt.date, hasta: dt.date) -> dict:
+    """Como compute_stats, pero sobre un rango de fechas en vez de un mes."""
+    if dfr.empty or total <= 0:
+        return {}
+    today   = now_peru().date()
+    elapsed = (min(hasta, today) - desde).days + 1
+    avg_day = total / max(elapsed, 1)
+    return {
+        "avg_day": avg_day,
+        "proj":    avg_day * ((hasta - desde).days + 1),
+        "n_tx":    len(dfr),
+        "top_cat": dfr.groupby("CATEGORÍA")["MONTO"].sum().idxmax(),
+    }
+
+
+class LedgerIndex:
+    """Ledger ordenado por FECHA para consultas por rango en O(log n + k).
+
+    - df:      filas con fecha válida, en orden estable por FECHA
+    - days:    FECHA como datetime64[D], sobre el que se hace searchsorted
+    - cum:     suma acumulada de MONTO → total de un rango en O(log n)
+    - by_cat:  posiciones (crecientes, luego también por fecha) de cada categoría
+    - cat_cum: suma acumulada de MONTO por categoría → totales por categoría
+               de un rango en O(categorías · log n)
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        d = df[df["FECHA"].notna()].sort_values("FECHA", kind="stable")
+        self.df     = d.reset_index(drop=True)
+        self.days   = self.df["FECHA"].to_numpy().astype("datetime64[D]")
+        self.cum    = np.concatenate([[0.0], self.df["MONTO"].to_numpy(dtype=float).cumsum()])
+        self.by_cat = {cat: np.asarray(pos) for cat, pos
+                       in self.df.groupby("CATEGORÍA", sort=False).indices.items()}
+        monto        = self.df["MONTO"].to_numpy(dtype=float)
+        self.cat_cum = {cat: np.concatenate([[0.0], monto[pos].cumsum()])
+                        for cat, pos in self.by_cat.items()}
+
+    @staticmethod
+    def _bounds(days: np.ndarray, desde: dt.date, hasta: dt.date) -> tuple[int, int]:
+        lo = np.searchsorted(days, np.datetime64(desde, "D"), side="left")
+        hi = np.searchsorted(days, np.datetime64(hasta, "D"), side="right")
+        return int(lo), int(max(lo, hi))
+
+    def range(self, desde: dt.date, hasta: dt.date, categoria=None) -> pd.DataFrame:
+        if categoria is None:
+            lo, hi = self._bounds(self.days, desde, hasta)
+            return self.df.iloc[lo:hi]
+        pos = self.by_cat.get(categoria)
+        if pos is None:
+            return self.df.iloc[:0]
+        lo, hi = self._bounds(self.days[pos], desde, hasta)
+        return self.df.iloc[pos[lo:hi]]
+
+    def total(self, desde: dt.date, hasta: dt.date) -> float:
+        lo, hi = self._bounds(self.days, desde, hasta)
+        return float(self.cum[hi] - self.cum[lo])
+
+    def totals(self, desde: dt.date, hasta: dt.date) -> pd.DataFrame:
+        """Total por categoría del rango (como _group_by_category), sin tocar las filas."""
+        out = []
+        for cat, pos in self.by_cat.items():
+            lo, hi = self._bounds(self.days[pos], desde, hasta)
+            if hi > lo:
+                out.append((cat, float(self.cat_cum[cat][hi] - self.cat_cum[cat][lo])))
+        return (pd.DataFrame(out, columns=["CATEGORÍA", "MONTO"])
+                  .sort_values("MONTO", ascending=False, ignore_index=True))
+
+
+def get_ledger_index() -> LedgerIndex:
+    """Índice por fecha del ledger vigente (load_data.snapshot()); se reconstruye solo si cambió."""
+    return _get_index("ledger_index", LedgerIndex)
+
+
+def _pct_change(cur: pd.Series, prev: pd.Series) -> pd.Series:
+    """Variación relativa; NaN donde el periodo anterior es 0."""
+    return cur / prev.where(prev != 0) - 1
+
+class LedgerAnalytics:
+    """Agregados del ledger completo, calculados una vez por versión y día.
+
+    - daily:   gasto por día calendario (días sin gasto = 0) hasta hoy
+    - rolling: suma móvil de 7 y 30 días sobre daily
+    - monthly: matriz periodo × categoría (periodo = año*12 + mes-1)
+    Cambiar de mes en la UI es un lookup sobre estas tablas.
+    """
+
+    def __init__(self, df: pd.DataFrame, today: dt.date):
+        self.today = today
+        if not df.empty and df["FECHA"].notna().any():
+            daily = df["MONTO"].groupby(df["FECHA"].dt.normalize()).sum()
+            days  = pd.date_range(daily.index.min(), max(daily.index.max(), pd.Timestamp(today)), freq="D")
+            self.daily = daily.reindex(days, fill_value=0.0)
+        else:
+            self.daily = pd.Series(dtype=float)
+        self.rolling = pd.DataFrame({
+            "7d":  self.daily.rolling(7, min_periods=1).sum(),
+            "30d": self.daily.rolling(30, min_periods=1).sum(),
+        })
+
+        if df.empty:
+            self.monthly = pd.DataFrame(dtype=float)
+        else:
+            period  = df["AÑO"].astype(int) * 12 + df["MES"].map(MES_NUM).fillna(1).astype(int) - 1
+            monthly = df.pivot_table(index=period, columns="CATEGORÍA", values="MONTO",
+                                     aggfunc="sum", fill_value=0.0)
+            # Periodos consecutivos para que shift(1)/shift(12) sean mes/año anterior
+            self.monthly = monthly.reindex(range(period.min(), period.max() + 1), fill_value=0.0)
+        totals = self.monthly.sum(axis=1)
+        self.mom     = self.monthly - self.monthly.shift(1, fill_value=0.0)
+        self.yoy     = self.monthly - self.monthly.shift(12, fill_value=0.0)
+        self.mom_pct = _pct_change(totals, totals.shift(1))
+        self.yoy_pct = _pct_change(totals, totals.shift(12))
+
+    def rolling_at(self, day: dt.date) -> tuple[float, float]:
+        ts = pd.Timestamp(day)
+        if self.rolling.empty or ts < self.rolling.index[0]:
+            return 0.0, 0.0
+        if ts > self.rolling.index[-1]:   # más allá del último día con datos
+            return (float(self.daily[ts - pd.Timedelta(days=6):].sum()),
+                    float(self.daily[ts - pd.Timedelta(days=29):].sum()))
+        row = self.rolling.iloc[self.rolling.index.searchsorted(ts, side="right") - 1]
+        return float(row["7d"]), float(row["30d"])
+
+    def month(self, anio: int, mes: str) -> dict:
+        """Comparativos y rolling para el mes elegido (sin recalcular nada)."""
+        mes_n = MES_NUM.get(mes, 1)
+        p     = anio * 12 + mes_n - 1
+        known = p in self.monthly.index
+        start = dt.date(anio, mes_n, 1)
+        end   = dt.date(anio, mes_n, calendar.monthrange(anio, mes_n)[1])
+        r7, r30 = self.rolling_at(end if start > self.today else min(self.today, end))
+        nan = float("nan")
+        return {
+            "roll_7d":  r7,
+            "roll_30d": r30,
+            "mom_pct":  float(self.mom_pct.get(p, nan)) if known else nan,
+            "yoy_pct":  float(self.yoy_pct.get(p, nan)) if known else nan,
+            "mom_cat":  self.mom.loc[p] if known else pd.Series(dtype=float),
+            "yoy_cat":  self.yoy.loc[p] if known else pd.Series(dtype=float),
+        }
+
+
+def _analytics() -> tuple:
+    """(LedgerAnalytics, (versión de datos, día)) del ledger actual."""
+    today = now_peru().date()
+    return _get_derived("analytics", lambda df: LedgerAnalytics(df, today),
+                        key=lambda version: (version, today), columns=ANALYTICS_COLS)
+
+
+def get_analytics() -> LedgerAnalytics:
+    """Analítica del ledger vigente, cacheada por (versión de datos, día)."""
+    return _analytics()[0]
+
+# ── Presupuesto vs real del año ─────────────────────────────
+# Umbrales de uso del presupuesto: los de la barra, las alertas y el mapa
+BUDGET_WARN_PCT = 80
+BUDGET_OVER_PCT = 100
+
+
+def budget_level(pct) -> str:
+    """"ok", "warn" (≥ 80%), "over" (≥ 100%) o "" si el mes no tiene presupuesto."""
+    if pd.isna(pct):
+        return ""
+    return "over" if pct >= BUDGET_OVER_PCT else "warn" if pct >= BUDGET_WARN_PCT else "ok"
+
+
+class BudgetMatrix:
+    """Presupuesto vs gasto real de todos los meses, con un solo join.
+
+    El dict de presupuestos se vuelve una serie por periodo (año*12 + mes-1)
+    y se alinea con la matriz periodo × categoría de LedgerAnalytics; ver
+    un año entero es un slice de 12 filas, sin recorrer meses.
+    """
+
+    def __init__(self, monthly: pd.DataFrame, budgets: dict):
+        keys   = pd.DataFrame(list(budgets), columns=["AÑO", "MES"])
+        period = keys["AÑO"].astype(int) * 12 + keys["MES"].map(MES_NUM) - 1
+        budget = pd.Series(list(budgets.values()), index=period, dtype=float)
+        budget = budget[budget.index.notna() & (budget > 0)]   # meses mal escritos en el Sheet
+        budget.index = budget.index.astype(int)
+
+        periods     = monthly.index.union(budget.index)
+        self.actual = monthly.reindex(periods, fill_value=0.0)
+        self.total  = self.actual.sum(axis=1)
+        self.budget = budget.groupby(level=0).last().reindex(periods)   # NaN = sin presupuesto
+        self.pct    = self.total / self.budget * 100
+
+    def year(self, anio: int) -> pd.DataFrame:
+        """
+        Una fila por mes (Enero…Diciembre): gasto por categoría (solo las
+        que tuvieron gasto, de mayor a menor en el año), TOTAL,
+        PRESUPUESTO y USO en % (NaN sin presupuesto) y NIVEL (budget_level).
+        """
+        periods = range(int(anio) * 12, int(anio) * 12 + 12)
+        act     = self.actual.reindex(periods, fill_value=0.0)
+        by_cat  = act.sum()
+        out     = act[by_cat[by_cat > 0].sort_values(ascending=False).index].assign(
+            TOTAL=self.total.reindex(periods, fill_value=0.0),
+            PRESUPUESTO=self.budget.reindex(periods),
+            USO=self.pct.reindex(periods),
+        )
+        uso = out["USO"]
+        out["NIVEL"] = np.select([uso.isna(), uso >= BUDGET_OVER_PCT, uso >= BUDGET_WARN_PCT],
+                                 ["", "over", "warn"], "ok")
+        out.index = pd.Index(MESES_ORD, name="MES")
+        out.columns.name = None
+        return out
+
+
+def get_budget_matrix() -> BudgetMatrix:
+    """Matriz del ledger y presupuestos vigentes, cacheada por ambas versiones y el día."""
+    store = _index_store("budget_matrix")
+    with store["lock"]:
+        analytics, key  = _analytics()
+        budgets, bver   = load_budgets.snapshot()
+        key            += (bver,)
+        if store["version"] != key or store["index"] is None:
+            store["index"]   = BudgetMatrix(analytics.monthly, budgets)
+            store["version"] = key
+            _account("budget_matrix", store["index"])
+        return store["index"]
+
+
+def export_csv(dfm: pd.DataFrame) -> bytes:
+    """
+    CSV del frame. Con cadenas Arrow lo escribe el writer de pyarrow sin
+    pasar por objetos Python (~10× más rápido); el texto sale entre comillas.
+    """
+    keep = [c for c in _LEDGER_COLS if c in dfm.columns]
+    if getattr(STR_DTYPE, "storage", None) != "pyarrow" or "FECHA" not in keep:
+        buf = io.StringIO()
+        dfm[keep].to_csv(buf, index=False)
+        return buf.getvalue().encode()
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    table = pa.Table.from_pandas(dfm[keep], preserve_index=False)
+    table = table.set_column(keep.index("FECHA"), "FECHA", table.column("FECHA").cast(pa.date32()))
+    buf   = io.BytesIO()
+    buf.write((",".join(keep) + "\n").encode())
+    pa_csv.write_csv(table, buf, pa_csv.WriteOptions(include_header=False))
+    return buf.getvalue()
+
+
+# ── Prefetch de meses vecinos ───────────────────────────────
+# Al mirar un mes, un hilo de fondo arma el anterior y el siguiente
+# (vista, totales, stats, comparativos y lo que la interfaz agregue en
+# extras); al tocar ‹ o › el rerun los encuentra listos. Se comparte
+# entre las sesiones del tenant y se invalida con la versión del ledger.
+PREFETCH_SIZE = 8   # meses armados por tenant
+_PREFETCH     = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+
+def adjacent_months(anio: int, mes: str) -> list[tuple[int, str]]:
+    n = int(anio) * 12 + MES_NUM[mes] - 1
+    return [(k // 12, MESES_ORD[k % 12]) for k in (n - 1, n + 1)]
+
+
+def _build_month(anio: int, mes: str, extras: dict) -> dict:
+    backend = get_backend()
+    an      = get_analytics()
+    dfm     = backend.query(anio, mes)
+    total   = float(dfm["MONTO"].sum()) if not dfm.empty else 0.0
+    grp     = backend.totals_by_category(anio, mes)
+    grp["PCT"] = grp["MONTO"] / total * 100 if total else 0.0
+    out = {
+        "dfm":    dfm,
+        "total":  total,
+        "grp":    grp,
+        "stats":  compute_stats(dfm, total),
+        "trends": an.month(anio, mes) if not an.monthly.empty else {},
+    }
+    for name, fn in extras.items():
+        out[name] = fn(out)
+    return out
+
+
+def _month_key(anio: int, mes: str, extras: dict) -> tuple:
+    return (load_data.version, now_peru().date(), int(anio), mes, tuple(extras))
+
+
+def _prefetch_store() -> dict:
+    return _tenant_state()["derived"].setdefault(
+        "prefetch", {"lock": threading.Lock(), "months": collections.OrderedDict()})
+
+
+def _remember(store: dict, key: tuple, fut: Future):
+    store["months"][key] = fut
+    while len(store["months"]) > PREFETCH_SIZE:
+        store["months"].popitem(last=False)
+    # El mes pesa recién al terminar. El callback corre en el hilo del pool
+    # (fuera del contexto del tenant) o aquí mismo con store["lock"] tomado:
+    # tenant explícito y una copia de los futures en vez de tomar el lock
+    tenant = current_tenant()
+    fut.add_done_callback(
+        lambda _: _tenant_registry().account(tenant, "prefetch", tuple(store["months"].values())))
+
+
+def get_month(anio: int, mes: str, extras: dict | None = None) -> dict:
+    """
+    Vistas derivadas de un mes: las del prefetch si ya están (o esperando
+    a que termine la que está en curso), si no se arman aquí mismo.
+    extras: {nombre: fn(mes_armado)} calculados junto con el resto.
+    """
+    extras = extras or {}
+    store  = _prefetch_store()
+    key    = _month_key(anio, mes, extras)
+    with store["lock"]:
+        fut = store["months"].get(key)
+        if fut is not None:
+            store["months"].move_to_end(key)
+    if fut is not None:
+        _CACHE_REQUESTS.inc(cache="month", result="hit" if fut.done() else "wait")
+        try:
+            return fut.result()
+        except Exception as e:
+            _swallowed("prefetch", e)   # se reintenta en primer plano
+    else:
+        _CACHE_REQUESTS.inc(cache="month", result="miss")
+    out = _build_month(anio, mes, extras)
+    fut = Future()
+    fut.set_result(out)
+    with store["lock"]:
+        _remember(store, key, fut)   # también sirve a las otras sesiones
+    return out
+
+
+def prefetch_months(months: list, extras: dict | None = None):
+    """Encola en segundo plano los meses que aún no estén armados."""
+    extras = extras or {}
+    store  = _prefetch_store()
+    with store["lock"]:
+        for anio, mes in months:
+            key = _month_key(anio, mes, extras)
+            if key in store["months"]:
+                continue
+            _remember(store, key, _PREFETCH.submit(contextvars.copy_context().run,
+                                                   _build_month, anio, mes, extras))
@@ -0,0 +1,497 @@
+# ============================================================
+# GESTOR DE GASTOS — prueba de carga
+# ============================================================
+# Cuántas sesiones simultáneas aguanta un proceso antes de que la
+# latencia de rerun se dispare. Levanta la app en un servidor Streamlit
+# real (subproceso) contra un Sheets en memoria con latencia simulada, y
+# la maneja con N clientes websocket que hablan el mismo protocolo que
+# el navegador: abrir el dashboard, navegar meses, buscar, dar de alta y
+# borrar. Se mide desde que sale el BackMsg hasta el script_finished.
+#
+#   python cli.py loadtest --sessions 1 5 10 20 --duration 30
+#
+# El servidor corre en una carpeta temporal (SQLite propio, sin .env ni
+# secrets): nunca toca la hoja ni el almacén locales de verdad.
+# ============================================================
+
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import datetime as dt
+from pathlib import Path
+
+import gspread
+import numpy as np
+
+APP_PATH = Path(__file__).with_name("app.py")
+
+LEDGER_HEADER = ["FECHA", "MES", "AÑO", "CATEGORÍA", "DESCRIPCION", "MONTO", "ID"]
+_MESES        = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto",
+                 "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+_CATS         = ["Alimentación", "Transporte", "Salud", "Ocio", "Casa", "Frutas", "Compras Generales", "Otros"]
+WORDS         = ["almuerzo", "taxi", "cine", "farmacia", "mercado", "luz", "agua", "regalo"]
+
+
+# ── Sheets en memoria ───────────────────────────────────────
+# Solo la parte de la API de gspread que usa gastos.py. Cada llamada
+# duerme `latency` segundos, como un round-trip a Google.
+class FakeWorksheet:
+    def __init__(self, sheets: "FakeSheets", title: str, rows: list):
+        self._sheets = sheets
+        self.title   = title
+        self.rows    = rows
+
+    def _call(self):
+        self._sheets.calls += 1
+        if self._sheets.latency:
+            time.sleep(self._sheets.latency)
+
+    def get_values(self, range_name=None, major_dimension=None, value_render_option=None, **kwargs):
+        self._call()
+        with self._sheets.lock:
+            width = max((len(r) for r in self.rows), default=0)
+            rows  = [list(r) + [""] * (width - len(r)) for r in self.rows]
+        if range_name:
+            g    = gspread.utils.a1_range_to_grid_range(range_name.split("!")[-1])
+            cols = slice(g.get("startColumnIndex", 0), g.get("endColumnIndex"))
+            rows = [r[cols] for r in rows[g.get("startRowIndex", 0):g.get("endRowIndex")]]
+        if str(getattr(major_dimension, "value", major_dimension)).upper() == "COLUMNS":
+            return [list(c) for c in zip(*rows)]
+        return rows
+
+    def get_all_values(self, **kwargs):
+        return [[str(v) for v in r] for r in self.get_values()]
+
+    def get_all_records(self, **kwargs):
+        rows = self.get_values()
+        return [dict(zip(rows[0], r)) for r in rows[1:]] if rows else []
+
+    def row_values(self, row: int, **kwargs):
+        self._call()
+        with self._sheets.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def update_cell(self, row: int, col: int, value):
+        self._call()
+        with self._sheets.lock:
+            while len(self.rows) < row:
+                self.rows.append([])
+            r = self.rows[row - 1]
+            r.extend([""] * (col - len(r)))
+            r[col - 1] = value
+
+    def append_row(self, values, **kwargs):
+        self._call()
+        with self._sheets.lock:
+            self.rows.append(list(values))
+            n = len(self.rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{n}:{chr(64 + len(values))}{n}"}}
+
+    def delete_rows(self, start_index: int, end_index: int | None = None):
+        self._call()
+        with self._sheets.lock:
+            del self.rows[start_index - 1:(end_index or start_index)]
+
+    def update(self, *args, values=None, range_name=None, **kwargs):
+        # Firma nueva (values, range_name) y vieja (range_name, values)
+        if args:
+            range_name, values = (args[0], args[1]) if isinstance(args[0], str) else (range_name, args[0])
+        self._call()
+        cell = (range_name or "A1").split(":")[0]
+        col  = ord(cell[0].upper()) - ord("A")
+        row  = int(cell[1:] or 1) - 1
+        with self._sheets.lock:
+            for i, vals in enumerate(values):
+                while len(self.rows) <= row + i:
+                    self.rows.append([])
+                r = self.rows[row + i]
+                r.extend([""] * (col + len(vals) - len(r)))
+                r[col:col + len(vals)] = list(vals)
+
+    def batch_update(self, data: list, **kwargs):
+        self._call()
+        with self._sheets.lock:
+            for d in data:
+                row, col = gspread.utils.a1_to_rowcol(d["range"].split("!")[-1].split(":")[0])
+                for i, vals in enumerate(d["values"]):
+                    while len(self.rows) < row + i:
+                        self.rows.append([])
+                    r = self.rows[row + i - 1]
+                    r.extend([""] * (col - 1 + len(vals) - len(r)))
+                    r[col - 1:col - 1 + len(vals)] = list(vals)
+
+    def update_title(self, title: str):
+        self._call()
+        self.title = title
+
+
+class FakeSpreadsheet:
+    def __init__(self, sheets: "FakeSheets", ledger: list):
+        self._sheets = sheets
+        self.sheet1  = FakeWorksheet(sheets, "Hoja 1", [LEDGER_HEADER] + ledger)
+        self._tabs   = [self.sheet1]
+
+    def worksheets(self):
+        self._sheets.calls += 1
+        return list(self._tabs)
+
+    def worksheet(self, title: str):
+        self._sheets.calls += 1
+        for ws in self._tabs:
+            if ws.title == title:
+                return ws
+        raise LookupError(title)   # gspread lanza WorksheetNotFound
+
+    def add_worksheet(self, title: str, rows: int = 0, cols: int = 0, **kwargs):
+        self._sheets.calls += 1
+        ws = FakeWorksheet(self._sheets, title, [])
+        self._tabs.append(ws)
+        return ws
+
+    def values_batch_get(self, ranges: list, params: dict | None = None):
+        # Solo rangos de hoja completa ("'Título'"), como los pide gastos.py
+        self._sheets.calls += 1
+        if self._sheets.latency:
+            time.sleep(self._sheets.latency)
+        by_title = {ws.title: ws for ws in self._tabs}
+        titles   = [r.split("!")[0].strip("'").replace("''", "'") for r in ranges]
+        if any(t not in by_title for t in titles):
+            raise LookupError(titles)   # la API responde 400: rango inválido
+        major = (params or {}).get("majorDimension", "ROWS")
+        out   = []
+        for r, t in zip(ranges, titles):
+            with self._sheets.lock:
+                rows = [list(x) for x in by_title[t].rows]
+            width = max((len(x) for x in rows), default=0)
+            rows  = [x + [""] * (width - len(x)) for x in rows]
+            out.append({"range": r, "majorDimension": major,
+                        "values": [list(c) for c in zip(*rows)] if major == "COLUMNS" else rows})
+        return {"valueRanges": out}
+
+
+class FakeSheets:
+    """Hace de pool de clientes y de cliente: get() → self, open() → el libro."""
+
+    def __init__(self, ledger: list, latency: float = 0.0):
+        self.latency = latency
+        self.lock    = threading.Lock()
+        self.calls   = 0
+        self._book   = FakeSpreadsheet(self, ledger)
+
+    def get(self):
+        return self
+
+    def open(self, title: str):
+        self.calls += 1
+        return self._book
+
+
+def seed_ledger(n: int, today: dt.date, seed: int = 0) -> list:
+    """n gastos repartidos en los últimos tres años, con texto dd/mm/aaaa como las altas de la app."""
+    rng  = np.random.default_rng(seed)
+    ago  = np.sort(rng.integers(0, 3 * 365, n))[::-1]
+    cats = rng.choice(_CATS, n)
+    desc = np.char.add(rng.choice(WORDS, n), rng.integers(0, 50, n).astype(str))
+    amts = (rng.gamma(2.0, 15.0, n) + 0.5).round(2)
+    rows = []
+    for i in range(n):
+        d = today - dt.timedelta(days=int(ago[i]))
+        rows.append([d.strftime("%d/%m/%Y"), _MESES[d.month - 1], d.year, str(cats[i]), str(desc[i]),
+                     float(amts[i]), f"lt{i:06x}"])
+    return rows
+
+
+# ── Servidor ────────────────────────────────────────────────
+def serve(port: int, rows: int, latency: float, seed: int = 0):
+    """Entrada del subproceso: instala el Sheets en memoria y corre la app."""
+    import gastos
+    from streamlit.web import bootstrap
+
+    gastos.use_client_pool(FakeSheets(seed_ledger(rows, gastos.now_peru().date(), seed), latency))
+    flags = {
+        "server_port":                port,
+        "server_address":             "127.0.0.1",
+        "server_headless":            True,
+        "server_fileWatcherType":     "none",
+        "server_enableStaticServing": True,
+        "browser_gatherUsageStats":   False,
+    }
+    bootstrap.load_config_options(flags)
+    bootstrap.run(str(APP_PATH), False, [], flags)
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(rows: int, latency: float, backend: str, workdir: str, timeout: float = 60.0):
+    port = _free_port()
+    env  = {k: v for k, v in os.environ.items()
+            if not k.startswith("GASTOS_") and k not in ("TENANTS", "GCP_SERVICE_ACCOUNT")}
+    env.update(GASTOS_BACKEND=backend, GASTOS_DB=os.path.join(workdir, "gastos.sqlite3"))
+    proc = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "serve", str(port), str(rows), str(latency)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "server.log"), "wb"),
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar (ver {workdir}/server.log)")
+        try:
+            if urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).status == 200:
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("El servidor no respondió a tiempo")
+
+
+def rss_bytes(pid: int) -> int | None:
+    """RSS actual de un proceso (Linux); None donde no hay /proc."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+# ── Sesión simulada ─────────────────────────────────────────
+# Guarda los widgets del último render (id, etiqueta, fragmento) y manda
+# BackMsg como el navegador: todos los valores vigentes más el trigger
+# del clic; si el widget vive en un fragmento, el rerun es del fragmento.
+_DONE = {0: "ok", 1: "compile_error", 3: "ok"}   # ScriptFinishedStatus; 2 = sigue otro rerun
+
+
+class SimSession:
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url      = url
+        self.timeout  = timeout
+        self.widgets  = {}   # id → (tipo, etiqueta o placeholder, fragment_id); tipo "expander" incluido
+        self.values   = {}   # id → WidgetState con el último valor escrito
+        self.errors   = 0
+        self._ws      = None
+
+    async def open(self) -> float:
+        from websockets.asyncio.client import connect
+        self._ws = await connect(self.url, subprotocols=["streamlit"], max_size=None)
+        return await self.rerun()
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+
+    def find(self, kind: str, key: str | None = None, label: str | None = None) -> list[str]:
+        return [wid for wid, (k, lab, _) in self.widgets.items()
+                if k == kind and (key is None or wid.endswith(f"-{key}")) and (label is None or lab.startswith(label))]
+
+    async def click(self, wid: str) -> float:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        return await self.rerun(WidgetState(id=wid, trigger_value=True), self.widgets[wid][2])
+
+    async def type(self, wid: str, text: str) -> float:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        self.values[wid] = WidgetState(id=wid, string_value=text)
+        return await self.rerun(fragment_id=self.widgets[wid][2])
+
+    async def toggle(self, wid: str, open_: bool = True) -> float:
+        """Abre o cierra un expander con on_change (los demás no son widgets)."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        # Una sola vez: al cambiar expanded el widget cambia de id y el viejo ya no existe
+        return await self.rerun(WidgetState(id=wid, bool_value=open_), self.widgets[wid][2])
+
+    async def rerun(self, trigger=None, fragment_id: str = "") -> float:
+        """Manda un rerun y espera a que termine; → segundos."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        msg = BackMsg()
+        cs  = msg.rerun_script
+        cs.widget_states.widgets.extend(self.values.values())
+        if trigger is not None:
+            cs.widget_states.widgets.append(trigger)
+        if fragment_id:
+            cs.fragment_id = fragment_id
+        t0 = time.perf_counter()
+        await self._ws.send(msg.SerializeToString())
+        await asyncio.wait_for(self._drain(), self.timeout)
+        return time.perf_counter() - t0
+
+    async def _drain(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        while True:
+            fm = ForwardMsg()
+            fm.ParseFromString(await self._ws.recv())
+            kind = fm.WhichOneof("type")
+            if kind == "new_session" and not fm.new_session.fragment_ids_this_run:
+                self.widgets.clear()   # rerun completo: el árbol se arma de nuevo
+            elif kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                self._see(fm.delta.new_element, fm.delta.fragment_id)
+            elif kind == "delta" and fm.delta.WhichOneof("type") == "add_block":
+                block = fm.delta.add_block
+                if block.WhichOneof("type") == "expandable" and block.expandable.id:
+                    self.widgets[block.expandable.id] = ("expander", block.expandable.label, fm.delta.fragment_id)
+            elif kind == "script_finished":
+                status = _DONE.get(fm.script_finished)
+                if status is not None:
+                    self.errors += status != "ok"
+                    return
+
+    def _see(self, el, fragment_id: str):
+        kind = el.WhichOneof("type")
+        if kind == "exception" or (kind == "alert" and "Error fatal" in el.alert.body):
+            self.errors += 1
+        elif kind in ("button", "text_input"):
+            w     = getattr(el, kind)
+            label = w.label if kind == "button" else (w.placeholder or w.label)
+            self.widgets[w.id] = (kind, label, fragment_id)
+
+
+# ── Flujos ──────────────────────────────────────────────────
+# Cada flujo devuelve [(acción, segundos)] o [] si el widget no está
+# (mes sin gastos, sin botón de borrar): entonces se elige otro.
+async def _nav(s: SimSession, rng: random.Random):
+    wid = s.find("button", key=rng.choice(["pm", "nm"]))
+    return [("navegar", await s.click(wid[0]))] if wid else []
+
+
+async def _search(s: SimSession, rng: random.Random):
+    box = s.find("text_input", label="Buscar")
+    if not box:
+        return []
+    out = [("buscar", await s.type(box[0], rng.choice(WORDS)))]
+    if box[0] in s.widgets:
+        out.append(("buscar", await s.type(box[0], "")))
+    return out
+
+
+async def _add(s: SimSession, rng: random.Random):
+    new = s.find("button", key="btn_nuevo_top")
+    if not new:
+        return []
+    out = [("alta", await s.click(new[0]))]
+    for step in ("monto", "Revisar", "✅ Confirmar"):
+        if step == "monto":
+            wid = s.find("text_input", key="monto_input")
+            if wid:
+                out.append(("alta", await s.type(wid[0], f"{rng.uniform(1, 80):.2f}")))
+            continue
+        wid = s.find("button", label=step)
+        if not wid:
+            break
+        out.append(("alta", await s.click(wid[0])))
+    s.values.clear()   # el formulario se descarta al volver al dashboard
+    return out
+
+
+async def _delete(s: SimSession, rng: random.Random):
+    out   = []
+    trash = s.find("button", label="🗑")
+    if not trash:
+        # Las categorías cerradas no renderizan sus movimientos: abrir una
+        cats = s.find("expander")
+        if not cats:
+            return []
+        out.append(("baja", await s.toggle(rng.choice(cats))))
+        trash = s.find("button", label="🗑")
+        if not trash:
+            return out
+    out.append(("baja", await s.click(rng.choice(trash))))
+    ok  = s.find("button", label="Eliminar")
+    if ok:
+        out.append(("baja", await s.click(ok[0])))
+    return out
+
+
+FLOWS = [(_nav, 0.45), (_search, 0.25), (_add, 0.15), (_delete, 0.15)]
+
+
+async def _session(url: str, until: float, think: float, seed: int, samples: list, counters: dict):
+    rng = random.Random(seed)
+    s   = SimSession(url)
+    try:
+        samples.append(("abrir", await s.open()))
+        while time.monotonic() < until:
+            flow = rng.choices([f for f, _ in FLOWS], weights=[w for _, w in FLOWS])[0]
+            samples.extend(await flow(s, rng))
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+    except Exception:
+        counters["caidas"] += 1   # timeout o conexión cerrada
+    finally:
+        counters["errores"] += s.errors
+        await s.close()
+
+
+def _pcts(xs: list) -> tuple:
+    if not xs:
+        return (float("nan"),) * 3
+    return tuple(float(v) * 1000 for v in np.percentile(xs, [50, 95, 99]))
+
+
+async def _level(url: str, pid: int, n: int, duration: float, think: float, seed: int) -> dict:
+    samples, counters, peak = [], {"errores": 0, "caidas": 0}, [rss_bytes(pid)]
+    until = time.monotonic() + duration
+
+    async def sample_rss():
+        while time.monotonic() < until:
+            peak.append(rss_bytes(pid))
+            await asyncio.sleep(0.5)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(sample_rss(), *(_session(url, until, think, seed * 1000 + i, samples, counters)
+                                         for i in range(n)))
+    wall = time.perf_counter() - t0
+    rss  = [r for r in peak + [rss_bytes(pid)] if r is not None]
+    lat  = [t for _, t in samples]
+    return {
+        "sesiones":  n,
+        "reruns":    len(samples),
+        "rps":       len(samples) / wall,
+        "pcts":      _pcts(lat),
+        "acciones":  {a: (len(ts), *_pcts(ts))
+                      for a in dict.fromkeys(a for a, _ in samples)
+                      for ts in [[t for b, t in samples if b == a]]},
+        "rss_mb":    max(rss) / 2**20 if rss else None,
+        **counters,
+    }
+
+
+def run(levels: list[int], duration: float = 30.0, rows: int = 5000, latency: float = 0.2,
+        think: float = 0.0, backend: str = "sheets", seed: int = 0, on_level=None) -> list[dict]:
+    """Levanta el servidor, corre cada nivel de concurrencia y lo apaga. → una fila por nivel."""
+    workdir = tempfile.mkdtemp(prefix="gastos-loadtest-")
+    proc, port = _start_server(rows, latency, backend, workdir)
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    try:
+        # Una sesión de calentamiento: primera carga del ledger y del SQLite
+        asyncio.run(_level(url, proc.pid, 1, 0.0, 0.0, seed))
+        out = []
+        for n in levels:
+            res = asyncio.run(_level(url, proc.pid, n, duration, think, seed))
+            out.append(res)
+            if on_level:
+                on_level(res)
+        return out
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["serve"]:
+    port, rows, latency = sys.argv[2:5]
+    serve(int(port), int(rows), float(latency))
@@ -0,0 +1,250 @@
+# ============================================================
+# GESTOR DE GASTOS — métricas del proceso
+# ============================================================
+# Contadores e histogramas en memoria con etiquetas, en formato de texto
+# de Prometheus. Se exponen por HTTP en un hilo daemon (serve) o en un
+# archivo que se reescribe cada tanto (write_every), para el textfile
+# collector de node_exporter o para un cron. Solo stdlib: no importa
+# gastos ni Streamlit, así lo usan la app, el CLI y los benchmarks.
+#
+# Registrar una métrica con el mismo nombre devuelve la existente: la
+# app vuelve a ejecutar el script en cada rerun sin duplicar series.
+# ============================================================
+
+import os
+import time
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latencias de red y de recarga: de 5 ms a 30 s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _series(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name    = name
+        self.help    = help
+        self.labels  = tuple(labels)
+        self._lock   = threading.Lock()
+        self._values = {}   # tupla de valores de etiqueta → estado
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: etiquetas {sorted(labels)}, se esperaban {list(self.labels)}")
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{_series(self.name, dict(zip(self.labels, k)))} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            st_ = self._values.get(key)
+            if st_ is None:
+                st_ = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    st_["counts"][i] += 1
+                    break
+            st_["sum"]   += value
+            st_["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observa la duración del bloque, aunque termine con excepción."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        st_ = self._values.get(self._key(labels))
+        return st_["count"] if st_ else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]})
+                           for k, v in self._values.items())
+        out = self._header()
+        for key, st_ in items:
+            labels = dict(zip(self.labels, key))
+            acc    = 0
+            for b, n in zip(self.buckets, st_["counts"]):
+                acc += n
+                out.append(f"{_series(self.name + '_bucket', {**labels, 'le': _fmt(b)})} {acc}")
+            out.append(f"{_series(self.name + '_bucket', {**labels, 'le': '+Inf'})} {st_['count']}")
+            out.append(f"{_series(self.name + '_sum', labels)} {_fmt(st_['sum'])}")
+            out.append(f"{_series(self.name + '_count', labels)} {st_['count']}")
+        return out
+
+
+class Gauge(_Metric):
+    """Valor que se lee al exponer: fn() → número, o {valores de etiqueta: número}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._fn = fn
+
+    def render(self) -> list[str]:
+        try:
+            value = self._fn()
+        except Exception:
+            return []   # una lectura fallida no debe tumbar el resto
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return self._header() + [
+            f"{_series(self.name, dict(zip(self.labels, k if isinstance(k, tuple) else (k,))))} {_fmt(v)}"
+            for k, v in sorted(items)
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            old = self._metrics.get(metric.name)
+            if old is not None:
+                if type(old) is not type(metric) or old.labels != metric.labels:
+                    raise ValueError(f"{metric.name} ya está registrada con otro tipo o etiquetas")
+                if isinstance(old, Gauge):
+                    old._fn = metric._fn   # el rerun trae una closure nueva
+                return old
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name: str, help: str, fn, labels: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, fn, labels))
+
+
+def render() -> str:
+    """Todas las métricas del proceso en formato de texto de Prometheus."""
+    return REGISTRY.render()
+
+
+# ── Exportadores ────────────────────────────────────────────
+# Uno de cada tipo por proceso: la app los pide en cada rerun.
+_EXPORT_LOCK = threading.Lock()
+_SERVER      = None
+_WRITERS     = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass   # un scrape cada 15 s no debe ensuciar el log de la app
+
+
+def serve(port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Sirve /metrics en un hilo daemon; si ya está levantado, devuelve ese."""
+    global _SERVER
+    with _EXPORT_LOCK:
+        if _SERVER is None:
+            _SERVER = ThreadingHTTPServer((addr, int(port)), _Handler)
+            _SERVER.daemon_threads = True
+            threading.Thread(target=_SERVER.serve_forever, name="metrics-http", daemon=True).start()
+        return _SERVER
+
+
+def write_file(path):
+    """Escribe las métricas de forma atómica (el collector nunca lee medio archivo)."""
+    path = os.fspath(path)
+    tmp  = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def write_every(path, interval: float = 15.0):
+    """Reescribe el archivo cada `interval` segundos en un hilo daemon."""
+    path = os.fspath(path)
+    with _EXPORT_LOCK:
+        if path in _WRITERS:
+            return
+
+        def loop():
+            while True:
+                try:
+                    write_file(path)
+                except OSError:
+                    pass   # disco lleno o carpeta borrada: se reintenta
+                time.sleep(interval)
+
+        _WRITERS[path] = threading.Thread(target=loop, name="metrics-file", daemon=True)
+        _WRITERS[path].start()
@@ -0,0 +1,148 @@
+# ============================================================
+# GESTOR DE GASTOS — reportes mensuales por lote
+# ============================================================
+# Una lámina por mes (total, donut por categoría, histórico diario) en
+# PNG, SVG o PDF. Cada mes se dibuja en un proceso aparte: matplotlib
+# es CPU-bound y su estado global no es seguro entre hilos, así que un
+# año o varios usan todos los núcleos. Los procesos solo dibujan: los
+# datos los lee el proceso padre (cli.py report o el botón de la app).
+# ============================================================
+
+import io
+import os
+import zipfile
+import calendar
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from gastos import MES_NUM, COLORS_MAP
+
+REPORT_FORMATS = ("png", "svg", "pdf")
+
+# Mismos tonos que el tema de la app
+_BG, _CARD, _TEXT, _MUTED, _PRIMARY = "#000000", "#121212", "#FFFFFF", "#A6A6A6", "#00E054"
+
+
+def report_name(anio: int, mes: str, fmt: str) -> str:
+    return f"{anio}-{MES_NUM[mes]:02d}_{mes}.{fmt}"
+
+
+def month_jobs(df: pd.DataFrame, years: list[int], budgets: dict | None = None, fmt: str = "png") -> list[dict]:
+    """Un trabajo por mes con gastos: solo lo que el proceso necesita para dibujar."""
+    if df.empty:
+        return []
+    budgets = budgets or {}
+    sub     = df[df["AÑO"].isin([int(y) for y in years])]
+    jobs    = []
+    for (anio, mes), g in sub.groupby(["AÑO", "MES"], sort=False):
+        if mes not in MES_NUM or g["MONTO"].sum() <= 0:
+            continue
+        jobs.append({
+            "anio":   int(anio),
+            "mes":    mes,
+            "fmt":    fmt,
+            "presup": float(budgets.get((int(anio), mes), 0.0)),
+            "data":   g[["FECHA", "CATEGORÍA", "MONTO"]].reset_index(drop=True),
+        })
+    return sorted(jobs, key=lambda j: (j["anio"], MES_NUM[j["mes"]]))
+
+
+def render_month(job: dict) -> tuple[str, bytes]:
+    """Dibuja la lámina de un mes; corre dentro de un proceso del pool."""
+    from matplotlib.figure import Figure   # sin pyplot: nada de estado global
+
+    data, anio, mes = job["data"], job["anio"], job["mes"]
+    total  = float(data["MONTO"].sum())
+    grp    = data.groupby("CATEGORÍA")["MONTO"].sum().sort_values(ascending=False)
+    dim    = calendar.monthrange(anio, MES_NUM[mes])[1]
+    daily  = (data.groupby(data["FECHA"].dt.day)["MONTO"].sum()
+                  .reindex(range(1, dim + 1), fill_value=0.0))
+
+    fig = Figure(figsize=(8.27, 11.69), dpi=150, facecolor=_BG)   # A4 vertical
+    gs  = fig.add_gridspec(3, 2, height_ratios=[1, 2.2, 1.6], hspace=0.35, wspace=0.1,
+                           left=0.07, right=0.95, top=0.95, bottom=0.06)
+
+    # ── Tarjeta de total ────────────────────────────────────
+    card = fig.add_subplot(gs[0, :])
+    card.set_facecolor(_CARD)
+    card.set_xticks([]); card.set_yticks([])
+    for s in card.spines.values():
+        s.set_visible(False)
+    card.text(0.04, 0.78, f"TOTAL GASTADO · {mes.upper()} {anio}", color=_MUTED,
+              fontsize=10, fontweight="bold", transform=card.transAxes)
+    card.text(0.04, 0.32, f"S/ {total:,.2f}", color=_TEXT, fontsize=30,
+              fontweight="bold", family="monospace", transform=card.transAxes)
+    sub = f"{len(data)} movimientos · top {grp.index[0]}"
+    if job["presup"] > 0:
+        sub += f" · {total / job['presup'] * 100:.0f}% de S/ {job['presup']:,.0f}"
+    card.text(0.04, 0.1, sub, color=_MUTED, fontsize=9, transform=card.transAxes)
+
+    # ── Donut por categoría + leyenda ───────────────────────
+    donut  = fig.add_subplot(gs[1, 0])
+    colors = [COLORS_MAP.get(c, "#555") for c in grp.index]
+    donut.pie(grp.values, colors=colors, startangle=90, counterclock=False,
+              wedgeprops={"width": 0.35, "edgecolor": _BG, "linewidth": 1.5})
+    donut.text(0, 0, f"{grp.iloc[0] / total * 100:.0f}%", color=_TEXT, fontsize=22,
+               fontweight="bold", ha="center", va="center", family="monospace")
+    legend = fig.add_subplot(gs[1, 1])
+    legend.axis("off")
+    step = min(0.085, 0.95 / len(grp))
+    for i, (cat, amt) in enumerate(grp.items()):
+        y = 0.96 - i * step
+        legend.scatter([0.04], [y], s=60, color=COLORS_MAP.get(cat, "#555"),
+                       transform=legend.transAxes, clip_on=False)
+        legend.text(0.1, y, cat, color=_TEXT, fontsize=10, va="center", transform=legend.transAxes)
+        legend.text(0.98, y, f"S/ {amt:,.0f} · {amt / total * 100:.0f}%", color=_MUTED, fontsize=9,
+                    va="center", ha="right", transform=legend.transAxes)
+
+    # ── Histórico diario ────────────────────────────────────
+    hist = fig.add_subplot(gs[2, :])
+    hist.set_facecolor(_BG)
+    bars = hist.bar(daily.index, daily.values, color=_PRIMARY, alpha=0.85, width=0.6)
+    bars[int(daily.values.argmax())].set_color(_TEXT)
+    for side in ("top", "right", "left"):
+        hist.spines[side].set_visible(False)
+    hist.spines["bottom"].set_color("#333")
+    hist.tick_params(colors=_MUTED, labelsize=7)
+    hist.set_xticks(range(1, dim + 1, 2))
+    hist.yaxis.grid(True, linestyle="--", alpha=0.1, color=_TEXT)
+    hist.set_title("GASTO POR DÍA", color=_MUTED, fontsize=9, fontweight="bold", loc="left")
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=job["fmt"], facecolor=_BG)
+    return report_name(anio, mes, job["fmt"]), buf.getvalue()
+
+
+def render_reports(jobs: list[dict], workers: int | None = None) -> dict[str, bytes]:
+    """
+    {nombre de archivo: contenido} de todos los meses, en orden.
+    Con un solo trabajo (o workers=1) no se levanta el pool.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return dict(map(render_month, jobs))
+    # spawn: un fork heredaría los hilos de sync/SWR del proceso padre
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        return dict(ex.map(render_month, jobs))
+
+
+def write_reports(files: dict[str, bytes], out_dir) -> list[Path]:
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, data in files.items():
+        (out / name).write_bytes(data)
+        paths.append(out / name)
+    return paths
+
+
+def zip_reports(files: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
@@ -0,0 +1,14 @@
+// Forzar teclado numérico en iPhone para campos de monto
+(function () {
+  if (window.__gastosInputmode) return;
+  window.__gastosInputmode = true;
+  function patchInputs() {
+    document.querySelectorAll('input[type="number"]').forEach(function (el) {
+      el.setAttribute('inputmode', 'decimal');
+      el.setAttribute('pattern', '[0-9]*');
+    });
+  }
+  patchInputs();
+  var obs = new MutationObserver(patchInputs);
+  obs.observe(document.body, { childList: true, subtree: true });
+})();
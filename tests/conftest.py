@@ -0,0 +1,47 @@
+# Pruebas sin red: Google Sheets en memoria (loadtest.FakeSheets) y un
+# tenant nuevo por prueba, así ningún caché ni índice pasa de una a otra.
+import sys
+import uuid
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import gastos    # noqa: E402
+import loadtest  # noqa: E402
+
+
+@pytest.fixture
+def book():
+    """Libro en memoria con 300 gastos de los últimos tres años."""
+    return loadtest.FakeSheets(loadtest.seed_ledger(300, gastos.now_peru().date(), seed=7))
+
+
+def _fresh_tenant(monkeypatch):
+    # Registro propio: ni los tenants ni el trabajo de fondo de otras
+    # pruebas cuentan para los límites de esta
+    monkeypatch.setattr(gastos, "_REGISTRY",
+                        gastos.TenantRegistry(gastos.TENANT_MAX_ACTIVE, gastos.TENANT_MEMORY_LIMIT))
+    key = f"t{uuid.uuid4().hex[:8]}"
+    gastos.use_tenant(gastos.Tenant(key, f"Gastos {key}", "Prueba"))
+
+
+@pytest.fixture
+def sheets(book, monkeypatch):
+    """Backend "sheets" contra el libro en memoria."""
+    monkeypatch.setattr(gastos, "STORAGE_BACKEND", "sheets")
+    gastos.use_client_pool(book)
+    _fresh_tenant(monkeypatch)
+    return book
+
+
+@pytest.fixture
+def local(book, monkeypatch, tmp_path):
+    """Backend "sqlite" (sin hilo de sync) replicando al libro en memoria."""
+    monkeypatch.setattr(gastos, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(gastos, "LOCAL_DB_PATH", str(tmp_path / "gastos.sqlite3"))
+    gastos.use_client_pool(book)
+    _fresh_tenant(monkeypatch)
+    gastos.get_backend().sync.pull()
+    return book
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+import gastos
+
+
+@pytest.fixture
+def batch(sheets, monkeypatch):
+    """Libro con presupuesto y registro de los rangos pedidos en cada batchGet."""
+    assert gastos.save_budget(2026, "Enero", 500.0)
+    gastos.load_data(), gastos.load_budgets()   # handles abiertos: solo se cuentan las lecturas
+    real, batches = sheets._book.values_batch_get, []
+
+    def spy(ranges, params=None):
+        batches.append([r.strip("'") for r in ranges])
+        return real(ranges, params)
+
+    monkeypatch.setattr(sheets._book, "values_batch_get", spy)
+    return sheets, batches
+
+
+def _reload(sheets) -> int:
+    gastos.load_data.clear()
+    gastos.load_budgets.clear()
+    sheets.calls = 0
+    gastos.load_data(), gastos.load_budgets()
+    return sheets.calls
+
+
+def _per_sheet() -> tuple[pd.DataFrame, dict]:
+    """Las mismas hojas leídas una por una, sin batchGet."""
+    return gastos._fetch_sheet_ledger(), gastos._fetch_sheet_budgets()
+
+
+def test_reload_is_one_batch(batch):
+    sheets, batches = batch
+    assert _reload(sheets) == 2            # metadatos del libro + batchGet
+    assert batches == [["Hoja 1", gastos.BUDGET_SHEET]]
+    assert gastos.load_budgets() == {(2026, "Enero"): 500.0}
+
+
+def test_batch_matches_per_sheet_reads(batch):
+    ledger, budgets = gastos._fetch_sheet_all()
+    one_by_one, budgets_1 = _per_sheet()
+    pd.testing.assert_frame_equal(ledger, one_by_one)
+    assert budgets == budgets_1 == {(2026, "Enero"): 500.0}
+
+
+def test_partitions_share_the_batch(batch):
+    sheets, batches = batch
+    years = sorted(gastos.migrate_to_partitions()["años"])
+    gastos.thaw_partitions()
+    assert _reload(sheets) == 2
+    assert batches[-1] == [gastos._partition_title(y) for y in years] + [gastos.BUDGET_SHEET]
+
+    # Años cerrados congelados: el siguiente batch solo trae el año en curso
+    assert _reload(sheets) == 2
+    assert batches[-1] == [gastos._partition_title(gastos.now_peru().year), gastos.BUDGET_SHEET]
+
+    gastos.thaw_partitions()
+    ledger, budgets = gastos._fetch_sheet_all()
+    gastos.thaw_partitions()
+    one_by_one, budgets_1 = _per_sheet()
+    pd.testing.assert_frame_equal(ledger, one_by_one)
+    assert budgets == budgets_1
+    assert len(ledger) == 300
+
+
+def test_missing_budget_tab_falls_back(sheets):
+    ledger, budgets = gastos._fetch_sheet_all()
+    assert budgets == {}
+    assert gastos.BUDGET_SHEET in [ws.title for ws in sheets._book._tabs]
+    pd.testing.assert_frame_equal(ledger, gastos._fetch_sheet_ledger())
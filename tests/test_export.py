@@ -0,0 +1,51 @@
+import io
+
+import pandas as pd
+import pytest
+
+import gastos
+
+STR_COLS = ["MES", "CATEGORÍA", "DESCRIPCION", "ID"]
+
+
+def _reimport(data: bytes) -> pd.DataFrame:
+    return pd.read_csv(io.BytesIO(data), dtype={c: gastos.STR_DTYPE for c in STR_COLS},
+                       parse_dates=["FECHA"], date_format="%Y-%m-%d", keep_default_na=False)
+
+
+@pytest.fixture
+def ledger(sheets):
+    # Texto con comas, comillas y saltos de línea, e IDs que parecen números
+    sheets._book.sheet1.rows += [
+        ["02/01/2024", "Enero", 2024, "Ocio", 'cine, "estreno"\nfunción 2', 14.25, "000123"],
+        ["03/01/2024", "Enero", 2024, "Salud", "farmacia", 1250.5, "1e5"],
+    ]
+    gastos.load_data.clear()
+    return gastos.load_data()
+
+
+def test_export_dtypes(ledger):
+    assert all(ledger[c].dtype == gastos.STR_DTYPE for c in STR_COLS)
+    back = _reimport(gastos.export_csv(ledger))
+    assert back.columns.tolist() == gastos._LEDGER_COLS
+    assert all(back[c].dtype == gastos.STR_DTYPE for c in STR_COLS)
+    assert pd.api.types.is_datetime64_dtype(back["FECHA"])
+    assert back["MONTO"].dtype == float
+    assert back["AÑO"].dtype == ledger["AÑO"].dtype
+
+
+def test_export_round_trip(ledger):
+    back = _reimport(gastos.export_csv(ledger))
+    assert back["ID"].tolist() == ledger["ID"].tolist()
+    assert {"000123", "1e5"} <= set(back["ID"])
+    pd.testing.assert_frame_equal(back, ledger[gastos._LEDGER_COLS].reset_index(drop=True),
+                                  check_dtype=False)
+    pd.testing.assert_series_equal(back["FECHA"].dt.date, ledger["FECHA"].dt.date)
+
+
+def test_export_of_a_filtered_view(ledger):
+    view = gastos.filter_data(ledger, "Enero", 2024)
+    back = _reimport(gastos.export_csv(view))
+    assert {"000123", "1e5"} <= set(view["ID"])
+    assert back["ID"].tolist() == view["ID"].tolist()
+    assert back["MONTO"].sum() == pytest.approx(view["MONTO"].sum())
@@ -0,0 +1,111 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+import gastos
+
+
+def _gasto(day, amount, category="Alimentación", description="menú"):
+    return {"date": dt.datetime.combine(day, dt.time(12)), "amount": amount,
+            "category": category, "description": description}
+
+
+@pytest.fixture
+def edited(sheets):
+    """Índices armados y luego mantenidos con altas, bajas y ediciones."""
+    df     = gastos.load_data()
+    streak = gastos.get_streak_index()
+    stats  = gastos.get_category_stats()
+    today  = gastos.now_peru().date()
+    ids    = []
+    for i, day in enumerate([today, today, today - dt.timedelta(days=1), today - dt.timedelta(days=40)]):
+        ok, gasto_id = gastos.save_to_sheet(_gasto(day, 10.0 + i, description=f"alta {i}"))
+        assert ok
+        ids.append(gasto_id)
+    old = df.sort_values("FECHA")["ID"].tolist()
+    for gasto_id in (old[0], old[len(old) // 2], ids[1]):
+        assert gastos.delete_from_sheet(gasto_id) == (True, "OK")
+    assert gastos.update_expense(ids[2], _gasto(today - dt.timedelta(days=3), 99.0, "Ocio", "editado"))[0]
+    assert gastos.update_expense(old[-1], _gasto(today - dt.timedelta(days=700), 5.5, "Salud", "viejo"))[0]
+    # Siguen siendo los mismos objetos: se parcharon, no se reconstruyeron
+    assert gastos.get_streak_index() is streak
+    assert gastos.get_category_stats() is stats
+    return streak, stats
+
+
+def _reload():
+    gastos.load_data.clear()
+    return gastos.load_data()
+
+
+def test_streak_index_matches_recompute(edited):
+    streak = edited[0]
+    fresh  = gastos.StreakIndex(_reload()["FECHA"])
+    assert streak._days == fresh._days
+    assert streak._count == fresh._count
+    assert streak._run == fresh._run
+    assert streak.longest == fresh.longest
+    today = gastos.now_peru().date()
+    assert streak.current(today) == fresh.current(today)
+    pd.testing.assert_frame_equal(streak.monthly(), fresh.monthly())
+
+
+def test_category_stats_match_recompute(edited):
+    stats = edited[1]
+    fresh = gastos.CategoryStats(_reload())
+    live  = {c: s for c, s in stats.sketches.items() if s.n}
+    assert live.keys() == fresh.sketches.keys()
+    for cat, sk in fresh.sketches.items():
+        got = live[cat]
+        assert got.n == sk.n
+        assert got.buckets == sk.buckets
+        assert got.mean == pytest.approx(sk.mean)
+        assert got.m2 == pytest.approx(sk.m2)
+        assert got.quantiles() == sk.quantiles()
+
+
+def test_ledger_index_follows_writes(edited):
+    idx   = gastos.get_ledger_index()
+    fresh = _reload()
+    assert sorted(idx.df["ID"]) == sorted(fresh["ID"])
+    desde, hasta = dt.date(2000, 1, 1), gastos.now_peru().date()
+    assert idx.total(desde, hasta) == pytest.approx(fresh["MONTO"].sum())
+    for cat in fresh["CATEGORÍA"].unique():
+        assert sorted(idx.range(desde, hasta, cat)["ID"]) == sorted(fresh.loc[fresh["CATEGORÍA"] == cat, "ID"])
+
+
+def test_budget_matrix_follows_writes(sheets):
+    today = gastos.now_peru().date()
+    mes   = gastos.MESES_ORD[today.month - 1]
+    before = gastos.get_budget_matrix().year(today.year)
+    assert gastos.save_budget(today.year, mes, 500.0)
+    assert gastos.save_to_sheet(_gasto(today, 123.0))[0]
+
+    got   = gastos.get_budget_matrix().year(today.year)
+    fresh = gastos.BudgetMatrix(gastos.LedgerAnalytics(gastos.load_data(), today).monthly,
+                                gastos.load_budgets()).year(today.year)
+    pd.testing.assert_frame_equal(got, fresh)
+    assert got.loc[mes, "PRESUPUESTO"] == 500.0
+    assert got.loc[mes, "TOTAL"] == pytest.approx(before.loc[mes, "TOTAL"] + 123.0)
+
+
+def test_note_delete_shifts_rows_below(sheets):
+    gastos._row_index()["Gastos"] = {"cols": {"ID": 7},
+                                     "rows": {"a": 2, "b": 3, "c": 4, "d": 5}}
+    gastos._note_delete("Gastos", 3)
+    assert gastos._row_index()["Gastos"]["rows"] == {"a": 2, "c": 3, "d": 4}
+    gastos._note_delete("Otra", 2)   # hoja sin índice: nada que hacer
+    assert "Otra" not in gastos._row_index()
+
+
+def test_row_index_tracks_sheet_after_writes(sheets):
+    gastos.load_data()
+    today = gastos.now_peru().date()
+    assert gastos.save_to_sheet(_gasto(today, 42.0))[0]
+    victim = sheets._book.sheet1.rows[5][6]
+    assert gastos.delete_from_sheet(victim) == (True, "OK")
+    rows = sheets._book.sheet1.rows
+    want = {r[6]: i + 1 for i, r in enumerate(rows) if i}
+    idx  = gastos._row_index()[sheets._book.sheet1.title]["rows"]
+    assert idx == want
@@ -0,0 +1,66 @@
+import datetime as dt
+
+import pytest
+
+import gastos
+
+BACKENDS = ["sheets", "local"]
+
+
+def _serial(day: dt.date) -> int:
+    """Fecha-celda como la devuelve UNFORMATTED_VALUE."""
+    return (day - dt.date(1899, 12, 30)).days
+
+
+@pytest.fixture(params=BACKENDS)
+def ingested(request):
+    """Filas crudas escritas a mano en el Sheet y recargadas por la ingesta."""
+    book  = request.getfixturevalue(request.param)
+    day   = gastos.now_peru().date() - dt.timedelta(days=5 * 365)   # antes de todo el seed
+    prev  = day - dt.timedelta(days=1)
+    book._book.sheet1.rows += [
+        [_serial(day), "Enero", day.year, "Ocio", "cine", 12.5, "in-serial"],
+        [prev.strftime("%d/%m/%Y"), "enero", str(prev.year), " Salud ", " farmacia ", "1,250.50", "in-texto"],
+        [day.isoformat(), "Enero", day.year, "Ocio", "inferida", 3, "in-iso"],
+        [day.strftime("%d/%m/%Y"), "Enero", day.year, "Ocio", "gratis", 0, "in-cero"],
+        ["", "", "", "", "", "", ""],
+    ]
+    if request.param == "local":
+        gastos.get_backend().sync.pull()
+    gastos.load_data.clear()
+    return day, prev
+
+
+def test_ingested_rows_reach_the_snapshot(ingested):
+    day, prev = ingested
+    df  = gastos.load_data().set_index("ID")
+    got = df.loc[["in-serial", "in-texto", "in-iso"]]
+    assert got["FECHA"].dt.date.tolist() == [day, prev, day]
+    assert got["MONTO"].tolist() == [12.5, 1250.5, 3.0]
+    assert got.loc["in-texto", "CATEGORÍA"] == "Salud"
+    assert got.loc["in-texto", "DESCRIPCION"] == "farmacia"
+    assert "in-cero" not in df.index
+
+
+def test_ingest_report_counts_drops(sheets):
+    sheets._book.sheet1.rows += [["01/01/2020", "Enero", 2020, "Ocio", "gratis", 0, "in-cero"],
+                                 ["", "", "", "", "", "", ""]]
+    gastos.load_data.clear()
+    gastos.load_data()
+    report = gastos.ingest_report()
+    assert report["filas"] == 302 and report["cargadas"] == 300
+    assert report["descartadas"] == {"vacías": 1, "monto_no_positivo": 1}
+
+
+def test_ingested_rows_reach_the_indexes(ingested):
+    day, prev = ingested
+    idx = gastos.get_ledger_index()
+    assert idx.total(prev, day) == 12.5 + 1250.5 + 3.0
+    assert idx.range(prev, prev)["ID"].tolist() == ["in-texto"]
+
+    streak = gastos.get_streak_index()
+    assert streak.current(day) == 2
+
+    df  = gastos.load_data()
+    n   = int(((df["CATEGORÍA"] == "Ocio") & (df["MONTO"] > 0)).sum())
+    assert gastos.get_category_stats().sketches["Ocio"].n == n
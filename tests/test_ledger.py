@@ -0,0 +1,23 @@
+import gastos
+
+
+def test_session_views_do_not_write_into_the_snapshot(sheets):
+    mine, theirs = gastos.load_data(), gastos.load_data()
+    col = mine.columns.get_loc("MONTO")
+    before = float(theirs.iat[0, col])
+    mine.iloc[0, col] = -1.0
+    mine["EXTRA"] = 1
+    assert float(theirs.iat[0, col]) == before
+    assert float(gastos.load_data().iat[0, col]) == before
+    assert "EXTRA" not in gastos.load_data().columns
+
+
+def test_edit_patch_leaves_earlier_views_alone(sheets):
+    view = gastos.load_data()
+    r    = view.loc[view["ID"] == "lt000009"].iloc[0]
+    data = {"date": r["FECHA"].to_pydatetime(), "amount": 999.0,
+            "category": r["CATEGORÍA"], "description": r["DESCRIPCION"]}
+    assert gastos.update_expense("lt000009", data) == (True, "OK")
+    assert float(view.loc[view["ID"] == "lt000009", "MONTO"].iloc[0]) == float(r["MONTO"])
+    fresh = gastos.load_data()
+    assert float(fresh.loc[fresh["ID"] == "lt000009", "MONTO"].iloc[0]) == 999.0
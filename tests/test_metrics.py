@@ -0,0 +1,26 @@
+import socket
+
+import gastos
+import metrics
+
+
+def test_metrics_port_in_use_does_not_crash(monkeypatch, caplog):
+    busy = socket.socket()
+    busy.bind(("127.0.0.1", 0))
+    busy.listen()
+    try:
+        monkeypatch.setenv("GASTOS_METRICS_PORT", str(busy.getsockname()[1]))
+        monkeypatch.delenv("GASTOS_METRICS_FILE", raising=False)
+        monkeypatch.setattr(gastos, "_METRICS_EXPORTED", False)
+        monkeypatch.setattr(metrics, "_SERVER", None)
+        gastos.enable_metrics_export()
+        assert "metrics" in caplog.text
+        assert metrics._SERVER is None
+        assert 'where="metrics_export"' in metrics.render()
+        # Un rerun no vuelve a intentar el bind
+        bind = []
+        monkeypatch.setattr(metrics, "serve", lambda *a: bind.append(a))
+        gastos.enable_metrics_export()
+        assert bind == []
+    finally:
+        busy.close()
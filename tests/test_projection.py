@@ -0,0 +1,52 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+import gastos
+import reports
+
+
+def test_projected_load_has_exactly_the_columns(sheets):
+    cols = ["MONTO", "FECHA", "CATEGORÍA"]
+    df   = gastos.load_columns(cols)
+    assert df.columns.tolist() == cols
+    full = gastos.load_data()
+    pd.testing.assert_frame_equal(df, full[cols])
+    assert gastos.load_columns(gastos.ANALYTICS_COLS).columns.tolist() == gastos.ANALYTICS_COLS
+    with pytest.raises(KeyError):
+        gastos.load_columns(["FECHA", "NOTA"])
+
+
+def test_projection_does_not_write_into_the_snapshot(sheets):
+    df = gastos.load_columns(gastos.ANALYTICS_COLS)
+    before = float(gastos.load_data()["MONTO"].iat[0])
+    df.iloc[0, df.columns.get_loc("MONTO")] = -1.0
+    assert float(gastos.load_data()["MONTO"].iat[0]) == before
+
+
+def test_projection_of_the_empty_fallback():
+    df = gastos.project(pd.DataFrame(), gastos.ANALYTICS_COLS)
+    assert df.empty and df.columns.tolist() == gastos.ANALYTICS_COLS
+    assert gastos.LedgerAnalytics(df, dt.date(2026, 1, 1)).monthly.empty
+
+
+def test_views_render_from_the_projection(sheets):
+    today = gastos.now_peru().date()
+    mes   = gastos.MESES_ORD[today.month - 1]
+    an    = gastos.get_analytics()
+    ref   = gastos.LedgerAnalytics(gastos.load_data(), today)
+    pd.testing.assert_frame_equal(an.monthly, ref.monthly)
+    pd.testing.assert_frame_equal(an.rolling, ref.rolling)
+    assert an.month(today.year, mes)["roll_30d"] == ref.month(today.year, mes)["roll_30d"]
+
+    assert gastos.save_budget(today.year, mes, 500.0)
+    year = gastos.get_budget_matrix().year(today.year)
+    assert len(year) == 12
+
+    view = gastos.get_month(today.year, mes)
+    assert view["stats"]["n_tx"] > 0
+
+    jobs = reports.month_jobs(gastos.load_columns(gastos.ANALYTICS_COLS), [today.year])
+    name, data = reports.render_month(jobs[-1])
+    assert name.endswith(".png") and data.startswith(b"\x89PNG")
@@ -0,0 +1,36 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+import gastos
+
+
+def _brute(desde, hasta):
+    df = gastos.load_data()
+    d  = df[(df["FECHA"].dt.date >= desde) & (df["FECHA"].dt.date <= hasta)]
+    return d, d.groupby("CATEGORÍA")["MONTO"].sum()
+
+
+@pytest.mark.parametrize("preset", list(gastos.RANGE_PRESETS))
+@pytest.mark.parametrize("store", ["sheets", "local"])
+def test_range_totals_match_rows(store, preset, request):
+    request.getfixturevalue(store)
+    backend      = gastos.get_backend()
+    desde, hasta = gastos.range_preset(preset, gastos.now_peru().date())
+    rows, by_cat = _brute(desde, hasta)
+
+    assert backend.total_range(desde, hasta) == pytest.approx(rows["MONTO"].sum())
+    got = backend.totals_by_range(desde, hasta)
+    assert got["MONTO"].is_monotonic_decreasing
+    pd.testing.assert_series_equal(got.set_index("CATEGORÍA")["MONTO"].sort_index(),
+                                   by_cat.sort_index(), check_names=False, check_index_type=False)
+
+
+def test_range_totals_with_search_filter_rows(sheets):
+    backend      = gastos.get_backend()
+    desde, hasta = dt.date(2000, 1, 1), gastos.now_peru().date()
+    got = backend.totals_by_range(desde, hasta, "taxi")
+    rows = backend.query_range(desde, hasta, texto="taxi")
+    assert got["MONTO"].sum() == pytest.approx(rows["MONTO"].sum())
+    assert len(rows) < len(gastos.load_data())
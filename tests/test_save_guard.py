@@ -0,0 +1,45 @@
+import datetime as dt
+
+import gastos
+import metrics
+
+
+def _gasto(**kw):
+    return {"date": dt.datetime(2026, 10, 3), "amount": 8.0, "category": "Transporte",
+            "description": "taxi", **kw}
+
+
+def test_same_token_saves_once(sheets):
+    gastos.load_data()
+    first  = gastos.save_to_sheet(_gasto(token="t1"))
+    second = gastos.save_to_sheet(_gasto(token="t1"))
+    assert first == second and first[0]
+    assert sum(r[6] == first[1] for r in sheets._book.sheet1.rows) == 1
+
+
+def test_recent_duplicate_needs_force(sheets):
+    gastos.load_data()
+    assert gastos.save_to_sheet(_gasto())[0]
+    assert gastos.recent_duplicate(_gasto()) is not None
+    assert not gastos.save_to_sheet(_gasto())[0]
+    assert gastos.save_to_sheet(_gasto(force=True))[0]
+
+
+def test_dedup_metric_name():
+    assert "gastos_save_dedup_total" in metrics.render()
+
+
+def test_double_tap_while_saving_is_not_an_error(sheets, monkeypatch):
+    gastos.load_data()
+    real, inner = gastos.get_backend().add_expense, []
+
+    def slow_add(row):
+        # El segundo toque llega mientras el primero sigue en la API
+        inner.append(gastos.save_to_sheet(_gasto(token="t2")))
+        return real(row)
+
+    monkeypatch.setattr(gastos.get_backend(), "add_expense", slow_add)
+    ok, gasto_id = gastos.save_to_sheet(_gasto(token="t2"))
+    assert ok
+    assert inner == [(False, gastos.SAVE_IN_FLIGHT)]
+    assert gastos.save_to_sheet(_gasto(token="t2")) == (True, gasto_id)
@@ -0,0 +1,81 @@
+import gastos
+
+
+def test_snapshot_pairs_value_and_version(sheets):
+    df, version = gastos.load_data.snapshot()
+    assert version == gastos.load_data.version
+    assert len(df) == len(gastos.load_data())
+
+
+def test_patch_bumps_version_and_returns_it(sheets):
+    _, before = gastos.load_data.snapshot()
+    after = gastos.load_data.patch(lambda df: df.iloc[1:])
+    assert after == before + 1 == gastos.load_data.version
+    assert len(gastos.load_data()) == 299
+
+
+def test_patch_without_value_is_noop(sheets):
+    gastos.load_data.clear()
+    assert gastos.load_data.patch(lambda df: df.iloc[1:]) is None
+
+
+def test_clear_bumps_version_and_reload_keeps_it(sheets):
+    _, before = gastos.load_data.snapshot()
+    gastos.load_data.clear()
+    _, after = gastos.load_data.snapshot()
+    assert after == before + 1
+
+
+def test_refresh_after_clear_is_discarded(sheets):
+    slot = gastos.load_data._slot
+    version = slot["version"]
+    gastos.load_data.clear()
+    gastos.load_data._refresh(slot, version)
+    assert slot["fetched_at"] is None
+
+
+def test_index_skips_patch_when_stale(sheets):
+    idx = gastos.get_category_stats()
+    # Dos writes; el primero no llegó a parchar el índice: el segundo
+    # no debe aplicarse sobre un índice al que le falta el primero
+    gastos.load_data.patch(lambda df: df)
+    after, applied = gastos.load_data.patch(lambda df: df), []
+    gastos._patch_index("cat_stats", after, applied.append)
+    assert applied == []
+    assert gastos.get_category_stats() is not idx
+
+
+def test_index_patch_in_order_keeps_it(sheets):
+    idx = gastos.get_category_stats()
+    after, applied = gastos.load_data.patch(lambda df: df), []
+    gastos._patch_index("cat_stats", after, applied.append)
+    assert applied == [idx]
+    assert gastos.get_category_stats() is idx
+
+
+def test_failed_first_load_is_not_cached(sheets, monkeypatch):
+    real, calls = gastos.get_backend().load_all, []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("Sheets caído")
+        return real()
+
+    monkeypatch.setattr(gastos.get_backend(), "load_all", flaky)
+    empty, v_empty = gastos.load_data.snapshot()
+    assert empty.empty
+    # Lo que llegue mientras tanto no se aplica sobre el vacío
+    assert gastos.load_data.patch(lambda df: df) is None
+    assert gastos.days_with_expense_streak() == 0
+
+    # Dentro del backoff no se martilla a Sheets
+    assert gastos.load_data().empty and len(calls) == 1
+
+    gastos.load_data._slot["retry_at"] = 0.0
+    df, v_ok = gastos.load_data.snapshot()
+    assert len(df) == 300 and len(calls) == 2
+    assert v_ok != v_empty
+    # Los índices armados sobre el vacío no sobreviven a la carga buena
+    assert gastos.get_streak_index().longest > 0
+    assert gastos.load_data.patch(lambda d: d) == v_ok + 1
@@ -0,0 +1,61 @@
+import os
+import sys
+import pathlib
+import threading
+import subprocess
+import contextvars
+import datetime as dt
+
+import gastos
+
+
+def _gasto(**kw):
+    return {"date": dt.datetime(2026, 10, 3), "amount": 12.5, "category": "Ocio",
+            "description": "cine", **kw}
+
+
+def test_pull_during_push_does_not_duplicate(local, monkeypatch):
+    backend = gastos.get_backend()
+    ok, gasto_id = gastos.save_to_sheet(_gasto())
+    assert ok
+
+    # Un pull en primer plano justo entre el append a Sheets y el ack
+    real, pulls = gastos._sheet_append, []
+
+    def append_then_pull(row):
+        real(row)
+        t = threading.Thread(target=contextvars.copy_context().run, args=(backend.sync.pull,))
+        t.start()
+        t.join(0.3)
+        pulls.append(t)
+
+    monkeypatch.setattr(gastos, "_sheet_append", append_then_pull)
+    assert backend.sync.push() == 1
+    pulls[0].join()
+
+    assert backend.pending() == []
+    assert (backend.load_ledger()["ID"] == gasto_id).sum() == 1
+    assert sum(r[6] == gasto_id for r in local._book.sheet1.rows) == 1
+
+
+def test_push_replays_outbox_in_order(local):
+    backend = gastos.get_backend()
+    ok, gasto_id = gastos.save_to_sheet(_gasto())
+    assert gastos.update_expense(gasto_id, _gasto(amount=20.0)) == (True, "OK")
+    assert backend.sync.push() == 2
+    row = next(r for r in local._book.sheet1.rows if r[6] == gasto_id)
+    assert row[5] == 20.0
+
+
+def test_sheets_is_the_default_backend():
+    env = {k: v for k, v in os.environ.items() if k != "GASTOS_BACKEND"}
+    out = subprocess.run([sys.executable, "-c", "import gastos; print(gastos.STORAGE_BACKEND)"],
+                         cwd=pathlib.Path(gastos.__file__).parent, env=env,
+                         capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "sheets"
+
+
+def test_sheets_backend_writes_through(sheets):
+    assert isinstance(gastos.get_backend(), gastos.SheetsBackend)
+    ok, gasto_id = gastos.save_to_sheet(_gasto())
+    assert ok and any(r[6] == gasto_id for r in sheets._book.sheet1.rows)
@@ -0,0 +1,50 @@
+import pandas as pd
+
+import gastos
+
+
+def _declared():
+    return gastos._tenant_state()["nbytes"]
+
+
+def test_every_tenant_structure_is_accounted(sheets):
+    today = gastos.now_peru().date()
+    mes   = gastos.MESES_ORD[today.month - 1]
+    gastos.get_streak_index()
+    gastos.get_category_stats()
+    gastos.get_ledger_index()
+    gastos.get_budget_matrix()
+    gastos.get_month(today.year, mes)
+    assert gastos.save_to_sheet({"date": today, "amount": 3.0, "category": "Ocio",
+                                 "description": "helado"})[0]
+    sizes = _declared()
+    for name in ("load_data", "load_budgets", "streak", "cat_stats", "ledger_index",
+                 "analytics", "budget_matrix", "rows", "prefetch", "save_guard"):
+        assert sizes.get(name, 0) > 0, name
+    # Las estructuras grandes pesan de verdad, no un tamaño de cabecera
+    assert sizes["ledger_index"] > sizes["load_data"] / 2
+    assert sizes["rows"] > 300 * 50
+
+
+def test_frozen_partitions_are_accounted(sheets):
+    gastos.load_data()
+    gastos.migrate_to_partitions()
+    gastos.load_data.clear()
+    gastos.load_data()
+    assert gastos._frozen()
+    assert _declared()["frozen"] > 0
+
+
+def test_nbytes_walks_indexes():
+    empty = gastos.StreakIndex(gastos._empty_ledger()["FECHA"])
+    full  = gastos.StreakIndex(pd.Series(pd.date_range("2020-01-01", periods=500)))
+    assert gastos._nbytes(full) > gastos._nbytes(empty) + 500 * 50
+
+
+def test_eviction_uses_the_full_estimate(sheets):
+    gastos.get_ledger_index()
+    reg   = gastos._tenant_registry()
+    reg.max_bytes = reg.total_bytes() + 1
+    gastos.use_tenant(gastos.Tenant("otro", "Otro", "Otro"))
+    gastos.get_ledger_index()
+    assert list(reg._states) == ["otro"]
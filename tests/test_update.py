@@ -0,0 +1,61 @@
+import datetime as dt
+
+import gastos
+
+
+def _gasto(**kw):
+    return {"date": dt.datetime(2026, 10, 3), "amount": 77.0, "category": "Salud",
+            "description": "farmacia", **kw}
+
+
+def _row(book, gasto_id):
+    return next(r for r in book._book.sheet1.rows if r[6] == gasto_id)
+
+
+def test_update_writes_only_changed_cells(sheets):
+    gastos.load_data()
+    before = list(_row(sheets, "lt000009"))
+    assert gastos.update_expense("lt000009", _gasto()) == (True, "OK")
+    after = _row(sheets, "lt000009")
+    assert after[5] == 77.0 and after[3] == "Salud" and after[6] == before[6]
+
+
+def test_update_after_external_delete_hits_the_right_row(sheets):
+    gastos.load_data()                      # el índice de filas queda armado
+    neighbour = list(_row(sheets, "lt00000a"))
+    del sheets._book.sheet1.rows[3]         # alguien borra la fila 4 desde Sheets
+    assert gastos.update_expense("lt000009", _gasto()) == (True, "OK")
+    assert _row(sheets, "lt00000a") == neighbour
+    assert _row(sheets, "lt000009")[5] == 77.0
+
+
+def test_update_of_externally_deleted_row_is_not_found(sheets):
+    gastos.load_data()
+    rows   = sheets._book.sheet1.rows
+    gone   = rows.pop(10)[6]                # la fila del gasto ya no está
+    before = [list(r) for r in rows]
+    ok, _  = gastos.update_expense(gone, _gasto())
+    assert not ok
+    assert rows == before
+
+
+def test_push_replay_after_external_delete(local):
+    backend   = gastos.get_backend()
+    neighbour = list(_row(local, "lt00000a"))
+    assert gastos.update_expense("lt000009", _gasto()) == (True, "OK")
+    del local._book.sheet1.rows[3]
+    assert backend.sync.push() == 1
+    assert _row(local, "lt00000a") == neighbour
+    assert _row(local, "lt000009")[5] == 77.0
+
+
+def test_update_request_count(sheets):
+    gastos.load_data()
+    calls = sheets.calls
+    assert gastos.update_expense("lt000009", _gasto()) == (True, "OK")
+    assert sheets.calls - calls == 2        # celda ID + batch_update
+    del sheets._book.sheet1.rows[3]
+    calls = sheets.calls
+    assert gastos.update_expense("lt00000b", _gasto(amount=1.0)) == (True, "OK")
+    assert sheets.calls - calls == 3        # + relectura de la hoja
+